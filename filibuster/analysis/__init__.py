@@ -103,6 +103,30 @@ def add_python_requests_exceptions():
         instrumentation['python.requests']['exceptions'].append({'name': 'requests.exceptions.UnrewindableBodyError'})
 
 
+def add_python_aiohttp_exceptions():
+    # Setup.
+    instrumentation['python.aiohttp'] = {}
+    instrumentation['python.aiohttp']['pattern'] = "aiohttp\\.(get|put|post|head)"
+    instrumentation['python.aiohttp']['exceptions'] = []
+
+    # Base exceptions.
+    instrumentation['python.aiohttp']['exceptions'].append({'name': 'aiohttp.ClientConnectionError'})
+    instrumentation['python.aiohttp']['exceptions'].append(
+        {'name': 'aiohttp.ServerTimeoutError', 'restrictions': 'timeout'})
+
+
+def add_python_httpx_exceptions():
+    # Setup.
+    instrumentation['python.httpx'] = {}
+    instrumentation['python.httpx']['pattern'] = "httpx\\.(get|put|post|head)"
+    instrumentation['python.httpx']['exceptions'] = []
+
+    # Base exceptions.
+    instrumentation['python.httpx']['exceptions'].append({'name': 'httpx.ConnectError'})
+    instrumentation['python.httpx']['exceptions'].append(
+        {'name': 'httpx.TimeoutException', 'restrictions': 'timeout'})
+
+
 def add_python_grpc_exceptions():
     # Setup.
     instrumentation['python.grpc'] = {}
@@ -324,6 +348,10 @@ def analyze_services_directory(output, directory):
     # Add Python requests callsite exceptions.
     add_python_requests_exceptions()
 
+    # Add Python aiohttp and httpx callsite exceptions.
+    add_python_aiohttp_exceptions()
+    add_python_httpx_exceptions()
+
     # Add Java WebClient callsite exceptions.
     add_java_webclient_exceptions()
 
@@ -336,7 +364,8 @@ def analyze_services_directory(output, directory):
 
     if 'http' not in instrumentation:
         instrumentation['http'] = {}
-        instrumentation['http']['pattern'] = "(((requests\\.(get|put|post|head))|(WebClient\\.(GET|PUT|POST|HEAD))))"
+        instrumentation['http']['pattern'] = \
+            "((((requests|aiohttp|httpx)\\.(get|put|post|head))|(WebClient\\.(GET|PUT|POST|HEAD))))"
 
     if 'grpc' not in instrumentation:
         instrumentation['grpc'] = {}
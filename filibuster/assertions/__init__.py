@@ -1,15 +1,24 @@
-import requests
+import os
 
+from filibuster import control_plane
+from filibuster.instrumentation.reporter import flush as _filibuster_flush
 from filibuster.logger import error
 
 FILIBUSTER_HOST = "127.0.0.1"
 FILIBUSTER_PORT = "5005"
 TIMEOUT = 10
 
+# Either http://host:port or unix://<path to socket>.
+FILIBUSTER_URL = os.environ.get('FILIBUSTER_URL', "http://{}:{}".format(FILIBUSTER_HOST, FILIBUSTER_PORT))
+
 
 def was_fault_injected():
-    uri = "http://{}:{}/filibuster/fault-injected".format(FILIBUSTER_HOST, FILIBUSTER_PORT)
-    response = requests.get(uri, timeout=TIMEOUT)
+    # The server must have seen every call the test made.
+    if not _filibuster_flush():
+        error("Some calls made by the test weren't reported to the Filibuster server.")
+
+    uri = "{}/filibuster/fault-injected".format(FILIBUSTER_URL)
+    response = control_plane.get(uri, timeout=TIMEOUT)
 
     if response.status_code == 200:
         response_json = response.json()
@@ -20,8 +29,12 @@ def was_fault_injected():
 
 
 def was_fault_injected_on(service_name):
-    uri = "http://{}:{}/filibuster/fault-injected/{}".format(FILIBUSTER_HOST, FILIBUSTER_PORT, service_name)
-    response = requests.get(uri, timeout=TIMEOUT)
+    # The server must have seen every call the test made.
+    if not _filibuster_flush():
+        error("Some calls made by the test weren't reported to the Filibuster server.")
+
+    uri = "{}/filibuster/fault-injected/{}".format(FILIBUSTER_URL, service_name)
+    response = control_plane.get(uri, timeout=TIMEOUT)
 
     if response.status_code == 200:
         response_json = response.json()
@@ -0,0 +1,268 @@
+import os
+import json
+import stat
+import select
+import socket
+import asyncio
+import functools
+import threading
+import http.client
+
+from concurrent.futures import ThreadPoolExecutor
+
+from urllib.parse import urlsplit, unquote
+
+# Timeout, in seconds, for calls to the Filibuster server (unset waits indefinitely.)
+if os.environ.get('FILIBUSTER_CONTROL_PLANE_TIMEOUT', ''):
+    CONTROL_PLANE_TIMEOUT = float(os.environ.get('FILIBUSTER_CONTROL_PLANE_TIMEOUT'))
+else:
+    CONTROL_PLANE_TIMEOUT = None
+
+# Maximum number of idle connections kept open to each Filibuster server.
+MAX_IDLE_CONNECTIONS = 16
+
+# Errors raised when reusing a connection the server has already closed.
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+# Methods of the calls that are safe to make again if the server might have already handled them.
+_RETRIED_METHODS = ('GET',)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# Has the server closed this idle connection?  An idle connection is only readable once it has.
+def _closed_by_server(connection):
+    if connection.sock is None:
+        return False
+
+    try:
+        (readable, _, _) = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class ControlPlaneResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# Socket paths already found in unix:// URLs.
+_unix_socket_paths = {}
+
+
+# Split the path of a unix:// URL into the socket path and the request path.
+def _split_unix_path(path):
+    for prefix in _unix_socket_paths:
+        if path == prefix or path.startswith(prefix + '/'):
+            return prefix, path[len(prefix):]
+
+    # The socket path is the first prefix of the path that is a socket.
+    index = path.find('/', 1)
+    while True:
+        prefix = path if index == -1 else path[:index]
+        try:
+            if stat.S_ISSOCK(os.stat(prefix).st_mode):
+                _unix_socket_paths[prefix] = True
+                return prefix, path[len(prefix):]
+        except OSError:
+            pass
+        if index == -1:
+            raise FileNotFoundError("No Unix domain socket found in " + path)
+        index = path.find('/', index + 1)
+
+
+class ControlPlaneClient:
+    """Thread-safe client for calls from instrumentation to the Filibuster server.
+
+    Connections are kept alive and pooled per server, and calls go through http.client
+    directly so they are never seen by the requests instrumentation.  Servers can be
+    reached over TCP (http://host:port) or a Unix domain socket, given either as
+    unix:// followed by the socket path (unix:///tmp/filibuster.sock/filibuster/create) or
+    as http+unix:// followed by the percent-encoded socket path.
+    """
+
+    def __init__(self, timeout=CONTROL_PLANE_TIMEOUT):
+        self.timeout = timeout
+        self.idle_connections = {}
+        self.mutex = threading.Lock()
+
+    def _new_connection(self, scheme, netloc):
+        if scheme == 'http+unix':
+            return _UnixHTTPConnection(unquote(netloc), timeout=self.timeout)
+        elif scheme == 'unix':
+            return _UnixHTTPConnection(netloc, timeout=self.timeout)
+        elif scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _acquire(self, key):
+        with self.mutex:
+            idle = self.idle_connections.get(key, [])
+            while idle:
+                connection = idle.pop()
+                if _closed_by_server(connection):
+                    connection.close()
+                    continue
+                return connection, True
+
+        return self._new_connection(*key), False
+
+    def _release(self, key, connection):
+        with self.mutex:
+            idle = self.idle_connections.setdefault(key, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def request(self, method, url, json_body=None, timeout=None):
+        parsed = urlsplit(url)
+
+        if parsed.scheme == 'unix':
+            (socket_path, path) = _split_unix_path(parsed.path)
+            key = (parsed.scheme, socket_path)
+        else:
+            key = (parsed.scheme, parsed.netloc)
+            path = parsed.path
+
+        path = path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        while True:
+            (connection, reused) = self._acquire(key)
+
+            connection.timeout = timeout if timeout is not None else self.timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(connection.timeout)
+
+            try:
+                connection.request(method, path, body=body, headers=headers)
+            except _STALE_CONNECTION_ERRORS:
+                connection.close()
+                # The server closed an idle connection before it got the request; retry on a new one.
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            try:
+                response = connection.getresponse()
+                content = response.read()
+            except _STALE_CONNECTION_ERRORS:
+                connection.close()
+                # The server may have handled the request before closing the connection, so only
+                # calls without side effects are made again.
+                if reused and method in _RETRIED_METHODS:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+
+            return ControlPlaneResponse(response.status, content)
+
+    def get(self, url, timeout=None):
+        return self.request('GET', url, timeout=timeout)
+
+    def put(self, url, json=None):
+        return self.request('PUT', url, json)
+
+    def post(self, url, json=None):
+        return self.request('POST', url, json)
+
+
+# One client per process; pooled connections can't be shared across fork.
+_client = None
+_client_pid = None
+_client_mutex = threading.Lock()
+
+
+def get_client():
+    global _client
+    global _client_pid
+
+    with _client_mutex:
+        if _client is None or _client_pid != os.getpid():
+            _client = ControlPlaneClient()
+            _client_pid = os.getpid()
+        return _client
+
+
+def get(url, timeout=None):
+    return get_client().get(url, timeout=timeout)
+
+
+def put(url, json=None):
+    return get_client().put(url, json=json)
+
+
+def post(url, json=None):
+    return get_client().post(url, json=json)
+
+
+# Executor running control-plane calls made from asyncio code, so they never block the event loop.
+_executor = None
+_executor_pid = None
+
+
+def get_executor():
+    global _executor
+    global _executor_pid
+
+    with _client_mutex:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=MAX_IDLE_CONNECTIONS,
+                                           thread_name_prefix='filibuster-control-plane')
+            # Not forked by the thread pool instrumentation.
+            _executor.filibuster_internal = True
+            _executor_pid = os.getpid()
+        return _executor
+
+
+# Run a blocking call to the Filibuster server (or a function making one) from asyncio code.
+async def run_async(fn, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def async_get(url, timeout=None):
+    return await run_async(get, url, timeout=timeout)
+
+
+async def async_put(url, json=None):
+    return await run_async(put, url, json=json)
+
+
+async def async_post(url, json=None):
+    return await run_async(post, url, json=json)
@@ -1,5 +1,11 @@
+import hashlib
 import json
 
+# Fields of a log entry that depend on the order in which concurrent calls were made: the
+# server assigns generated ids in arrival order, and services advance their vclock for
+# each call in the order they make them.
+_ORDER_DEPENDENT_LOG_KEYS = ['generated_id', 'vclock', 'origin_vclock']
+
 
 class TestExecution:
     @staticmethod
@@ -44,6 +50,26 @@ class TestExecution:
         te.response_log = loaded_json['response_log']
         return te
 
+    # Identifies a call by its execution index and what it did, so the same calls made concurrently
+    # compare equal however they were ordered.
+    @staticmethod
+    def log_entry_key(entry):
+        return (str(entry.get('execution_index', None)),
+                json.dumps({key: entry[key] for key in entry if key not in _ORDER_DEPENDENT_LOG_KEYS},
+                           sort_keys=True, default=str))
+
+    @staticmethod
+    def failure_key(failure):
+        return str(failure.get('execution_index', None)), json.dumps(failure, sort_keys=True, default=str)
+
+    # Signature of a log entry, failure or response log entry: a hash of its contents.
+    @staticmethod
+    def entry_signature(entry):
+        if entry is None:
+            return None
+
+        return hashlib.md5(json.dumps(entry, sort_keys=True, default=str).encode()).hexdigest()
+
     @staticmethod
     def same_call_as_request_log_call(le, rle):
         return (le['module'] == rle['module']) and \
@@ -68,6 +94,11 @@ class TestExecution:
         for f in failures:
             self.failures.append(TestExecution.filter_request_for_failures(f))
 
+        # Computed when first compared.
+        self._canonical_key = None
+        self._log_entry_keys = None
+        self._response_log_signatures = None
+
         # If this test execution contains actual responses...
         self.response_log = None
 
@@ -139,19 +170,44 @@ class TestExecution:
 
                 self.response_log.append(response_log_entry)
 
+    # The log and failures in canonical order: executions that made the same calls, in any
+    # order concurrent calls allow, with the same failures, have the same key.
+    def canonical_key(self):
+        if self._canonical_key is None:
+            self._canonical_key = (tuple(sorted(TestExecution.log_entry_key(l) for l in self.log)),
+                                   tuple(sorted(TestExecution.failure_key(f) for f in self.failures)))
+        return self._canonical_key
+
+    # Signatures of the response log entries, in order; the response log doesn't change once the test
+    # execution has run, so they're only computed once.
+    def response_log_signatures(self):
+        if self._response_log_signatures is None and self.response_log is not None:
+            self._response_log_signatures = [TestExecution.entry_signature(e) for e in self.response_log]
+        return self._response_log_signatures
+
+    # Was this call (a log entry from any execution) made in this execution?
+    def contains_log_entry(self, entry):
+        if self._log_entry_keys is None:
+            self._log_entry_keys = set(TestExecution.log_entry_key(l) for l in self.log)
+        return TestExecution.log_entry_key(TestExecution.filter_request_for_log(entry)) in self._log_entry_keys
+
     def __eq__(self, other):
         if not isinstance(other, TestExecution):
             # don't attempt to compare against unrelated types
             return NotImplemented
 
-        return self.log == other.log and self.failures == other.failures
+        return self.canonical_key() == other.canonical_key()
 
     def __hash__(self):
         # necessary for instances to behave sanely in dicts and sets.
-        return hash((self.log, self.failures))
+        return hash(self.canonical_key())
 
     def to_json(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+        def serialize(o):
+            return {key: value for (key, value) in o.__dict__.items()
+                    if key not in ('_canonical_key', '_log_entry_keys', '_response_log_signatures')}
+
+        return json.dumps(self, default=serialize, sort_keys=True, indent=4)
 
 
 class ServerState:
@@ -159,3 +215,5 @@ class ServerState:
         self.service_request_log = []
         self.seen_first_request_from_mapping = {}
         self.generated_id_incr = -1
+        self.generated_id_by_client_id = {}
+        self.pending_events_by_client_id = {}
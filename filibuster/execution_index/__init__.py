@@ -1,8 +1,35 @@
 import json
 import os
+import hashlib
+import threading
+
+from filibuster.logger import warning
+
+# Represent execution indexes by a rolling hash of the call path instead of the path itself.
+#
+# Each entry of the callstack is a (digest, parent) pair, where digest is a 128-bit hash of
+# the parent's digest and the (service, count) pushed; pushing and popping are O(1), and the
+# serialized execution index is always 32 hex characters.
+EI_ROLLING_HASH = os.environ.get("EI_ROLLING_HASH", "")
+
+# Remember the path behind every rolling hash seen by this process, to detect collisions.
+EI_ROLLING_HASH_DEBUG = os.environ.get("EI_ROLLING_HASH_DEBUG", "")
+
+# Size, in bytes, of rolling hashes.
+ROLLING_HASH_SIZE = 16
+
+# Callstack of the empty rolling-hash execution index.
+_ROLLING_ROOT = (bytes(ROLLING_HASH_SIZE), None)
+
+# Rolling hash -> (parent hash, service, count), when EI_ROLLING_HASH_DEBUG is set.
+_rolling_hash_paths = {}
+_rolling_hash_paths_mutex = threading.Lock()
 
 
 def execution_index_new():
+    if EI_ROLLING_HASH:
+        return _ROLLING_ROOT, {}
+
     # Don't use an actual stack for the callstack, because
     # it's not JSON serializable -- we need to be able to
     # send this in a HTTP header.
@@ -12,6 +39,22 @@ def execution_index_new():
     return callstack, counters
 
 
+def _rolling_hash_push(callstack, service, count):
+    (parent_digest, parent) = callstack
+    digest = hashlib.blake2b(parent_digest + service.encode() + b'\0' + str(count).encode(),
+                             digest_size=ROLLING_HASH_SIZE).digest()
+
+    if EI_ROLLING_HASH_DEBUG:
+        with _rolling_hash_paths_mutex:
+            entry = (parent_digest, service, count)
+            existing = _rolling_hash_paths.setdefault(digest, entry)
+            if existing != entry:
+                warning("Execution index hash collision: " + digest.hex() + " is both " +
+                        str(existing) + " and " + str(entry))
+
+    return digest, callstack
+
+
 def execution_index_push(service, execution_index):
     if os.environ.get("EI_DISABLE_PATH_INCLUSION", ""):
         (callstack, counters) = execution_index_new()
@@ -26,7 +69,11 @@ def execution_index_push(service, execution_index):
         else:
             counters[service] = 1
 
-    callstack.append((service, counters[service]))
+    if isinstance(callstack, tuple):
+        # Rolling hash: entries are never modified, so this doesn't affect other references.
+        callstack = _rolling_hash_push(callstack, service, counters[service])
+    else:
+        callstack.append((service, counters[service]))
 
     return callstack, counters
 
@@ -44,6 +91,13 @@ def execution_index_pop(execution_index):
     # from a call by our instrumentation.
     #
 
+    if isinstance(callstack, tuple):
+        if callstack[1] is None:
+            # This indicates a double-pop, which is a problem.
+            raise
+
+        return callstack[1], counters
+
     if len(callstack) <= 0:
         # This indicates a double-pop, which is a problem.
         raise
@@ -55,8 +109,22 @@ def execution_index_pop(execution_index):
 
 def execution_index_tostring(execution_index):
     (callstack, counters) = execution_index
+
+    if isinstance(callstack, tuple):
+        return callstack[0].hex()
+
     return json.dumps(callstack)
 
 
+# Is this a serialized rolling-hash execution index?
+def execution_index_is_rolling(serialized):
+    return len(serialized) == 2 * ROLLING_HASH_SIZE and not serialized.startswith('[')
+
+
 def execution_index_fromstring(serialized):
+    if execution_index_is_rolling(serialized):
+        # Everything below the received index belongs to the caller, so it can't be popped.
+        return (bytes.fromhex(serialized), None), {}
+
     return json.loads(serialized), {}
+
@@ -1,14 +1,394 @@
+import os
+import secrets
+import threading
+
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager, DictProxy, AcquirerProxy
+
+from filibuster.logger import warning, debug
+
 _GLOBAL_CONTEXT = {}
 
+# Address ("host:port", or the path of a Unix socket) of a shared state server started with
+# start_shared_state().  When set, the request-scoped maps, shared values and request references
+# are kept by that server, so that every worker process of a pre-fork server sees the same
+# vclocks, execution indexes and last test epoch.
+SHARED_STATE_ADDRESS = os.environ.get('FILIBUSTER_SHARED_STATE_ADDRESS', '')
+
+# Key authenticating connections to the shared state server, which unpickles what it's sent.
+# Generated by start_shared_state() unless given; there is no default.
+SHARED_STATE_AUTHKEY = os.environ.get('FILIBUSTER_SHARED_STATE_AUTHKEY', '')
+
+# Maximum number of requests tracked by each request-scoped map; least recently used
+# requests are dropped first.  Requests are normally released when they complete, this
+# only bounds memory when they aren't (e.g. requests that never reach a service's handler.)
+# Per-request mutexes aren't bounded this way: they're dropped once nobody holds them.
+MAX_REQUEST_SCOPED_ENTRIES = int(os.environ.get('FILIBUSTER_MAX_REQUEST_SCOPED_ENTRIES', '10000'))
+
+# Keys of the request-scoped maps.
+_REQUEST_SCOPED_KEYS = []
+
+# Keys of the values kept by the shared state server, when there is one.
+_SHARED_VALUE_KEYS = []
+
+# Number of inbound requests being handled, by request id.
+_REQUEST_REFERENCES = {}
+_REQUEST_REFERENCES_MUTEX = threading.Lock()
+
+# Mutex for updates spanning several requests (e.g. resetting every request on a new test epoch.)
+_GLOBAL_MUTEX = threading.RLock()
+
+
+class RequestScopedMap(OrderedDict):
+    """Map from request id to state kept while a request is being handled, bounded by
+    MAX_REQUEST_SCOPED_ENTRIES."""
+
+    def __init__(self, *args, **kwargs):
+        self.mutex = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        with self.mutex:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def get(self, key, default=None):
+        with self.mutex:
+            if key in self:
+                return self[key]
+            return default
+
+    def __setitem__(self, key, value):
+        with self.mutex:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > MAX_REQUEST_SCOPED_ENTRIES:
+                self.popitem(last=False)
+
+    def pop(self, key, *default):
+        with self.mutex:
+            return super().pop(key, *default)
+
+    def clear(self):
+        with self.mutex:
+            super().clear()
+
+
+class RequestLocks:
+    """Mutexes guarding the request-scoped state of each request id.
+
+    A request id's mutex is kept only while a thread holds or waits for it, so it's never
+    dropped from under a thread, however long the request takes or however many requests
+    there are."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # Request id -> [mutex, number of threads holding or waiting for it].
+        self.locks = {}
+
+    def acquire(self, request_id):
+        with self.mutex:
+            entry = self.locks.get(request_id, None)
+            if entry is None:
+                entry = [threading.Lock(), 0]
+                self.locks[request_id] = entry
+            entry[1] += 1
+
+        entry[0].acquire()
+
+    def release(self, request_id):
+        with self.mutex:
+            entry = self.locks[request_id]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[request_id]
+
+    def __len__(self):
+        with self.mutex:
+            return len(self.locks)
+
+
+class _SharedState:
+    """State kept by the shared state server for every worker process."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.maps = {}
+        self.values = {}
+        self.references = {}
+        self.request_locks = RequestLocks()
+        self.global_mutex = threading.Lock()
+
+    def request_scoped_map(self, key):
+        with self.mutex:
+            if key not in self.maps:
+                self.maps[key] = RequestScopedMap()
+            return self.maps[key]
+
+    # The manager serves each thread of a worker on a thread of its own, so waiting here only
+    # blocks the calling thread.
+    def acquire_request_mutex(self, request_id):
+        self.request_locks.acquire(request_id)
+
+    def release_request_mutex(self, request_id):
+        self.request_locks.release(request_id)
+
+    def get_value(self, key):
+        return self.values.get(key, None)
+
+    def set_value(self, key, value):
+        self.values[key] = value
+
+    def acquire_request(self, request_id):
+        with self.mutex:
+            self.references[request_id] = self.references.get(request_id, 0) + 1
+
+    # Returns whether the request id was released by every worker process.
+    def release_request(self, request_id):
+        with self.mutex:
+            references = self.references.get(request_id, 0) - 1
+            if references > 0:
+                self.references[request_id] = references
+                return False
+            self.references.pop(request_id, None)
+
+            for by_request in self.maps.values():
+                by_request.pop(request_id, None)
+            return True
+
+
+_SHARED_STATE = None
+
+
+def _shared_state():
+    global _SHARED_STATE
+    if _SHARED_STATE is None:
+        _SHARED_STATE = _SharedState()
+    return _SHARED_STATE
+
+
+def _shared_request_scoped_map(key):
+    return _shared_state().request_scoped_map(key)
+
+
+def _shared_global_mutex():
+    return _shared_state().global_mutex
+
+
+class _SharedStateManager(BaseManager):
+    pass
+
+
+_SharedStateManager.register('state', callable=_shared_state,
+                             exposed=('get_value', 'set_value', 'acquire_request', 'release_request',
+                                      'acquire_request_mutex', 'release_request_mutex'))
+_SharedStateManager.register('request_scoped_map', callable=_shared_request_scoped_map, proxytype=DictProxy)
+_SharedStateManager.register('global_mutex', callable=_shared_global_mutex, proxytype=AcquirerProxy)
+
+
+def _shared_state_address():
+    (host, _, port) = SHARED_STATE_ADDRESS.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return SHARED_STATE_ADDRESS
+
+
+def _shared_state_manager():
+    return _SharedStateManager(address=_shared_state_address(), authkey=SHARED_STATE_AUTHKEY.encode())
+
+
+def start_shared_state():
+    """Start the shared state server at FILIBUSTER_SHARED_STATE_ADDRESS, in a new process.
+
+    Call this in the parent process of a pre-fork server before it starts its workers (e.g. from
+    gunicorn's on_starting hook); the server is shut down when the returned manager is, or
+    when the calling process exits.
+
+    Unless FILIBUSTER_SHARED_STATE_AUTHKEY is set, a random key is generated and passed to the
+    workers, forked or started afterwards, through this process and its environment."""
+
+    global SHARED_STATE_AUTHKEY
+    if not SHARED_STATE_AUTHKEY:
+        SHARED_STATE_AUTHKEY = secrets.token_hex(32)
+        os.environ['FILIBUSTER_SHARED_STATE_AUTHKEY'] = SHARED_STATE_AUTHKEY
+
+    manager = _shared_state_manager()
+    manager.start()
+    return manager
+
+
+class _SharedStateClient:
+    """Connection of this process to the shared state server, and the proxies it uses."""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.state = manager.state()
+        self.global_mutex = manager.global_mutex()
+        self.maps = {}
+        self.mutex = threading.Lock()
+
+    def request_scoped_map(self, key):
+        with self.mutex:
+            if key not in self.maps:
+                self.maps[key] = self.manager.request_scoped_map(key)
+            return self.maps[key]
+
+
+# Connected lazily, so that the parent process of a pre-fork server, which only imports the
+# instrumentation, never connects and forked workers each open their own connection;
+# False if there's no shared state server.
+_SHARED_STATE_CLIENT = None
+_SHARED_STATE_CLIENT_MUTEX = threading.Lock()
+
+
+def _shared_state_client():
+    global _SHARED_STATE_CLIENT
+    if _SHARED_STATE_CLIENT is not None:
+        return _SHARED_STATE_CLIENT
+
+    with _SHARED_STATE_CLIENT_MUTEX:
+        if _SHARED_STATE_CLIENT is None:
+            _SHARED_STATE_CLIENT = False
+            if SHARED_STATE_ADDRESS and not SHARED_STATE_AUTHKEY:
+                warning("No key for the shared state server at " + SHARED_STATE_ADDRESS + " (start it with "
+                        "start_shared_state() or set FILIBUSTER_SHARED_STATE_AUTHKEY), keeping state in this "
+                        "process.")
+            elif SHARED_STATE_ADDRESS:
+                try:
+                    manager = _shared_state_manager()
+                    manager.connect()
+                    _SHARED_STATE_CLIENT = _SharedStateClient(manager)
+                    debug("Connected to shared state server at " + SHARED_STATE_ADDRESS + ".")
+                except Exception as e:
+                    warning("Couldn't connect to shared state server at " + SHARED_STATE_ADDRESS +
+                            ", keeping state in this process: " + str(e))
+        return _SHARED_STATE_CLIENT
+
+
+def _reset_shared_state_client():
+    global _SHARED_STATE_CLIENT
+    _SHARED_STATE_CLIENT = None
+
+
+# Connections to the shared state server can't be shared with forked processes.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared_state_client)
+
 
 def set_value(key, value):
     global _GLOBAL_CONTEXT
+    if key in _SHARED_VALUE_KEYS or key in _REQUEST_SCOPED_KEYS:
+        client = _shared_state_client()
+        if client:
+            # Request-scoped maps are updated in place.
+            if key in _SHARED_VALUE_KEYS:
+                client.state.set_value(key, value)
+            return
     _GLOBAL_CONTEXT[key] = value
 
 
 def get_value(key):
     global _GLOBAL_CONTEXT
+    if key in _SHARED_VALUE_KEYS or key in _REQUEST_SCOPED_KEYS:
+        client = _shared_state_client()
+        if client:
+            if key in _SHARED_VALUE_KEYS:
+                return client.state.get_value(key)
+            return client.request_scoped_map(key)
     if key in _GLOBAL_CONTEXT:
         return _GLOBAL_CONTEXT[key]
     else:
         return None
+
+
+# Keep the value stored under key in the shared state server, when there is one.
+def share_value(key):
+    if key not in _SHARED_VALUE_KEYS:
+        _SHARED_VALUE_KEYS.append(key)
+
+
+# Mutex for updates spanning several requests; shared by every worker process when there's a
+# shared state server.
+def global_mutex():
+    client = _shared_state_client()
+    if client:
+        return client.global_mutex
+    return _GLOBAL_MUTEX
+
+
+# Create the request-scoped map stored under key, unless it already exists.
+def set_request_scoped_map(key):
+    global _GLOBAL_CONTEXT
+    if not isinstance(_GLOBAL_CONTEXT.get(key, None), RequestScopedMap):
+        _GLOBAL_CONTEXT[key] = RequestScopedMap()
+    if key not in _REQUEST_SCOPED_KEYS:
+        _REQUEST_SCOPED_KEYS.append(key)
+
+
+class RequestMutex:
+    """Mutex guarding the request-scoped state of a single request id."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+
+    def acquire(self):
+        client = _shared_state_client()
+        if client:
+            client.state.acquire_request_mutex(self.request_id)
+        else:
+            _REQUEST_LOCKS.acquire(self.request_id)
+        return True
+
+    def release(self):
+        client = _shared_state_client()
+        if client:
+            client.state.release_request_mutex(self.request_id)
+        else:
+            _REQUEST_LOCKS.release(self.request_id)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+# Mutexes of the requests being handled by this process, when there's no shared state server.
+_REQUEST_LOCKS = RequestLocks()
+
+
+def request_mutex(request_id):
+    return RequestMutex(request_id)
+
+
+# Called when a service starts handling an inbound request.
+def acquire_request(request_id):
+    client = _shared_state_client()
+    if client:
+        client.state.acquire_request(request_id)
+        return
+
+    with _REQUEST_REFERENCES_MUTEX:
+        _REQUEST_REFERENCES[request_id] = _REQUEST_REFERENCES.get(request_id, 0) + 1
+
+
+# Called when a service is done handling an inbound request; once every inbound request with
+# this request id is done, its entries are removed from the request-scoped maps.
+def release_request(request_id):
+    client = _shared_state_client()
+    if client:
+        client.state.release_request(request_id)
+        return
+
+    with _REQUEST_REFERENCES_MUTEX:
+        references = _REQUEST_REFERENCES.get(request_id, 0) - 1
+        if references > 0:
+            _REQUEST_REFERENCES[request_id] = references
+            return
+        _REQUEST_REFERENCES.pop(request_id, None)
+
+        for key in _REQUEST_SCOPED_KEYS:
+            _GLOBAL_CONTEXT[key].pop(request_id, None)
+
@@ -0,0 +1,334 @@
+"""Instrumentation shared by the asyncio HTTP clients (aiohttp, httpx.)
+
+The context of the inbound request is read from the incoming contextvar (see
+filibuster.instrumentation.helpers) instead of the OpenTelemetry context, and calls to the
+Filibuster server, and updates of request-scoped state that may wait on other worker processes,
+are made off the event loop.  Tasks created while handling a request fork
+its execution index (see filibuster.instrumentation.forking.)
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+from filibuster import control_plane
+from filibuster.datatypes import TestExecution
+from filibuster.execution_index import execution_index_new, execution_index_push, execution_index_tostring, \
+    execution_index_pop
+from filibuster.global_context import get_value as _filibuster_global_context_get_value
+from filibuster.global_context import set_request_scoped_map as _filibuster_global_context_set_request_scoped_map
+from filibuster.global_context import request_mutex as _filibuster_global_context_request_mutex
+from filibuster.instrumentation.helpers import get_full_traceback_hash, counterexample_file, \
+    should_load_counterexample_file, observe_test_epoch, get_incoming_context
+from filibuster.instrumentation.reporter import report_async as _filibuster_report_async
+from filibuster.instrumentation.failure_plan import get_failure_plan_async, resolve_test_epoch_async, decide, \
+    new_generated_id
+from filibuster.instrumentation.exception_registry import exception_class as _filibuster_exception_class, \
+    preload as _filibuster_preload_exceptions
+from filibuster.instrumentation.forking import request_execution_index, current_fork, fork_path
+from filibuster.instrumentation.propagation import http_headers as _filibuster_http_headers
+from filibuster.logger import notice, warning, debug
+from filibuster.nginx_http_special_response import get_response
+from filibuster.server_helpers import should_fail_request_with, load_counterexample
+from filibuster.vclock import vclock_new, vclock_merge, vclock_fromstring, vclock_increment, vclock_todict
+
+# Key for Filibuster vclock mapping.
+_FILIBUSTER_VCLOCK_BY_REQUEST_KEY = "filibuster_vclock_by_request"
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+
+# Key for Filibuster execution index mapping.
+_FILIBUSTER_EI_BY_REQUEST_KEY = "filibuster_execution_indices_by_request"
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_EI_BY_REQUEST_KEY)
+
+# Configuration is resolved once, rather than on every call.
+_SERVER_COMMUNICATION_DISABLED = bool(os.environ.get('DISABLE_SERVER_COMMUNICATION', ''))
+_PRETTY_EXECUTION_INDEXES = bool(os.environ.get("PRETTY_EXECUTION_INDEXES", ""))
+_SET_ERROR_CONTENT = bool(os.environ.get('SET_ERROR_CONTENT', ''))
+
+if should_load_counterexample_file():
+    notice("Counterexample file present!")
+    counterexample = load_counterexample(counterexample_file())
+    counterexample_test_execution = TestExecution.from_json(counterexample['TestExecution']) if counterexample else None
+    if counterexample_test_execution is not None:
+        _filibuster_preload_exceptions(counterexample_test_execution.failures)
+else:
+    counterexample = None
+    counterexample_test_execution = None
+
+
+def _incoming_field(incoming, field):
+    if incoming is None:
+        return None
+    return incoming.get(field, None)
+
+
+def _server_communication_enabled():
+    return not _SERVER_COMMUNICATION_DISABLED and counterexample is None
+
+
+# For a given request, return a unique hash that can be used to identify it.
+def unique_request_hash(args):
+    hash_string = "-".join(args)
+    hex_digest = hashlib.md5(hash_string.encode()).hexdigest()
+    return hex_digest
+
+
+# Advance the vclock and execution index of the current task for a new call, after resetting them if
+# the call belongs to a new test execution.  Blocks on the request's mutex, which may be held by
+# another thread or worker process: run it off the event loop.
+def _advance(incoming, request_id_string, fork, test_epoch, execution_index_hash):
+    service_name = _filibuster_global_context_get_value("filibuster_service_name")
+
+    observe_test_epoch(test_epoch)
+
+    with _filibuster_global_context_request_mutex(request_id_string):
+        vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+        local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
+
+        incoming_vclock_string = _incoming_field(incoming, 'vclock')
+        if incoming_vclock_string is not None:
+            local_vclock = vclock_merge(vclock_fromstring(incoming_vclock_string), local_vclock)
+
+        vclock = vclock_increment(local_vclock, service_name)
+        vclocks_by_request[request_id_string] = vclock
+
+        if fork is None:
+            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+            execution_indices_by_request[request_id_string] = execution_index_push(
+                execution_index_hash, request_execution_index(incoming, request_id_string))
+            execution_index = execution_index_tostring(execution_indices_by_request[request_id_string])
+        else:
+            fork.execution_index = execution_index_push(execution_index_hash, fork.execution_index)
+            execution_index = execution_index_tostring(fork.execution_index)
+
+    return vclock, execution_index
+
+
+# Remove the call that just completed from the execution index of the current task.  Like _advance,
+# run it off the event loop.
+def _pop_execution_index(request_id_string, fork):
+    with _filibuster_global_context_request_mutex(request_id_string):
+        if fork is None:
+            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+            execution_index = execution_indices_by_request.get(request_id_string, None)
+
+            # Reset by a new test execution, or dropped, while the call was in flight: nothing to pop.
+            if execution_index is None:
+                debug("No execution index to pop for request " + str(request_id_string) + ".")
+                return
+
+            execution_indices_by_request[request_id_string] = execution_index_pop(execution_index)
+        else:
+            fork.execution_index = execution_index_pop(fork.execution_index)
+
+
+def _execution_index_hash(full_traceback_hash, module, method, url, fork):
+    if _PRETTY_EXECUTION_INDEXES:
+        if fork is not None:
+            return url + " " + fork_path(fork)
+        return url
+
+    # Remove host information, as the requests instrumentation does.
+    url = url.replace('http://', '')
+    if ":" in url:
+        url = url.split(":", 1)[1]
+
+    args = [full_traceback_hash, module, method, json.dumps(url)]
+    if fork is not None:
+        args.append(fork_path(fork))
+    return unique_request_hash(args)
+
+
+def _injected_exception(name):
+    return _filibuster_exception_class(name)("Filibuster injected fault.")
+
+
+def _exception_name(exception):
+    return re.findall(r"'(.*?)'", str(type(exception)), re.DOTALL)[0]
+
+
+async def instrumented_call(module, method, url, metadata, send, fake_response, response_summary):
+    """Make a call with an asyncio HTTP client, injecting the fault the failure plan asks for.
+
+    send(additional_headers) makes the actual call; fake_response(status_code, content, result)
+    builds the response returned for an injected status code (result is the actual response,
+    or None if the call was not made); response_summary(result) returns the status code and
+    body of a response.
+    """
+
+    service_name = _filibuster_global_context_get_value("filibuster_service_name")
+    filibuster_url = _filibuster_global_context_get_value("filibuster_url")
+
+    method = method.lower()
+    url = str(url)
+
+    debug("instrumented_call entering; module: " + module + " method: " + method + " url: " + url)
+
+    incoming = get_incoming_context()
+    request_id_string = _incoming_field(incoming, 'request_id')
+    test_epoch = _incoming_field(incoming, 'test_epoch')
+    fork = current_fork(request_id_string)
+
+    callsite_file, callsite_line, full_traceback_hash = get_full_traceback_hash(service_name)
+
+    # Calls not triggered by an instrumented request (e.g. from the test) get the test execution
+    # they belong to from the failure plan, before their vclock and execution index advance.
+    if _server_communication_enabled():
+        test_epoch = await resolve_test_epoch_async(filibuster_url, test_epoch)
+
+    execution_index_hash = _execution_index_hash(full_traceback_hash, module, method, url, fork)
+    (vclock, execution_index) = await control_plane.run_async(
+        _advance, incoming, request_id_string, fork, test_epoch, execution_index_hash)
+
+    incoming_origin_vclock_string = _incoming_field(incoming, 'origin_vclock')
+    if incoming_origin_vclock_string is not None:
+        incoming_origin_vclock = vclock_fromstring(incoming_origin_vclock_string)
+    else:
+        incoming_origin_vclock = vclock_new()
+
+    notice("clock now: " + str(vclock))
+    notice("execution index now: " + str(execution_index))
+
+    response = None
+    generated_id = None
+    has_execution_index = False
+    exception = None
+    status_code = None
+    should_inject_fault = False
+    should_abort = True
+    should_sleep_interval = 0
+
+    payload = {
+        'instrumentation_type': 'invocation',
+        'source_service_name': service_name,
+        'module': module,
+        'method': method,
+        'args': [url],
+        'kwargs': {},
+        'callsite_file': callsite_file,
+        'callsite_line': callsite_line,
+        'full_traceback': full_traceback_hash,
+        'metadata': metadata,
+        'vclock': vclock_todict(vclock),
+        'origin_vclock': vclock_todict(incoming_origin_vclock),
+        'execution_index': execution_index
+    }
+
+    try:
+        if counterexample is not None and counterexample_test_execution is not None:
+            notice("Using counterexample without contacting server.")
+            response = should_fail_request_with(payload, counterexample_test_execution.failures)
+            if response is None:
+                response = {'execution_index': execution_index}
+        elif _SERVER_COMMUNICATION_DISABLED:
+            warning("Server communication disabled.")
+        else:
+            # Decide locally using the failure plan for this test execution and notify the server.
+            failure_plan = await get_failure_plan_async(filibuster_url, test_epoch)
+            if failure_plan is not None:
+                generated_id = new_generated_id()
+                payload['client_generated_id'] = generated_id
+                payload['parent_generated_id'] = _incoming_field(incoming, 'generated_id')
+                payload['test_epoch'] = failure_plan['test_epoch']
+                await _filibuster_report_async(filibuster_url, payload)
+                response = decide(failure_plan, generated_id, payload)
+    except Exception as e:
+        warning("Exception raised (instrumented_call)!")
+        print(e, file=sys.stderr)
+
+    if response is not None:
+        if 'generated_id' in response:
+            generated_id = response['generated_id']
+
+        if 'execution_index' in response:
+            has_execution_index = True
+
+        if 'forced_exception' in response:
+            exception = response['forced_exception']['name']
+            exception_metadata = response['forced_exception'].get('metadata', None) or {}
+            if exception_metadata.get('abort', None) is not None:
+                should_abort = exception_metadata['abort']
+            if exception_metadata.get('sleep', None) is not None:
+                should_sleep_interval = exception_metadata['sleep']
+            should_inject_fault = True
+
+        if 'failure_metadata' in response:
+            return_value = response['failure_metadata'].get('return_value', {})
+            if 'status_code' in return_value:
+                status_code = return_value['status_code']
+                should_inject_fault = True
+
+    result = None
+
+    try:
+        if not has_execution_index:
+            result = await send({})
+        elif not should_inject_fault or not should_abort:
+            # Propagate vclock and origin vclock forward.
+            result = await send(_filibuster_http_headers(generated_id, vclock, vclock, execution_index,
+                                                         request_id_string, test_epoch,
+                                                         should_sleep_interval if should_inject_fault else None))
+    except Exception as exc:
+        exception = exc
+    finally:
+        await control_plane.run_async(_pop_execution_index, request_id_string, fork)
+
+    if exception is not None:
+        if isinstance(exception, str):
+            exception_name = exception
+            exception = _injected_exception(exception)
+        else:
+            exception_name = _exception_name(exception)
+
+        debug("=> exception: " + str(exception))
+
+        # Notify the filibuster server of the actual exception we encountered.
+        if generated_id is not None and _server_communication_enabled():
+            payload = {
+                'instrumentation_type': 'invocation_complete',
+                'generated_id': generated_id,
+                'execution_index': execution_index,
+                'vclock': vclock_todict(vclock),
+                'exception': {
+                    'name': exception_name,
+                    'metadata': {}
+                }
+            }
+
+            if should_sleep_interval > 0:
+                payload['exception']['metadata']['sleep'] = should_sleep_interval
+
+            if should_abort is not True:
+                payload['exception']['metadata']['abort'] = should_abort
+
+            await _filibuster_report_async(filibuster_url, payload)
+
+        raise exception
+
+    if status_code is not None:
+        # Get the default response for the status code.
+        content = ''
+        if _SET_ERROR_CONTENT:
+            content = get_response(status_code)
+        result = fake_response(int(status_code), content.encode(), result)
+
+    # Notify the filibuster server of the actual response.
+    if generated_id is not None and _server_communication_enabled():
+        (result_status_code, result_content) = await response_summary(result)
+        payload = {
+            'instrumentation_type': 'invocation_complete',
+            'generated_id': generated_id,
+            'execution_index': execution_index,
+            'vclock': vclock_todict(vclock),
+            'return_value': {
+                '__class__': str(result.__class__.__name__),
+                'status_code': str(result_status_code),
+                'text': hashlib.md5(result_content).hexdigest()
+            }
+        }
+        await _filibuster_report_async(filibuster_url, payload)
+
+    debug("instrumented_call exiting; module: " + module + " method: " + method + " url: " + url)
+    return result
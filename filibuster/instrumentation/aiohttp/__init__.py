@@ -0,0 +1,147 @@
+"""
+Instrument aiohttp client sessions.
+
+Usage::
+
+    AiohttpInstrumentor().instrument(service_name=..., filibuster_url=...)
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            ...
+
+"""
+
+import os
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from wrapt import wrap_function_wrapper as _wrap
+from yarl import URL
+
+from opentelemetry.instrumentation.instrumentor import BaseInstrumentor
+from opentelemetry.instrumentation.utils import unwrap
+
+from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.instrumentation.aio import instrumented_call
+from filibuster.instrumentation.forking import instrument_task_creation, uninstrument_task_creation
+from filibuster.instrumentation.helpers import should_passthrough
+from filibuster.logger import debug
+
+
+class _InjectedResponse:
+    """Response returned, instead of making the call, when a status code is injected."""
+
+    def __init__(self, method, url, status, content):
+        self.method = method
+        self.url = URL(str(url))
+        self.real_url = self.url
+        self.status = status
+        self.reason = None
+        self.headers = CIMultiDictProxy(CIMultiDict({'Content-Type': 'text/html'}))
+        self.request_info = aiohttp.RequestInfo(self.url, method, CIMultiDictProxy(CIMultiDict()), self.url)
+        self.history = ()
+        self.closed = True
+        self.ok = status < 400
+        self._content = content
+
+    async def read(self):
+        return self._content
+
+    async def text(self, encoding=None, errors='strict'):
+        return self._content.decode(encoding or 'utf-8', errors)
+
+    async def json(self, **kwargs):
+        raise aiohttp.ContentTypeError(self.request_info, self.history, status=self.status,
+                                       message="Attempt to decode JSON with unexpected mimetype: text/html")
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise aiohttp.ClientResponseError(self.request_info, self.history, status=self.status,
+                                              message=str(self.reason), headers=self.headers)
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_for_close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+def _with_headers(headers, additional_headers):
+    # Merge headers: don't worry about collisions, we're only adding information.
+    merged = CIMultiDict(headers or {})
+    for key in additional_headers:
+        merged[key] = additional_headers[key]
+    return merged
+
+
+def _metadata(url, kwargs):
+    metadata = {}
+
+    timeout = kwargs.get('timeout', None)
+    if isinstance(timeout, aiohttp.ClientTimeout):
+        timeout = timeout.total
+    if isinstance(timeout, (int, float)):
+        debug("=> timeout for call is set to " + str(timeout))
+        metadata['timeout'] = timeout
+
+    if str(url).startswith('https'):
+        metadata['ssl'] = True
+
+    return metadata
+
+
+async def _instrumented_request(wrapped, instance, args, kwargs):
+    (method, str_or_url) = args[:2]
+
+    async def send(additional_headers):
+        if additional_headers:
+            kwargs['headers'] = _with_headers(kwargs.get('headers', None), additional_headers)
+        return await wrapped(*args, **kwargs)
+
+    def fake_response(status_code, content, result):
+        if result is not None:
+            result.release()
+        return _InjectedResponse(method, str_or_url, status_code, content)
+
+    async def response_summary(result):
+        return result.status, await result.read()
+
+    return await instrumented_call('aiohttp', method, str_or_url, _metadata(str_or_url, kwargs),
+                                   send, fake_response, response_summary)
+
+
+class AiohttpInstrumentor(BaseInstrumentor):
+    """
+    Globally instrument aiohttp client sessions.
+
+    Every request made through :code:`aiohttp.ClientSession._request` (this includes
+    :code:`session.get`, etc.) is instrumented.
+    """
+
+    def _instrument(self, **kwargs):
+        if os.environ.get('DISABLE_INSTRUMENTATION', ''):
+            debug("Not instrumenting. DISABLE_INSTRUMENTATION set.")
+            return
+
+        _filibuster_global_context_set_value("filibuster_service_name", kwargs['service_name'])
+        _filibuster_global_context_set_value("filibuster_url", kwargs['filibuster_url'])
+
+        if should_passthrough():
+            debug("Not instrumenting aiohttp. DISABLE_SERVER_COMMUNICATION set and no counterexample.")
+            return
+
+        instrument_task_creation()
+        _wrap("aiohttp", "ClientSession._request", _instrumented_request)
+
+    def _uninstrument(self, **kwargs):
+        unwrap(aiohttp.ClientSession, "_request")
+        uninstrument_task_creation()
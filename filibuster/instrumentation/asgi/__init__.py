@@ -0,0 +1,51 @@
+"""
+Filibuster middleware for any ASGI application (e.g. Starlette, FastAPI.)
+
+Usage::
+
+    app = FilibusterASGIMiddleware(app, service_name=..., filibuster_url=...)
+
+Injected delays are awaited, so they don't block the event loop, and the reporter is
+flushed off the event loop.  Tasks created while handling a request get their own execution
+index on any event loop, including uvloop's.
+"""
+
+import asyncio
+import os
+
+from filibuster import control_plane
+from filibuster.instrumentation.forking import instrument_event_loop
+from filibuster.instrumentation.inbound import begin_request, end_request
+from filibuster.instrumentation.propagation import from_asgi_scope as _filibuster_from_asgi_scope
+from filibuster.instrumentation.reporter import flush as _filibuster_flush
+from filibuster.logger import debug
+
+
+class FilibusterASGIMiddleware:
+    def __init__(self, app, service_name, filibuster_url):
+        self.app = app
+        self.service_name = service_name
+        self.filibuster_url = filibuster_url
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or os.environ.get('DISABLE_INSTRUMENTATION', ''):
+            return await self.app(scope, receive, send)
+
+        instrument_event_loop(asyncio.get_running_loop())
+        inbound = begin_request(_filibuster_from_asgi_scope(scope), self.service_name, self.filibuster_url)
+
+        async def filibuster_send(message):
+            if message['type'] == 'http.response.start':
+                # Make sure the server has seen everything this request did before responding.
+                await control_plane.run_async(_filibuster_flush)
+            await send(message)
+
+        try:
+            # If we should delay the request to simulate timeouts, do it.
+            if inbound.sleep_interval > 0:
+                debug("Sleeping for " + str(inbound.sleep_interval) + " seconds.")
+                await asyncio.sleep(inbound.sleep_interval)
+
+            await self.app(scope, receive, filibuster_send)
+        finally:
+            end_request(inbound)
@@ -0,0 +1,102 @@
+"""Exception classes and gRPC status codes of injected faults, resolved once by name.
+
+Names come from the analysis file (e.g. "requests.exceptions.ConnectionError", "UNAVAILABLE")
+and are resolved, without eval, the first time they're seen: when a failure plan or
+counterexample is loaded (see preload) or, failing that, when the fault is injected.
+
+As with eval, injecting a fault whose name doesn't resolve raises (a LookupError), rather than
+injecting some other fault; preload only warns about it, when the plan is loaded.
+"""
+
+import builtins
+import importlib
+import sys
+import threading
+
+from filibuster.logger import warning, debug
+
+# Exception class (or why it couldn't be resolved, as a LookupError) by name.
+_exception_classes = {}
+
+# grpc.StatusCode (or why it couldn't be resolved, as a LookupError) by name.
+_status_codes = {}
+
+_registry_mutex = threading.Lock()
+
+
+def _resolve_exception_class(name):
+    parts = name.split('.')
+    if len(parts) == 1:
+        return getattr(builtins, name)
+
+    # Import the longest prefix that is a module, then look up the rest as attributes.
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            value = importlib.import_module('.'.join(parts[:i]))
+        except ImportError:
+            continue
+        for part in parts[i:]:
+            value = getattr(value, part)
+        return value
+
+    raise ImportError("No module found for " + name)
+
+
+def _resolve_status_code(name):
+    return importlib.import_module('grpc').StatusCode[name]
+
+
+def _lookup(cache, resolve, name, description):
+    try:
+        value = cache[name]
+    except KeyError:
+        with _registry_mutex:
+            if name not in cache:
+                try:
+                    cache[name] = resolve(name)
+                    debug("Resolved " + description + " " + name + ".")
+                except Exception as e:
+                    cache[name] = LookupError("Couldn't resolve " + description + " " + str(name) + ": " +
+                                              type(e).__name__ + ": " + str(e))
+            value = cache[name]
+
+    if isinstance(value, LookupError):
+        raise LookupError(*value.args)
+    return value
+
+
+def exception_class(name):
+    return _lookup(_exception_classes, _resolve_exception_class, name, "exception")
+
+
+def status_code(name):
+    return _lookup(_status_codes, _resolve_status_code, name, "status code")
+
+
+def _preload(lookup, name):
+    try:
+        lookup(name)
+    except LookupError as e:
+        warning(str(e) + "; calls it should fail will raise.")
+
+
+# Resolve the exceptions and status codes of failures from a failure plan or counterexample ahead
+# of the calls they fail.
+def preload(failures):
+    for failure in failures:
+        codes = []
+
+        forced_exception = failure.get('forced_exception', None)
+        if forced_exception:
+            _preload(exception_class, forced_exception['name'])
+            codes.append((forced_exception.get('metadata', None) or {}).get('code', None))
+
+        # gRPC failures given as error responses.
+        failure_exception = (failure.get('failure_metadata', None) or {}).get('exception', None)
+        if failure_exception:
+            codes.append((failure_exception.get('metadata', None) or {}).get('code', None))
+
+        # Only gRPC faults carry status codes; don't import grpc for services that don't use it.
+        for code in codes:
+            if code is not None and 'grpc' in sys.modules:
+                _preload(status_code, code)
@@ -0,0 +1,106 @@
+import os
+import sys
+import uuid
+import threading
+
+from filibuster import control_plane
+from filibuster.instrumentation.exception_registry import preload as _filibuster_preload_exceptions
+from filibuster.logger import warning, debug
+
+# Failure plan for the most recent test epoch seen by this service.
+_failure_plan = None
+
+# Set by the server for the functional test of each test execution.
+_FUNCTIONAL_TEST_EPOCH = os.environ.get('FILIBUSTER_TEST_EPOCH', None)
+_failure_plan_mutex = threading.Lock()
+
+
+def filibuster_failure_plan_url(filibuster_url):
+    return "{}/{}/failure-plan".format(filibuster_url, 'filibuster')
+
+
+def new_generated_id():
+    return uuid.uuid4().hex
+
+
+# Requests to fail in the current test execution, indexed by execution index.
+#
+# Services reached by an instrumented request, and the functional test, fetch the plan once per
+# test epoch; other calls that aren't part of an instrumented request don't know the test epoch,
+# so they always fetch it.
+def get_failure_plan(filibuster_url, test_epoch=None):
+    global _failure_plan
+
+    with _failure_plan_mutex:
+        if test_epoch is not None and str(test_epoch) != 'None' and _failure_plan is not None \
+                and str(_failure_plan['test_epoch']) == str(test_epoch):
+            return _failure_plan
+
+        try:
+            _failure_plan = control_plane.get(filibuster_failure_plan_url(filibuster_url)).json()
+            _filibuster_preload_exceptions(_failure_plan['failures'].values())
+            debug("Failure plan for test epoch " + str(_failure_plan['test_epoch']) + ": " +
+                  str(len(_failure_plan['failures'])) + " requests to fail.")
+        except Exception as e:
+            warning("Exception raised (get_failure_plan)!")
+            print(e, file=sys.stderr)
+            return None
+
+        return _failure_plan
+
+
+# Same as get_failure_plan, for asyncio code: only fetching a new plan leaves the event loop.
+async def get_failure_plan_async(filibuster_url, test_epoch=None):
+    failure_plan = _failure_plan
+    if test_epoch is not None and str(test_epoch) != 'None' and failure_plan is not None \
+            and str(failure_plan['test_epoch']) == str(test_epoch):
+        return failure_plan
+
+    return await control_plane.run_async(get_failure_plan, filibuster_url, test_epoch)
+
+
+def _known_test_epoch(test_epoch):
+    if test_epoch is not None and str(test_epoch) != 'None':
+        return test_epoch
+    return _FUNCTIONAL_TEST_EPOCH
+
+
+# Test epoch of a call: the one propagated with the request being handled, if any, or the one
+# the functional test was started with, otherwise the current failure plan's.
+#
+# Other calls not triggered by an instrumented request learn about new test executions from the
+# failure plan, so they fetch it before advancing the vclock and execution index that a new test
+# execution resets.
+def resolve_test_epoch(filibuster_url, test_epoch):
+    test_epoch = _known_test_epoch(test_epoch)
+    if test_epoch is not None:
+        return test_epoch
+
+    failure_plan = get_failure_plan(filibuster_url, None)
+    if failure_plan is None:
+        return None
+    return failure_plan['test_epoch']
+
+
+async def resolve_test_epoch_async(filibuster_url, test_epoch):
+    test_epoch = _known_test_epoch(test_epoch)
+    if test_epoch is not None:
+        return test_epoch
+
+    return await control_plane.run_async(resolve_test_epoch, filibuster_url, test_epoch)
+
+
+# Decide locally what the server would have answered for the creation of this request.
+def decide(failure_plan, generated_id, payload):
+    response = {
+        'generated_id': generated_id,
+        'execution_index': payload['execution_index'],
+        'test_epoch': failure_plan['test_epoch']
+    }
+
+    failure = failure_plan['failures'].get(payload['execution_index'], None)
+    if failure is not None:
+        for key in failure:
+            response[key] = failure[key]
+
+    return response
@@ -53,13 +53,19 @@ from logging import getLogger
 import sys
 import os
 import flask
-import requests
 import uuid 
 
 import opentelemetry.instrumentation.wsgi as otel_wsgi
 
 from filibuster.datatypes import TestExecution
-from filibuster.instrumentation.helpers import should_load_counterexample_file, counterexample_file
+from filibuster.instrumentation.helpers import should_load_counterexample_file, counterexample_file, \
+    set_incoming_context, reset_incoming_context
+from filibuster.instrumentation.reporter import report as _filibuster_report, flush_request as _filibuster_flush_request
+from filibuster.instrumentation.reporter import track_request as _filibuster_track_request, \
+    untrack_request as _filibuster_untrack_request
+from filibuster.global_context import acquire_request as _filibuster_global_context_acquire_request
+from filibuster.global_context import release_request as _filibuster_global_context_release_request
+from filibuster.instrumentation.propagation import from_http_headers as _filibuster_from_http_headers
 from filibuster.logger import error, warning, notice, info, debug
 
 from opentelemetry import context, propagators, trace
@@ -76,12 +82,17 @@ _ENVIRON_STARTTIME_KEY = "opentelemetry-flask.starttime_key"
 _ENVIRON_SPAN_KEY = "opentelemetry-flask.span_key"
 _ENVIRON_ACTIVATION_KEY = "opentelemetry-flask.activation_key"
 _ENVIRON_TOKEN = "opentelemetry-flask.token"
+_ENVIRON_FILIBUSTER_REQUEST_ID_KEY = "filibuster-flask.request_id"
+_ENVIRON_FILIBUSTER_INCOMING_TOKEN = "filibuster-flask.incoming_token"
+_ENVIRON_FILIBUSTER_REPORTER_TOKEN = "filibuster-flask.reporter_token"
 
 _FILIBUSTER_INSTRUMENTATION_KEY = "filibuster_instrumentation"
 _FILIBUSTER_VCLOCK_KEY = "filibuster_vclock"
 _FILIBUSTER_ORIGIN_VCLOCK_KEY = "filibuster_origin_vclock"
 _FILIBUSTER_EXECUTION_INDEX_KEY = "filibuster_execution_index"
 _FILIBUSTER_REQUEST_ID_KEY = "filibuster_request_id"
+_FILIBUSTER_TEST_EPOCH_KEY = "filibuster_test_epoch"
+_FILIBUSTER_GENERATED_ID_KEY = "filibuster_generated_id"
 
 _excluded_urls = get_excluded_urls("FLASK")
 
@@ -132,20 +143,20 @@ def _rewrapped_app(wsgi_app):
 
     return _wrapped_app
 
-def filibuster_update_url(filibuster_url):
-    return "{}/{}/update".format(filibuster_url, 'filibuster')
-
 def _wrapped_before_request(name_callback, service_name, filibuster_url):
     def _before_request():
         if _excluded_urls.url_disabled(flask.request.url):
             return
 
+        # Incoming context, from the context header or the legacy X-Filibuster-* headers.
+        incoming = _filibuster_from_http_headers(flask.request.headers)
+
         # Each request needs to maintain some things independently of the global state (e.g. 
         # execution_index, vclock) for when we issue multiple requests. Unique request_ids
         # can distinguish one request from another. Generate a new unique request_id if one
         # doesn't already exist (new request), otherwise use the existing one.
-        if 'X-Filibuster-Request-Id' in flask.request.headers and flask.request.headers['X-Filibuster-Request-Id'] is not None:
-            request_id = flask.request.headers['X-Filibuster-Request-Id']
+        if incoming['request_id'] is not None:
+            request_id = incoming['request_id']
             debug("Using old request_id: " + request_id)
         else:
             request_id = str(uuid.uuid4())
@@ -153,47 +164,61 @@ def _wrapped_before_request(name_callback, service_name, filibuster_url):
         context.attach(context.set_value(_FILIBUSTER_REQUEST_ID_KEY, request_id))
         debug("** [FLASK] [" + service_name + "]: request-id attached to context: " + str(context.get_value(_FILIBUSTER_REQUEST_ID_KEY)))
 
-        if 'X-Filibuster-Execution-Index' in flask.request.headers and flask.request.headers['X-Filibuster-Execution-Index'] is not None:
+        # Vclock and execution index state for this request id is kept until the request is torn down.
+        _filibuster_global_context_acquire_request(request_id)
+        flask.request.environ[_ENVIRON_FILIBUSTER_REQUEST_ID_KEY] = request_id
+
+        # Also made available to work forked from this request (e.g. on thread pools.)
+        flask.request.environ[_ENVIRON_FILIBUSTER_INCOMING_TOKEN] = set_incoming_context(
+            dict(incoming, request_id=request_id))
+
+        # Events this request reports, so teardown only waits for those still pending.
+        flask.request.environ[_ENVIRON_FILIBUSTER_REPORTER_TOKEN] = _filibuster_track_request()
+
+        if incoming['execution_index'] is not None:
 
             payload = { 
                 'instrumentation_type': 'request_received',
-                'generated_id': str(flask.request.headers['X-Filibuster-Generated-Id']),
-                'execution_index': str(flask.request.headers['X-Filibuster-Execution-Index']),
-                'target_service_name': service_name
+                'generated_id': str(incoming['generated_id']),
+                'execution_index': str(incoming['execution_index']),
+                'target_service_name': service_name,
+                'test_epoch': incoming['test_epoch']
             }
 
+            # All this is responsible for doing is putting the header generated id into the context
+            # so that the server can order requests triggered from this after the request itself.
+            context.attach(context.set_value(_FILIBUSTER_GENERATED_ID_KEY, incoming['generated_id']))
+
             # All this is responsible for doing is putting the header execution index into the context
             # so that any requests that are triggered from this have the existing execution index.
-            context.attach(context.set_value(_FILIBUSTER_EXECUTION_INDEX_KEY, flask.request.headers['X-Filibuster-Execution-Index']))
+            context.attach(context.set_value(_FILIBUSTER_EXECUTION_INDEX_KEY, incoming['execution_index']))
             debug("** [FLASK] [" + service_name + "]: execution-index attached to context: " + str(context.get_value(_FILIBUSTER_EXECUTION_INDEX_KEY)))
 
             # All this is responsible for doing is putting the header vclock into the context
             # so that any requests that are triggered from this, know to merge the incoming vclock in.
-            context.attach(context.set_value(_FILIBUSTER_VCLOCK_KEY, flask.request.headers['X-Filibuster-VClock']))
+            context.attach(context.set_value(_FILIBUSTER_VCLOCK_KEY, incoming['vclock']))
             debug("** [FLASK] [" + service_name + "]: vclock attached to context: " + str(context.get_value(_FILIBUSTER_VCLOCK_KEY)))
 
             # All this is responsible for doing is putting the header origin vclock into the context
             # so that any requests that are triggered from this, know to merge the incoming vclock in.
-            context.attach(context.set_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY, flask.request.headers['X-Filibuster-Origin-VClock']))
+            context.attach(context.set_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY, incoming['origin_vclock']))
             debug("** [FLASK] [" + service_name + "]: origin-vclock attached to context: " + str(context.get_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY)))
 
+            # All this is responsible for doing is putting the header test epoch into the context
+            # so that any requests that are triggered from this know whether this is a new test execution.
+            if incoming['test_epoch'] is not None:
+                context.attach(context.set_value(_FILIBUSTER_TEST_EPOCH_KEY, incoming['test_epoch']))
+                debug("** [FLASK] [" + service_name + "]: test-epoch attached to context: " + str(context.get_value(_FILIBUSTER_TEST_EPOCH_KEY)))
+
             if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
-                try:
-                    debug("Setting Filibuster instrumentation key...")
-                    token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
-
-                    requests.post(filibuster_update_url(filibuster_url), json = payload)
-                except Exception as e:
-                    warning("Exception raised during instrumentation (_record_successful_response)!")
-                    print(e, file=sys.stderr)
-                finally:
-                    debug("Removing instrumentation key for Filibuster.")
-                    context.detach(token)
+                # Reported from the background, in order with the calls this request makes; the
+                # server holds it until it has seen the call that reached this service, and
+                # teardown flushes it before the response goes out.
+                _filibuster_report(filibuster_url, payload)
 
         # If we should delay the request to simulate timeouts, do it.
-        if 'X-Filibuster-Forced-Sleep' in flask.request.headers and flask.request.headers['X-Filibuster-Forced-Sleep'] is not None:
-            sleep_interval_string = flask.request.headers['X-Filibuster-Forced-Sleep']
-            sleep_interval = int(sleep_interval_string)
+        if incoming['forced_sleep'] is not None:
+            sleep_interval = int(incoming['forced_sleep'])
             if sleep_interval != 0:
                 time.sleep(sleep_interval)
 
@@ -236,6 +261,19 @@ def _teardown_request(exc):
     if _excluded_urls.url_disabled(flask.request.url):
         return
 
+    # Make sure the server has seen everything this request did before responding; the background
+    # thread usually has already.
+    _filibuster_flush_request()
+
+    if _ENVIRON_FILIBUSTER_REPORTER_TOKEN in flask.request.environ:
+        _filibuster_untrack_request(flask.request.environ[_ENVIRON_FILIBUSTER_REPORTER_TOKEN])
+
+    if _ENVIRON_FILIBUSTER_REQUEST_ID_KEY in flask.request.environ:
+        _filibuster_global_context_release_request(flask.request.environ[_ENVIRON_FILIBUSTER_REQUEST_ID_KEY])
+
+    if _ENVIRON_FILIBUSTER_INCOMING_TOKEN in flask.request.environ:
+        reset_incoming_context(flask.request.environ[_ENVIRON_FILIBUSTER_INCOMING_TOKEN])
+
     activation = flask.request.environ.get(_ENVIRON_ACTIVATION_KEY)
     if not activation:
         # This request didn't start a span, maybe because it was created in a
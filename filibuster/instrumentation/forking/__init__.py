@@ -0,0 +1,205 @@
+"""Execution indexes of the tasks and threads a service forks while handling a request.
+
+Calls made concurrently (asyncio tasks, thread pools) can't share the execution index kept
+for the request: their pushes and pops would interleave.  Instead, each task or thread gets
+a copy of its parent's execution index when created, along with the order in which its
+parent created it; calls include this path of ordinals in their execution index hash, so
+they get the same execution index in every run, however they interleave.
+"""
+
+import asyncio
+import contextvars
+import functools
+from asyncio import base_events
+from concurrent.futures import ThreadPoolExecutor
+
+from filibuster.execution_index import execution_index_new, execution_index_fromstring
+from filibuster.global_context import get_value as _filibuster_global_context_get_value
+from filibuster.global_context import set_request_scoped_map as _filibuster_global_context_set_request_scoped_map
+from filibuster.global_context import request_mutex as _filibuster_global_context_request_mutex
+from filibuster.instrumentation.helpers import get_incoming_context
+
+# Key for Filibuster execution index mapping.
+_FILIBUSTER_EI_BY_REQUEST_KEY = "filibuster_execution_indices_by_request"
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_EI_BY_REQUEST_KEY)
+
+
+class ForkedExecutionIndex:
+    """Execution index of a task or thread handling (part of) a request.
+
+    The task or thread handling the request itself has the empty path and uses the execution
+    index kept for the request (execution_index is None.)
+    """
+
+    __slots__ = ('request_id', 'path', 'children', 'execution_index')
+
+    def __init__(self, request_id, path, execution_index):
+        self.request_id = request_id
+        self.path = path
+        self.children = 0
+        self.execution_index = execution_index
+
+
+_filibuster_fork = contextvars.ContextVar('filibuster_fork', default=None)
+
+
+def _incoming_field(incoming, field):
+    if incoming is None:
+        return None
+    return incoming.get(field, None)
+
+
+def _copy_execution_index(execution_index):
+    (callstack, counters) = execution_index
+    if isinstance(callstack, list):
+        callstack = list(callstack)
+    return callstack, dict(counters)
+
+
+# Execution index kept for the request being handled; callers hold the request's mutex.
+def request_execution_index(incoming, request_id_string):
+    incoming_execution_index_string = _incoming_field(incoming, 'execution_index')
+    if incoming_execution_index_string is not None:
+        return execution_index_fromstring(incoming_execution_index_string)
+
+    execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+    return execution_indices_by_request.get(request_id_string, execution_index_new())
+
+
+# Forked execution index of the current task or thread, if it was forked while handling request_id_string.
+def current_fork(request_id_string):
+    fork = _filibuster_fork.get()
+    if fork is None or fork.execution_index is None or fork.request_id != request_id_string:
+        return None
+    return fork
+
+
+# Part of the execution index hash identifying calls made by a forked task or thread.
+def fork_path(fork):
+    return 'fork-' + '.'.join(str(ordinal) for ordinal in fork.path)
+
+
+# Only tasks and threads forked while handling an inbound request belong to it; others (e.g. the
+# gRPC server's handler pool, or tasks a server creates per connection) are left alone.
+def _handling_request():
+    return get_incoming_context() is not None
+
+
+def fork_execution_index():
+    incoming = get_incoming_context()
+    request_id_string = _incoming_field(incoming, 'request_id')
+
+    parent = _filibuster_fork.get()
+    if parent is None or parent.request_id != request_id_string:
+        # First fork by the task or thread handling the request.
+        parent = ForkedExecutionIndex(request_id_string, (), None)
+        _filibuster_fork.set(parent)
+
+    with _filibuster_global_context_request_mutex(request_id_string):
+        if parent.execution_index is None:
+            execution_index = _copy_execution_index(request_execution_index(incoming, request_id_string))
+        else:
+            execution_index = _copy_execution_index(parent.execution_index)
+
+        ordinal = parent.children
+        parent.children += 1
+
+    return ForkedExecutionIndex(request_id_string, parent.path + (ordinal,), execution_index)
+
+
+def instrument_task_creation():
+    """Fork the execution index of every task created from another task.
+
+    Covers loops derived from asyncio's BaseEventLoop; other loops (e.g. uvloop's) are covered
+    by instrument_event_loop, through their task factory."""
+
+    wrapped_create_task = base_events.BaseEventLoop.create_task
+    if getattr(wrapped_create_task, "filibuster_instrumentation_applied", False):
+        return
+
+    @functools.wraps(wrapped_create_task)
+    def create_task(self, coro, *args, **kwargs):
+        # Only tasks created by other tasks share their request; tasks given an explicit
+        # context keep it.
+        if kwargs.get('context', None) is not None or asyncio.current_task(self) is None \
+                or not _handling_request():
+            return wrapped_create_task(self, coro, *args, **kwargs)
+
+        # The task copies the current context when created.
+        token = _filibuster_fork.set(fork_execution_index())
+        try:
+            return wrapped_create_task(self, coro, *args, **kwargs)
+        finally:
+            _filibuster_fork.reset(token)
+
+    create_task.filibuster_instrumentation_applied = True
+    base_events.BaseEventLoop.create_task = create_task
+
+
+def instrument_event_loop(loop):
+    """Fork the execution index of every task created from another task on loop, through its
+    task factory, if loop isn't derived from BaseEventLoop (e.g. uvloop's.)
+
+    Called by the ASGI middleware and the grpc.aio server interceptor for the loop serving
+    each request, before the request's handler can create tasks."""
+
+    if isinstance(loop, base_events.BaseEventLoop):
+        return
+
+    wrapped_task_factory = loop.get_task_factory()
+    if getattr(wrapped_task_factory, "filibuster_instrumentation_applied", False):
+        return
+
+    def create_task(loop, coro, **kwargs):
+        if wrapped_task_factory is None:
+            return asyncio.Task(coro, loop=loop, **kwargs)
+        return wrapped_task_factory(loop, coro, **kwargs)
+
+    def task_factory(loop, coro, **kwargs):
+        if kwargs.get('context', None) is not None or asyncio.current_task(loop) is None \
+                or not _handling_request():
+            return create_task(loop, coro, **kwargs)
+
+        token = _filibuster_fork.set(fork_execution_index())
+        try:
+            return create_task(loop, coro, **kwargs)
+        finally:
+            _filibuster_fork.reset(token)
+
+    task_factory.filibuster_instrumentation_applied = True
+    loop.set_task_factory(task_factory)
+
+
+def uninstrument_task_creation():
+    create_task = base_events.BaseEventLoop.create_task
+    if getattr(create_task, "filibuster_instrumentation_applied", False):
+        base_events.BaseEventLoop.create_task = create_task.__wrapped__
+
+
+def instrument_thread_pools():
+    """Run everything submitted to a thread pool while handling an inbound request in a copy of
+    the submitter's context, with a forked execution index.
+
+    Executors with filibuster_internal set (the control plane's) are left alone."""
+
+    wrapped_submit = ThreadPoolExecutor.submit
+    if getattr(wrapped_submit, "filibuster_instrumentation_applied", False):
+        return
+
+    @functools.wraps(wrapped_submit)
+    def submit(self, fn, *args, **kwargs):
+        if getattr(self, 'filibuster_internal', False) or not _handling_request():
+            return wrapped_submit(self, fn, *args, **kwargs)
+
+        forked_context = contextvars.copy_context()
+        forked_context.run(_filibuster_fork.set, fork_execution_index())
+        return wrapped_submit(self, forked_context.run, fn, *args, **kwargs)
+
+    submit.filibuster_instrumentation_applied = True
+    ThreadPoolExecutor.submit = submit
+
+
+def uninstrument_thread_pools():
+    submit = ThreadPoolExecutor.submit
+    if getattr(submit, "filibuster_instrumentation_applied", False):
+        ThreadPoolExecutor.submit = submit.__wrapped__
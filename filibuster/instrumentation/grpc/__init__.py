@@ -130,6 +130,7 @@ from opentelemetry.instrumentation.instrumentor import BaseInstrumentor
 from opentelemetry.instrumentation.utils import unwrap
 
 from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.instrumentation.helpers import should_passthrough
 
 # pylint:disable=import-outside-toplevel
 # pylint:disable=import-self
@@ -209,6 +210,10 @@ class GrpcInstrumentorClient(BaseInstrumentor):
         _filibuster_global_context_set_value("filibuster_service_name", kwargs['service_name'])
         _filibuster_global_context_set_value("filibuster_url", kwargs['filibuster_url'])
 
+        if should_passthrough():
+            debug("Not instrumenting grpc channels. DISABLE_SERVER_COMMUNICATION set and no counterexample.")
+            return
+
         for ctype in self._which_channel(kwargs):
             _wrap(
                 "grpc", ctype, self.wrapper_fn,
@@ -226,6 +231,81 @@ class GrpcInstrumentorClient(BaseInstrumentor):
         )
 
 
+class GrpcAioInstrumentorServer(BaseInstrumentor):
+    """
+    Globally instrument grpc.aio servers.
+
+    Usage::
+
+        grpc_aio_server_instrumentor = GrpcAioInstrumentorServer()
+        grpc_aio_server_instrumentor.instrument(service_name=..., filibuster_url=...)
+
+    """
+
+    # pylint:disable=attribute-defined-outside-init, redefined-outer-name
+
+    def _instrument(self, **kwargs):
+        if os.environ.get('DISABLE_INSTRUMENTATION', ''):
+            debug("Not instrumenting. DISABLE_INSTRUMENTATION set.")
+            return
+
+        _filibuster_global_context_set_value("filibuster_service_name", kwargs['service_name'])
+        _filibuster_global_context_set_value("filibuster_url", kwargs['filibuster_url'])
+
+        self._original_func = grpc.aio.server
+
+        def server(*args, **kwargs):
+            interceptors = list(kwargs.get("interceptors", None) or [])
+            # add our interceptor as the first
+            interceptors.insert(0, aio_server_interceptor())
+            kwargs["interceptors"] = interceptors
+            return self._original_func(*args, **kwargs)
+
+        grpc.aio.server = server
+
+    def _uninstrument(self, **kwargs):
+        grpc.aio.server = self._original_func
+
+
+class GrpcAioInstrumentorClient(BaseInstrumentor):
+    """
+    Globally instrument grpc.aio channels.
+
+    Usage::
+
+        grpc_aio_client_instrumentor = GrpcAioInstrumentorClient()
+        grpc_aio_client_instrumentor.instrument(service_name=..., filibuster_url=...)
+
+    """
+
+    # pylint:disable=attribute-defined-outside-init
+
+    def _instrument(self, **kwargs):
+        if os.environ.get('DISABLE_INSTRUMENTATION', ''):
+            debug("Not instrumenting. DISABLE_INSTRUMENTATION set.")
+            return
+
+        _filibuster_global_context_set_value("filibuster_service_name", kwargs['service_name'])
+        _filibuster_global_context_set_value("filibuster_url", kwargs['filibuster_url'])
+
+        if should_passthrough():
+            debug("Not instrumenting grpc.aio channels. DISABLE_SERVER_COMMUNICATION set and no counterexample.")
+            return
+
+        for ctype in ("secure_channel", "insecure_channel"):
+            _wrap("grpc.aio", ctype, self.wrapper_fn)
+
+    def _uninstrument(self, **kwargs):
+        for ctype in ("secure_channel", "insecure_channel"):
+            unwrap(grpc.aio, ctype)
+
+    def wrapper_fn(self, original_func, instance, args, kwargs):
+        interceptors = list(kwargs.get("interceptors", None) or [])
+        interceptors.insert(0, aio_client_interceptor())
+        kwargs["interceptors"] = interceptors
+        return original_func(*args, **kwargs)
+
+
 def client_interceptor(tracer_provider=None):
     """Create a gRPC client channel interceptor.
 
@@ -256,3 +336,25 @@ def server_interceptor(tracer_provider=None):
     tracer = trace.get_tracer(__name__, __version__, tracer_provider)
 
     return _server.OpenTelemetryServerInterceptor(tracer)
+
+
+def aio_client_interceptor():
+    """Create a grpc.aio client channel interceptor.
+
+    Returns:
+        An invocation-side interceptor object for grpc.aio channels.
+    """
+    from . import _aio
+
+    return _aio.FilibusterAioClientInterceptor()
+
+
+def aio_server_interceptor():
+    """Create a grpc.aio server interceptor.
+
+    Returns:
+        A service-side interceptor object for grpc.aio servers.
+    """
+    from . import _aio
+
+    return _aio.FilibusterAioServerInterceptor()
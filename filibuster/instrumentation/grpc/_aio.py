@@ -0,0 +1,452 @@
+# pylint:disable=relative-beyond-top-level
+# pylint:disable=arguments-differ
+# pylint:disable=no-member
+# pylint:disable=signature-differs
+
+"""Interceptors for asyncio gRPC (grpc.aio) channels and servers.
+
+The context of the inbound request (request id, vclocks, execution index, test epoch) is kept
+in a contextvar instead of the OpenTelemetry context, so it follows each RPC's task; calls to
+the Filibuster server, and updates of request-scoped state that may wait on other worker
+processes, are made off the event loop.  Tasks created while handling a request fork its
+execution index (see filibuster.instrumentation.forking.)
+"""
+
+import asyncio
+import hashlib
+import inspect
+import os
+import sys
+import uuid
+
+import grpc
+
+from filibuster import control_plane
+from filibuster.datatypes import TestExecution
+from filibuster.execution_index import execution_index_push, execution_index_tostring, execution_index_pop
+from filibuster.global_context import get_value as _filibuster_global_context_get_value
+from filibuster.global_context import set_request_scoped_map as _filibuster_global_context_set_request_scoped_map
+from filibuster.global_context import request_mutex as _filibuster_global_context_request_mutex
+from filibuster.global_context import acquire_request as _filibuster_global_context_acquire_request
+from filibuster.global_context import release_request as _filibuster_global_context_release_request
+from filibuster.instrumentation.helpers import get_full_traceback_hash, counterexample_file, \
+    should_load_counterexample_file, observe_test_epoch, get_incoming_context, set_incoming_context, \
+    reset_incoming_context
+from filibuster.instrumentation.reporter import report_async as _filibuster_report_async, \
+    flush as _filibuster_flush
+from filibuster.instrumentation.failure_plan import get_failure_plan_async, resolve_test_epoch_async, decide, \
+    new_generated_id
+from filibuster.instrumentation.exception_registry import status_code as _filibuster_status_code, \
+    preload as _filibuster_preload_exceptions
+from filibuster.instrumentation.forking import instrument_event_loop, request_execution_index, current_fork, \
+    fork_path
+from filibuster.instrumentation.propagation import grpc_metadata as _filibuster_grpc_metadata
+from filibuster.instrumentation.propagation import from_grpc_metadata as _filibuster_from_grpc_metadata
+from filibuster.logger import notice, warning, debug
+from filibuster.server_helpers import should_fail_request_with, load_counterexample
+from filibuster.vclock import vclock_new, vclock_merge, vclock_fromstring, vclock_increment, vclock_todict
+
+## *******************************************************************************************
+## START FILIBUSTER CONSTANTS
+## *******************************************************************************************
+
+# Key for Filibuster vclock mapping.
+_FILIBUSTER_VCLOCK_BY_REQUEST_KEY = "filibuster_vclock_by_request"
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+
+# Key for Filibuster execution index mapping.
+_FILIBUSTER_EI_BY_REQUEST_KEY = "filibuster_execution_indices_by_request"
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_EI_BY_REQUEST_KEY)
+
+# Exception reported for injected faults, as for synchronous channels.
+_FILIBUSTER_GRPC_EXCEPTION = "grpc._channel._InactiveRpcError"
+
+# Resolved once, rather than on every call.
+_SERVER_COMMUNICATION_DISABLED = bool(os.environ.get('DISABLE_SERVER_COMMUNICATION', ''))
+
+if should_load_counterexample_file():
+    notice("Counterexample file present!")
+    counterexample = load_counterexample(counterexample_file())
+    counterexample_test_execution = TestExecution.from_json(counterexample['TestExecution']) if counterexample else None
+    if counterexample_test_execution is not None:
+        _filibuster_preload_exceptions(counterexample_test_execution.failures)
+else:
+    counterexample = None
+    counterexample_test_execution = None
+
+## *******************************************************************************************
+## END FILIBUSTER CONSTANTS
+## *******************************************************************************************
+
+## *******************************************************************************************
+## START FILIBUSTER HELPERS
+## *******************************************************************************************
+
+
+def _server_communication_enabled():
+    return not _SERVER_COMMUNICATION_DISABLED and counterexample is None
+
+
+# For a given request, return a unique hash that can be used to identify it.
+def unique_request_hash(args):
+    hash_string = "-".join(args)
+    hex_digest = hashlib.md5(hash_string.encode()).hexdigest()
+    return hex_digest
+
+
+def _incoming_field(incoming, field):
+    if incoming is None:
+        return None
+    return incoming.get(field, None)
+
+
+def _execution_index_hash(full_traceback_hash, fork):
+    args = [full_traceback_hash]
+    if fork is not None:
+        args.append(fork_path(fork))
+    return unique_request_hash(args)
+
+
+# Advance the vclock and execution index of the current task for a new call, after resetting them if
+# the call belongs to a new test execution.  Blocks on the request's mutex, which may be held by
+# another thread or worker process: run it off the event loop.
+def _advance(incoming, request_id_string, fork, test_epoch, execution_index_hash):
+    service_name = _filibuster_global_context_get_value("filibuster_service_name")
+
+    observe_test_epoch(test_epoch)
+
+    with _filibuster_global_context_request_mutex(request_id_string):
+        vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+        local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
+
+        incoming_vclock_string = _incoming_field(incoming, 'vclock')
+        if incoming_vclock_string is not None:
+            local_vclock = vclock_merge(vclock_fromstring(incoming_vclock_string), local_vclock)
+
+        vclock = vclock_increment(local_vclock, service_name)
+        vclocks_by_request[request_id_string] = vclock
+
+        if fork is None:
+            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+            execution_indices_by_request[request_id_string] = execution_index_push(
+                execution_index_hash, request_execution_index(incoming, request_id_string))
+            execution_index = execution_index_tostring(execution_indices_by_request[request_id_string])
+        else:
+            fork.execution_index = execution_index_push(execution_index_hash, fork.execution_index)
+            execution_index = execution_index_tostring(fork.execution_index)
+
+    incoming_origin_vclock_string = _incoming_field(incoming, 'origin_vclock')
+    if incoming_origin_vclock_string is not None:
+        origin_vclock = vclock_fromstring(incoming_origin_vclock_string)
+    else:
+        origin_vclock = vclock_new()
+
+    return vclock, origin_vclock, execution_index
+
+
+# Remove the call that just completed from the execution index of the current task.  Like _advance,
+# run it off the event loop.
+def _pop_execution_index(request_id_string, fork):
+    with _filibuster_global_context_request_mutex(request_id_string):
+        if fork is None:
+            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+            execution_index = execution_indices_by_request.get(request_id_string, None)
+
+            # Reset by a new test execution, or dropped, while the call was in flight: nothing to pop.
+            if execution_index is None:
+                debug("No execution index to pop for request " + str(request_id_string) + ".")
+                return
+
+            execution_indices_by_request[request_id_string] = execution_index_pop(execution_index)
+        else:
+            fork.execution_index = execution_index_pop(fork.execution_index)
+
+
+def _metadata_pairs(metadata):
+    if metadata is None:
+        return []
+    return list(metadata)
+
+## *******************************************************************************************
+## END FILIBUSTER HELPERS
+## *******************************************************************************************
+
+
+class FilibusterAioClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    """Fault injection for unary calls made on grpc.aio channels, with the same semantics as
+    the interceptor for synchronous channels."""
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        service_name = _filibuster_global_context_get_value("filibuster_service_name")
+        filibuster_url = _filibuster_global_context_get_value("filibuster_url")
+
+        method = client_call_details.method
+        if isinstance(method, bytes):
+            method = method.decode()
+
+        ## *******************************************************************************************
+        ## START CLOCK AND EXECUTION INDEX WORK
+        ## *******************************************************************************************
+
+        incoming = get_incoming_context()
+        request_id_string = _incoming_field(incoming, 'request_id')
+        test_epoch = _incoming_field(incoming, 'test_epoch')
+        parent_generated_id = _incoming_field(incoming, 'generated_id')
+        fork = current_fork(request_id_string)
+
+        callsite_file, callsite_line, full_traceback_hash = get_full_traceback_hash(service_name)
+
+        # Calls not triggered by an instrumented request (e.g. from the test) get the test execution
+        # they belong to from the failure plan, before their vclock and execution index advance.
+        if _server_communication_enabled():
+            test_epoch = await resolve_test_epoch_async(filibuster_url, test_epoch)
+
+        execution_index_hash = _execution_index_hash(full_traceback_hash, fork)
+        (vclock, origin_vclock, execution_index) = await control_plane.run_async(
+            _advance, incoming, request_id_string, fork, test_epoch, execution_index_hash)
+
+        notice("request_id_string: " + str(request_id_string))
+        notice("execution index now: " + str(execution_index))
+
+        ## *******************************************************************************************
+        ## END CLOCK AND EXECUTION INDEX WORK
+        ## *******************************************************************************************
+
+        ## *******************************************************************************************
+        ## START RECORD CALL WORK
+        ## *******************************************************************************************
+
+        response = None
+        generated_id = None
+        should_sleep_interval = 0
+        should_abort = True
+        exception_code = None
+
+        payload = {
+            'instrumentation_type': 'invocation',
+            'source_service_name': service_name,
+            'module': 'grpc',
+            'method': 'insecure_channel',
+            'args': [str(method), str(request)],
+            'kwargs': {},
+            'callsite_file': callsite_file,
+            'callsite_line': callsite_line,
+            'full_traceback': full_traceback_hash,
+            'metadata': {},
+            'vclock': vclock_todict(vclock),
+            'origin_vclock': vclock_todict(origin_vclock),
+            'execution_index': execution_index
+        }
+
+        if client_call_details.timeout is not None:
+            payload['metadata']['timeout'] = client_call_details.timeout
+
+        try:
+            if counterexample is not None and counterexample_test_execution is not None:
+                notice("Using counterexample without contacting server.")
+                response = should_fail_request_with(payload, counterexample_test_execution.failures)
+                if response is None:
+                    response = {'execution_index': execution_index}
+            elif _SERVER_COMMUNICATION_DISABLED:
+                warning("Server communication disabled.")
+            else:
+                # Decide locally using the failure plan for this test execution and notify the server.
+                failure_plan = await get_failure_plan_async(filibuster_url, test_epoch)
+                if failure_plan is not None:
+                    generated_id = new_generated_id()
+                    payload['client_generated_id'] = generated_id
+                    payload['parent_generated_id'] = parent_generated_id
+                    payload['test_epoch'] = failure_plan['test_epoch']
+                    await _filibuster_report_async(filibuster_url, payload)
+                    response = decide(failure_plan, generated_id, payload)
+        except Exception as e:
+            warning("Exception raised (invocation)!")
+            print(e, file=sys.stderr)
+
+        if response is not None:
+            if 'generated_id' in response:
+                generated_id = response['generated_id']
+
+            if 'forced_exception' in response:
+                exception_metadata = response['forced_exception'].get('metadata', None) or {}
+                if exception_metadata.get('abort', None) is not None:
+                    should_abort = exception_metadata['abort']
+                if exception_metadata.get('sleep', None) is not None:
+                    should_sleep_interval = exception_metadata['sleep']
+                if exception_metadata.get('code', None) is not None:
+                    exception_code = exception_metadata['code']
+
+            if 'failure_metadata' in response:
+                exception_description = response['failure_metadata'].get('exception', {})
+                if 'metadata' in exception_description:
+                    exception_metadata = exception_description['metadata']
+                    if exception_metadata.get('code', None) is not None:
+                        exception_code = exception_metadata['code']
+
+        ## *******************************************************************************************
+        ## END RECORD CALL WORK
+        ## *******************************************************************************************
+
+        ## *******************************************************************************************
+        ## START METADATA WORK
+        ## *******************************************************************************************
+
+        metadata = _metadata_pairs(client_call_details.metadata)
+        metadata.extend(_filibuster_grpc_metadata(generated_id, vclock, origin_vclock, execution_index,
+                                                  request_id_string, test_epoch, should_sleep_interval))
+        client_call_details = client_call_details._replace(metadata=grpc.aio.Metadata(*metadata))
+
+        ## *******************************************************************************************
+        ## END METADATA WORK
+        ## *******************************************************************************************
+
+        if exception_code:
+            notice("Raising exception!")
+
+            await control_plane.run_async(_pop_execution_index, request_id_string, fork)
+
+            if _server_communication_enabled():
+                payload = {
+                    'instrumentation_type': 'invocation_complete',
+                    'generated_id': generated_id,
+                    'execution_index': execution_index,
+                    'vclock': vclock_todict(vclock),
+                    'exception': {
+                        'name': _FILIBUSTER_GRPC_EXCEPTION,
+                        'metadata': {
+                            'code': str(exception_code)
+                        }
+                    }
+                }
+
+                if should_sleep_interval > 0:
+                    payload['exception']['metadata']['sleep'] = should_sleep_interval
+
+                if should_abort is not True:
+                    payload['exception']['metadata']['abort'] = should_abort
+
+                await _filibuster_report_async(filibuster_url, payload)
+
+            raise grpc.aio.AioRpcError(_filibuster_status_code(exception_code), grpc.aio.Metadata(), grpc.aio.Metadata(),
+                                       details="Filibuster injected fault.")
+
+        call = await continuation(client_call_details, request)
+
+        try:
+            result = await call
+        except grpc.aio.AioRpcError as err:
+            await control_plane.run_async(_pop_execution_index, request_id_string, fork)
+
+            if _server_communication_enabled():
+                payload = {
+                    'instrumentation_type': 'invocation_complete',
+                    'generated_id': generated_id,
+                    'execution_index': execution_index,
+                    'vclock': vclock_todict(vclock),
+                    'exception': {
+                        'name': _FILIBUSTER_GRPC_EXCEPTION,
+                        'metadata': {
+                            'code': str(err.code()).replace("StatusCode.", "")
+                        }
+                    }
+                }
+
+                if should_sleep_interval > 0:
+                    payload['exception']['metadata']['sleep'] = should_sleep_interval
+
+                if should_abort is not True:
+                    payload['exception']['metadata']['abort'] = should_abort
+
+                await _filibuster_report_async(filibuster_url, payload)
+
+            raise err
+
+        await control_plane.run_async(_pop_execution_index, request_id_string, fork)
+
+        if _server_communication_enabled():
+            payload = {
+                'instrumentation_type': 'invocation_complete',
+                'generated_id': generated_id,
+                'execution_index': execution_index,
+                'vclock': vclock_todict(vclock),
+                'return_value': {
+                    '__class__': str(result.__class__.__name__)
+                }
+            }
+            await _filibuster_report_async(filibuster_url, payload)
+
+        return call
+
+
+class FilibusterAioServerInterceptor(grpc.aio.ServerInterceptor):
+    """Makes the context propagated with unary calls to a grpc.aio server available to the
+    calls that handling them makes."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+
+        # Only unary responses carry Filibuster context for now, as for synchronous servers.
+        if handler is None or handler.unary_unary is None:
+            return handler
+
+        behavior = handler.unary_unary
+        incoming = _filibuster_from_grpc_metadata(dict(handler_call_details.invocation_metadata or ()))
+
+        async def filibuster_behavior(request, context):
+            instrument_event_loop(asyncio.get_running_loop())
+
+            service_name = _filibuster_global_context_get_value("filibuster_service_name")
+            filibuster_url = _filibuster_global_context_get_value("filibuster_url")
+
+            ## *******************************************************************************************
+            ## START PARSE METADATA AND CONTEXT PROPAGATION
+            ## *******************************************************************************************
+
+            fields = dict(incoming)
+
+            # Assign request id if none is provided.
+            if fields['request_id'] is None:
+                fields['request_id'] = str(uuid.uuid4())
+            request_id = fields['request_id']
+
+            notice("request_id: " + str(request_id))
+            notice("execution_index: " + str(fields['execution_index']))
+
+            token = set_incoming_context(fields)
+            await control_plane.run_async(_filibuster_global_context_acquire_request, request_id)
+
+            ## *******************************************************************************************
+            ## END PARSE METADATA AND CONTEXT PROPAGATION
+            ## *******************************************************************************************
+
+            try:
+                if fields['generated_id'] and _server_communication_enabled():
+                    # Delivered before this service makes any calls or responds.
+                    await _filibuster_report_async(filibuster_url, {
+                        'instrumentation_type': 'request_received',
+                        'generated_id': str(fields['generated_id']),
+                        'execution_index': str(fields['execution_index']),
+                        'target_service_name': service_name,
+                        'test_epoch': fields['test_epoch']
+                    })
+
+                # If we should delay the request to simulate timeouts, do it.
+                sleep_interval = int(fields['forced_sleep'] or 0)
+                if sleep_interval > 0:
+                    await asyncio.sleep(sleep_interval)
+
+                result = behavior(request, context)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            finally:
+                # Make sure the server has seen everything this request did before responding.
+                await control_plane.run_async(_filibuster_flush)
+                await control_plane.run_async(_filibuster_global_context_release_request, request_id)
+                reset_incoming_context(token)
+
+        return grpc.unary_unary_rpc_method_handler(
+            filibuster_behavior,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
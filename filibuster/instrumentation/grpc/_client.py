@@ -24,11 +24,9 @@ import os
 import re
 import sys
 from collections import OrderedDict
-from threading import Lock
 from typing import MutableMapping
 
 import grpc
-import requests
 from grpc._channel import _RPCState
 from grpc._cython import cygrpc
 
@@ -48,10 +46,17 @@ from opentelemetry.trace.status import Status, StatusCode
 # both, Session.request and Session.send, since Session.request calls into Session.send
 from filibuster.logger import notice, warning, debug
 from filibuster.instrumentation.helpers import get_full_traceback_hash, counterexample_file, \
-    should_load_counterexample_file
-from filibuster.vclock import vclock_new, vclock_merge, vclock_fromstring, vclock_increment, vclock_tostring
+    should_load_counterexample_file, observe_test_epoch
+from filibuster.vclock import vclock_new, vclock_todict, vclock_merge, vclock_fromstring, vclock_increment
+from filibuster.instrumentation.reporter import report as _filibuster_report
+from filibuster.instrumentation.failure_plan import get_failure_plan, resolve_test_epoch, decide, new_generated_id
+from filibuster.instrumentation.exception_registry import exception_class as _filibuster_exception_class, \
+    status_code as _filibuster_status_code, preload as _filibuster_preload_exceptions
+from filibuster.instrumentation.propagation import grpc_metadata as _filibuster_grpc_metadata
 from filibuster.global_context import get_value as _filibuster_global_context_get_value
 from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.global_context import set_request_scoped_map as _filibuster_global_context_set_request_scoped_map
+from filibuster.global_context import request_mutex as _filibuster_global_context_request_mutex
 from filibuster.server_helpers import should_fail_request_with, load_counterexample
 from filibuster.instrumentation.helpers import get_full_traceback_hash
 
@@ -74,6 +79,12 @@ _FILIBUSTER_EXECUTION_INDEX_KEY = "filibuster_execution_index"
 # Key for the Filibuster request id in the context.
 _FILIBUSTER_REQUEST_ID_KEY = "filibuster_request_id"
 
+# Key for the Filibuster test epoch in the context.
+_FILIBUSTER_TEST_EPOCH_KEY = "filibuster_test_epoch"
+
+# Key for the Filibuster generated id of the request being processed in the context.
+_FILIBUSTER_GENERATED_ID_KEY = "filibuster_generated_id"
+
 # We're making an assumption here that test files start with test_ (Pytest)
 TEST_PREFIX = "test_"
 
@@ -82,15 +93,12 @@ INSTRUMENTATION_PREFIX = "filibuster/instrumentation"
 
 # Key for Filibuster vclock mapping.
 _FILIBUSTER_VCLOCK_BY_REQUEST_KEY = "filibuster_vclock_by_request"
-_filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, {})
-
-# Mutex for vclock and execution_index.
-ei_and_vclock_mutex = Lock()
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
 
 # Last used execution index.
 # (this is mutated under the same mutex as the vclock.)
 _FILIBUSTER_EI_BY_REQUEST_KEY = "filibuster_execution_indices_by_request"
-_filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, {})
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_EI_BY_REQUEST_KEY)
 
 # Service name, set from global context during instrumentor instantiation.
 service_name = None
@@ -98,8 +106,19 @@ service_name = None
 # Filibuster URL, set from global context during instrumentor instantiation.
 filibuster_url = None
 
-# Mutex for vclock and execution_index.
-ei_and_vclock_mutex = Lock()
+# Resolved once, rather than on every call.
+_SERVER_COMMUNICATION_DISABLED = bool(os.environ.get('DISABLE_SERVER_COMMUNICATION', ''))
+
+# Operations of the RPC state of injected faults.
+_UNARY_UNARY_INITIAL_DUE = (
+    cygrpc.OperationType.send_initial_metadata,
+    cygrpc.OperationType.send_message,
+    cygrpc.OperationType.send_close_from_client,
+    cygrpc.OperationType.receive_initial_metadata,
+    cygrpc.OperationType.receive_message,
+    cygrpc.OperationType.receive_status_on_client,
+)
+
 
 # End Filibuster configuration
 
@@ -132,6 +151,7 @@ if should_load_counterexample_file():
     counterexample = load_counterexample(counterexample_file())
     counterexample_test_execution = TestExecution.from_json(counterexample['TestExecution']) if counterexample else None
     print(counterexample_test_execution.failures)
+    _filibuster_preload_exceptions(counterexample_test_execution.failures)
 else:
     counterexample = None
 
@@ -141,25 +161,23 @@ def unique_request_hash(args):
     hex_digest = hashlib.md5(hash_string.encode()).hexdigest()
     return hex_digest
 
-## *******************************************************************************************
-## END FILIBUSTER HELPERS
-## *******************************************************************************************
-
-## *******************************************************************************************
-## START FILIBUSTER ENDPOINTS
-## *******************************************************************************************
+# Remove the call that just completed from the execution index of the current request.
+def _pop_execution_index():
+    request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
 
-def filibuster_update_url(url):
-    return "{}/{}/update".format(url, 'filibuster')
+    with _filibuster_global_context_request_mutex(request_id_string):
+        execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+        execution_index = execution_indices_by_request.get(request_id_string, None)
 
-def filibuster_create_url(url):
-    return "{}/{}/create".format(url, 'filibuster')
+        # Reset by a new test execution, or dropped, while the call was in flight: nothing to pop.
+        if execution_index is None:
+            debug("No execution index to pop for request " + str(request_id_string) + ".")
+            return
 
-def filibuster_new_test_execution_url(url, service):
-    return "{}/{}/new-test-execution/{}".format(url, 'filibuster', service)
+        execution_indices_by_request[request_id_string] = execution_index_pop(execution_index)
 
 ## *******************************************************************************************
-## END FILIBUSTER ENDPOINTS
+## END FILIBUSTER HELPERS
 ## *******************************************************************************************
 
 def _inject_span_context(metadata: MutableMapping[str, str]) -> None:
@@ -237,9 +255,6 @@ class OpenTelemetryClientInterceptor(
     def intercept_unary(self, request, metadata, client_info, invoker):
         notice("Interceptor invoked!")
 
-        global ei_and_vclock_mutex
-        ei_and_vclock_mutex.acquire()
-
         ## *******************************************************************************************
         ## START CALLSITE INFORMATION
         ## *******************************************************************************************
@@ -259,108 +274,98 @@ class OpenTelemetryClientInterceptor(
         request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
         notice("request_id_string: " + str(request_id_string))
 
-        # Figure out if this is the first request in a new test execution.
-        debug("Setting Filibuster instrumentation key...")
-        token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
-        response = None
-        if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
-            response = requests.get(filibuster_new_test_execution_url(filibuster_url, service_name))
-            if response is not None:
-                response = response.json()
-                notice("clock reset response: " + str(response))
-        debug("Removing instrumentation key for Filibuster.")
-        context.detach(token)
-
-        # Reset EI and vclock if this is a new test execution.
-        if response and ('new-test-execution' in response) and (response['new-test-execution']):
-            vclocks_by_request = {request_id_string: vclock_new()}
-            _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
+        # Test execution this call belongs to; calls not triggered by an instrumented request (e.g.
+        # from the test) get it from the failure plan.
+        test_epoch = context.get_value(_FILIBUSTER_TEST_EPOCH_KEY)
+        if not _SERVER_COMMUNICATION_DISABLED and counterexample is None:
+            test_epoch = resolve_test_epoch(filibuster_url, test_epoch)
+        notice("test_epoch: " + str(test_epoch))
 
-            execution_indices_by_request = {request_id_string: execution_index_new()}
-            _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
+        # Reset EI and vclock if this call belongs to a new test execution, before advancing them.
+        observe_test_epoch(test_epoch)
 
         ## *******************************************************************************************
         ## END CLOCK RESET
         ## *******************************************************************************************
 
-        ## *******************************************************************************************
-        ## START INCOMING AND LOCAL CLOCK WORK
-        ## *******************************************************************************************
-
-        # Incoming clock from the request that triggered this service to be reached.
-        incoming_vclock_string = context.get_value(_FILIBUSTER_VCLOCK_KEY)
-
-        # If it's not none, we probably need to merge with our clock, first, since our clock is keeping
-        # track of *our* requests from this node.
-        if incoming_vclock_string is not None:
-            incoming_vclock = vclock_fromstring(incoming_vclock_string)
+        # Only calls made on behalf of the same request wait for each other while their clocks advance.
+        with _filibuster_global_context_request_mutex(request_id_string):
+            ## *******************************************************************************************
+            ## START INCOMING AND LOCAL CLOCK WORK
+            ## *******************************************************************************************
+
+            # Incoming clock from the request that triggered this service to be reached.
+            incoming_vclock_string = context.get_value(_FILIBUSTER_VCLOCK_KEY)
+
+            # If it's not none, we probably need to merge with our clock, first, since our clock is keeping
+            # track of *our* requests from this node.
+            if incoming_vclock_string is not None:
+                incoming_vclock = vclock_fromstring(incoming_vclock_string)
+                vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+                local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
+                new_local_vclock = vclock_merge(incoming_vclock, local_vclock)
+                vclocks_by_request[request_id_string] = new_local_vclock
+                _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
+
+            # Finally, advance the clock to account for this request.
             vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
             local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
-            new_local_vclock = vclock_merge(incoming_vclock, local_vclock)
+            new_local_vclock = vclock_increment(local_vclock, service_name)
             vclocks_by_request[request_id_string] = new_local_vclock
             _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
+            vclock = vclocks_by_request.get(request_id_string, vclock_new())
 
-        # Finally, advance the clock to account for this request.
-        vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
-        local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
-        new_local_vclock = vclock_increment(local_vclock, service_name)
-        vclocks_by_request[request_id_string] = new_local_vclock
-        _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
-        vclock = vclocks_by_request.get(request_id_string, vclock_new())
+            notice("clock now: " + str(vclocks_by_request.get(request_id_string, vclock_new())))
 
-        notice("clock now: " + str(vclocks_by_request.get(request_id_string, vclock_new())))
+            ## *******************************************************************************************
+            ## END INCOMING AND LOCAL CLOCK WORK
+            ## *******************************************************************************************
 
-        ## *******************************************************************************************
-        ## END INCOMING AND LOCAL CLOCK WORK
-        ## *******************************************************************************************
+            ## *******************************************************************************************
+            ## START EXECUTION INDEX WORK
+            ## *******************************************************************************************
 
-        ## *******************************************************************************************
-        ## START EXECUTION INDEX WORK
-        ## *******************************************************************************************
-
-        # Get incoming execution index.
-        incoming_execution_index_string = context.get_value(_FILIBUSTER_EXECUTION_INDEX_KEY)
-
-        if incoming_execution_index_string is not None:
-            incoming_execution_index = execution_index_fromstring(incoming_execution_index_string)
-        else:
-            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-            incoming_execution_index = execution_indices_by_request.get(request_id_string, execution_index_new())
+            # Get incoming execution index.
+            incoming_execution_index_string = context.get_value(_FILIBUSTER_EXECUTION_INDEX_KEY)
 
-        execution_index_hash = unique_request_hash([full_traceback_hash])
+            if incoming_execution_index_string is not None:
+                incoming_execution_index = execution_index_fromstring(incoming_execution_index_string)
+            else:
+                execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+                incoming_execution_index = execution_indices_by_request.get(request_id_string, execution_index_new())
 
-        # Advance execution index.
-        execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-        execution_indices_by_request[request_id_string] = execution_index_push(execution_index_hash, incoming_execution_index)
-        _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
-        execution_index = execution_index_tostring(execution_indices_by_request[request_id_string])
+            execution_index_hash = unique_request_hash([full_traceback_hash])
 
-        notice("execution index now: " + str(execution_index_tostring(execution_indices_by_request[request_id_string])))
+            # Advance execution index.
+            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+            execution_indices_by_request[request_id_string] = execution_index_push(execution_index_hash, incoming_execution_index)
+            _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
+            execution_index = execution_index_tostring(execution_indices_by_request[request_id_string])
 
-        ## *******************************************************************************************
-        ## END EXECUTION INDEX WORK
-        ## *******************************************************************************************
+            notice("execution index now: " + str(execution_index_tostring(execution_indices_by_request[request_id_string])))
 
-        ## *******************************************************************************************
-        ## START ORIGIN CLOCK WORK
-        ## *******************************************************************************************
+            ## *******************************************************************************************
+            ## END EXECUTION INDEX WORK
+            ## *******************************************************************************************
 
-        # Get the incoming origin vclock from the context.
-        incoming_origin_vclock_string = context.get_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY)
+            ## *******************************************************************************************
+            ## START ORIGIN CLOCK WORK
+            ## *******************************************************************************************
 
-        # Either use the incoming clock as origin or set to an empty clock.
-        if incoming_origin_vclock_string is not None:
-            origin_vclock = vclock_fromstring(incoming_origin_vclock_string)
-        else:
-            origin_vclock = vclock_new()
+            # Get the incoming origin vclock from the context.
+            incoming_origin_vclock_string = context.get_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY)
 
-        notice("origin_clock: " + str(origin_vclock))
+            # Either use the incoming clock as origin or set to an empty clock.
+            if incoming_origin_vclock_string is not None:
+                origin_vclock = vclock_fromstring(incoming_origin_vclock_string)
+            else:
+                origin_vclock = vclock_new()
 
-        ## *******************************************************************************************
-        ## END ORIGIN CLOCK WORK
-        ## *******************************************************************************************
+            notice("origin_clock: " + str(origin_vclock))
 
-        ei_and_vclock_mutex.release()
+            ## *******************************************************************************************
+            ## END ORIGIN CLOCK WORK
+            ## *******************************************************************************************
 
         ## *******************************************************************************************
         ## START RECORD CALL WORK
@@ -396,8 +401,8 @@ class OpenTelemetryClientInterceptor(
                 'callsite_line': callsite_line,
                 'full_traceback': full_traceback_hash,
                 'metadata': {},
-                'vclock': vclock,
-                'origin_vclock': origin_vclock,
+                'vclock': vclock_todict(vclock),
+                'origin_vclock': vclock_todict(origin_vclock),
                 'execution_index': execution_index
             }
 
@@ -410,11 +415,18 @@ class OpenTelemetryClientInterceptor(
                 if response is None:
                     response = {'execution_index': execution_index}
                 print(response)
-            elif os.environ.get('DISABLE_SERVER_COMMUNICATION', ''):
+            elif _SERVER_COMMUNICATION_DISABLED:
                 warning("Server communication disabled.")
             else:
-                warning("Issuing request")
-                response = requests.put(filibuster_create_url(filibuster_url), json=payload)
+                # Decide locally using the failure plan for this test execution and notify the server.
+                failure_plan = get_failure_plan(filibuster_url, test_epoch)
+                if failure_plan is not None:
+                    generated_id = new_generated_id()
+                    payload['client_generated_id'] = generated_id
+                    payload['parent_generated_id'] = context.get_value(_FILIBUSTER_GENERATED_ID_KEY)
+                    payload['test_epoch'] = failure_plan['test_epoch']
+                    _filibuster_report(filibuster_url, payload)
+                    response = decide(failure_plan, generated_id, payload)
         except Exception as e:
             warning("Exception raised (invocation)!")
             print(e, file=sys.stderr)
@@ -463,19 +475,10 @@ class OpenTelemetryClientInterceptor(
         ## Start generate exception instance from exception description.
         ## -------------------------------------------------------------
 
-        _UNARY_UNARY_INITIAL_DUE = (
-            cygrpc.OperationType.send_initial_metadata,
-            cygrpc.OperationType.send_message,
-            cygrpc.OperationType.send_close_from_client,
-            cygrpc.OperationType.receive_initial_metadata,
-            cygrpc.OperationType.receive_message,
-            cygrpc.OperationType.receive_status_on_client,
-        )
-
         if exception and exception_code:
-            exception_class = eval(exception)
+            exception_class = _filibuster_exception_class(exception)
+            exception_code = _filibuster_status_code(exception_code)
             exception = exception_class(_RPCState(_UNARY_UNARY_INITIAL_DUE, None, None, None, None))
-            exception_code = eval("grpc.StatusCode." + exception_code)
             exception._state.code = exception_code
 
         ## -------------------------------------------------------------
@@ -501,12 +504,8 @@ class OpenTelemetryClientInterceptor(
 
         if not metadata:
             metadata = []
-        metadata.append(('x-filibuster-generated-id', str(generated_id)))
-        metadata.append(('x-filibuster-vclock', vclock_tostring(vclock)))
-        metadata.append(('x-filibuster-origin-vclock', vclock_tostring(origin_vclock)))
-        metadata.append(('x-filibuster-execution-index', execution_index))
-        metadata.append(('x-filibuster-request-id', request_id_string))
-        metadata.append(('x-filibuster-forced-sleep', str(should_sleep_interval)))
+        metadata.extend(_filibuster_grpc_metadata(generated_id, vclock, origin_vclock, execution_index,
+                                                  request_id_string, test_epoch, should_sleep_interval))
 
         notice("metadata after: " + str(metadata))
 
@@ -541,13 +540,10 @@ class OpenTelemetryClientInterceptor(
                 ## *******************************************************************************************
 
                 # Remove request from the execution index.
-                execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-                request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
-                execution_indices_by_request[request_id_string] = execution_index_pop(execution_indices_by_request.get(request_id_string, execution_index_new()))
-                _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
+                _pop_execution_index()
 
                 # Notify the Filibuster server that the call succeeded.
-                if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
+                if not _SERVER_COMMUNICATION_DISABLED and counterexample is None:
                     try:
                         debug("Setting Filibuster instrumentation key...")
                         token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
@@ -556,7 +552,7 @@ class OpenTelemetryClientInterceptor(
                             'instrumentation_type': 'invocation_complete',
                             'generated_id': generated_id,
                             'execution_index': execution_index,
-                            'vclock': vclock,
+                            'vclock': vclock_todict(vclock),
                             'exception': {
                                 'name': "grpc._channel._InactiveRpcError",
                                 'metadata': {
@@ -571,7 +567,7 @@ class OpenTelemetryClientInterceptor(
                         if should_abort is not True:
                             payload['exception']['metadata']['abort'] = should_abort
 
-                        requests.post(filibuster_update_url(filibuster_url), json=payload)
+                        _filibuster_report(filibuster_url, payload)
                     except Exception as e:
                         warning("Exception raised recording exceptional response!")
                         print(e, file=sys.stderr)
@@ -593,13 +589,10 @@ class OpenTelemetryClientInterceptor(
                     ## *******************************************************************************************
 
                     # Remove request from the execution index.
-                    execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-                    request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
-                    execution_indices_by_request[request_id_string] = execution_index_pop(execution_indices_by_request.get(request_id_string, execution_index_new()))
-                    _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
+                    _pop_execution_index()
 
                     # Notify the Filibuster server that the call succeeded.
-                    if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
+                    if not _SERVER_COMMUNICATION_DISABLED and counterexample is None:
                         try:
                             debug("Setting Filibuster instrumentation key...")
                             token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
@@ -611,10 +604,10 @@ class OpenTelemetryClientInterceptor(
                                 'instrumentation_type': 'invocation_complete',
                                 'generated_id': generated_id,
                                 'execution_index': execution_index,
-                                'vclock': vclock,
+                                'vclock': vclock_todict(vclock),
                                 'return_value': return_value
                             }
-                            requests.post(filibuster_update_url(filibuster_url), json=payload)
+                            _filibuster_report(filibuster_url, payload)
                         except Exception as e:
                             warning("Exception raised recording successful response!")
                             print(e, file=sys.stderr)
@@ -633,13 +626,10 @@ class OpenTelemetryClientInterceptor(
                     ## *******************************************************************************************
 
                     # Remove request from the execution index.
-                    execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-                    request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
-                    execution_indices_by_request[request_id_string] = execution_index_pop(execution_indices_by_request.get(request_id_string, execution_index_new()))
-                    _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
+                    _pop_execution_index()
 
                     # Notify the Filibuster server that the call succeeded.
-                    if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
+                    if not _SERVER_COMMUNICATION_DISABLED and counterexample is None:
                         try:
                             debug("Setting Filibuster instrumentation key...")
                             token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
@@ -648,7 +638,7 @@ class OpenTelemetryClientInterceptor(
                                 'instrumentation_type': 'invocation_complete',
                                 'generated_id': generated_id,
                                 'execution_index': execution_index,
-                                'vclock': vclock,
+                                'vclock': vclock_todict(vclock),
                                 'exception': {
                                     'name': "grpc._channel._InactiveRpcError",
                                     'metadata': {
@@ -663,7 +653,7 @@ class OpenTelemetryClientInterceptor(
                             if should_abort is not True:
                                 payload['exception']['metadata']['abort'] = should_abort
 
-                            requests.post(filibuster_update_url(filibuster_url), json=payload)
+                            _filibuster_report(filibuster_url, payload)
                         except Exception as e:
                             warning("Exception raised recording exceptional response!")
                             print(e, file=sys.stderr)
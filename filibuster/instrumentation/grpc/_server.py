@@ -29,7 +29,6 @@ import uuid
 from contextlib import contextmanager
 
 import grpc
-import requests
 
 from opentelemetry import propagators, trace
 from opentelemetry.context import attach, detach, set_value
@@ -37,13 +36,17 @@ from opentelemetry.trace.propagation.textmap import DictGetter
 from opentelemetry.trace.status import Status, StatusCode
 
 from filibuster.datatypes import TestExecution
-from filibuster.instrumentation.helpers import should_load_counterexample_file, counterexample_file
+from filibuster.instrumentation.helpers import should_load_counterexample_file, counterexample_file, \
+    set_incoming_context, reset_incoming_context
+from filibuster.instrumentation.reporter import report as _filibuster_report, flush as _filibuster_flush
+from filibuster.instrumentation.propagation import from_grpc_metadata as _filibuster_from_grpc_metadata
 from filibuster.logger import notice, debug, warning
 from filibuster.server_helpers import load_counterexample
-from filibuster.vclock import vclock_fromstring
 
 from filibuster.global_context import get_value as _filibuster_global_context_get_value
 from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.global_context import acquire_request as _filibuster_global_context_acquire_request
+from filibuster.global_context import release_request as _filibuster_global_context_release_request
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,8 @@ _FILIBUSTER_VCLOCK_KEY = "filibuster_vclock"
 _FILIBUSTER_ORIGIN_VCLOCK_KEY = "filibuster_origin_vclock"
 _FILIBUSTER_EXECUTION_INDEX_KEY = "filibuster_execution_index"
 _FILIBUSTER_REQUEST_ID_KEY = "filibuster_request_id"
+_FILIBUSTER_TEST_EPOCH_KEY = "filibuster_test_epoch"
+_FILIBUSTER_GENERATED_ID_KEY = "filibuster_generated_id"
 
 # Service name, set from global context during instrumentor instantiation.
 service_name = None
@@ -75,17 +80,6 @@ else:
 ## END FILIBUSTER CONSTANTS
 ## *******************************************************************************************
 
-## *******************************************************************************************
-## START FILIBUSTER ENDPOINTS
-## *******************************************************************************************
-
-def filibuster_update_url(url):
-    return "{}/{}/update".format(url, 'filibuster')
-
-## *******************************************************************************************
-## END FILIBUSTER ENDPOINTS
-## *******************************************************************************************
-
 # wrap an RPC call
 # see https://github.com/grpc/grpc/issues/18191
 def _wrap_rpc_behavior(handler, continuation):
@@ -312,28 +306,26 @@ class OpenTelemetryServerInterceptor(grpc.ServerInterceptor):
 
                 metadata = dict(context.invocation_metadata())
 
-                request_id = None
                 sleep_interval = 0
 
-                # Parse incoming metadata.
+                # Parse incoming metadata (the context metadata, or the legacy metadata.)
+                incoming = _filibuster_from_grpc_metadata(metadata)
 
-                if 'x-filibuster-request-id' in metadata:
-                    request_id = metadata['x-filibuster-request-id']
+                request_id = incoming['request_id']
+                test_epoch = incoming['test_epoch']
+                generated_id = incoming['generated_id']
+                vclock_str = incoming['vclock']
+                origin_vclock_str = incoming['origin_vclock']
+                execution_index = incoming['execution_index']
 
-                generated_id = metadata['x-filibuster-generated-id']
-                vclock_str = metadata['x-filibuster-vclock']
-                vclock = vclock_fromstring(vclock_str)
-                origin_vclock_str = metadata['x-filibuster-origin-vclock']
-                origin_vclock = vclock_fromstring(origin_vclock_str)
-                execution_index = metadata['x-filibuster-execution-index']
-
-                if 'x-filibuster-forced-sleep' in metadata:
-                    sleep_interval = int(metadata['x-filibuster-forced-sleep'])
+                if incoming['forced_sleep'] is not None:
+                    sleep_interval = int(incoming['forced_sleep'])
 
                 notice("request_id: " + str(request_id))
+                notice("test_epoch: " + str(test_epoch))
                 notice("generated_id: " + str(generated_id))
-                notice("vclock: " + str(vclock))
-                notice("origin_vclock: " + str(origin_vclock))
+                notice("vclock: " + str(vclock_str))
+                notice("origin_vclock: " + str(origin_vclock_str))
                 notice("execution_index: " + str(execution_index))
                 notice("sleep_interval: " + str(sleep_interval))
 
@@ -344,8 +336,11 @@ class OpenTelemetryServerInterceptor(grpc.ServerInterceptor):
                 # Attach metadata to thread context.
                 attach(set_value(_FILIBUSTER_VCLOCK_KEY, vclock_str))
                 attach(set_value(_FILIBUSTER_REQUEST_ID_KEY, request_id))
-                attach(set_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY, origin_vclock))
+                # Clocks stay serialized in the context, as the client instrumentation expects.
+                attach(set_value(_FILIBUSTER_ORIGIN_VCLOCK_KEY, origin_vclock_str))
                 attach(set_value(_FILIBUSTER_EXECUTION_INDEX_KEY, execution_index))
+                attach(set_value(_FILIBUSTER_TEST_EPOCH_KEY, test_epoch))
+                attach(set_value(_FILIBUSTER_GENERATED_ID_KEY, generated_id))
 
                 ## *******************************************************************************************
                 ## END PARSE METADATA AND CONTEXT PROPAGATION
@@ -362,20 +357,14 @@ class OpenTelemetryServerInterceptor(grpc.ServerInterceptor):
                         'instrumentation_type': 'request_received',
                         'generated_id': str(generated_id),
                         'execution_index': str(execution_index),
-                        'target_service_name': service_name
+                        'target_service_name': service_name,
+                        'test_epoch': test_epoch
                     }
 
                     if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
-                        warning("Making a call to the server.")
-                        try:
-                            token = attach(set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
-                            requests.post(filibuster_update_url(filibuster_url), json=payload)
-                        except Exception as e:
-                            warning("Exception raised during instrumentation (_record_successful_response)!")
-                            print(e, file=sys.stderr)
-                        finally:
-                            notice("Removing instrumentation key for Filibuster.")
-                            detach(token)
+                        # Delivered before this service makes any calls or responds.
+                        notice("Reporting request received to the server.")
+                        _filibuster_report(filibuster_url, payload)
                 else:
                     notice("No generated id.")
 
@@ -395,6 +384,12 @@ class OpenTelemetryServerInterceptor(grpc.ServerInterceptor):
                 ## END SLEEP INTERVAL
                 ## *******************************************************************************************
 
+                # Vclock and execution index state for this request id is kept until the call completes.
+                _filibuster_global_context_acquire_request(request_id)
+
+                # Also made available to work forked from this call (e.g. on thread pools.)
+                incoming_token = set_incoming_context(dict(incoming, request_id=request_id))
+
                 with self._set_remote_context(context):
                     with self._start_span(
                         handler_call_details, context
@@ -415,6 +410,12 @@ class OpenTelemetryServerInterceptor(grpc.ServerInterceptor):
                                 span.record_exception(error)
                             raise error
 
+                        finally:
+                            # Make sure the server has seen everything this request did before responding.
+                            _filibuster_flush()
+                            _filibuster_global_context_release_request(request_id)
+                            reset_incoming_context(incoming_token)
+
             return telemetry_interceptor
 
         return _wrap_rpc_behavior(
@@ -1,9 +1,17 @@
 import os
-import traceback
+import sys
 import re
 import hashlib
+import functools
+import contextvars
+import linecache
 from os.path import exists
 
+from filibuster.global_context import get_value as _filibuster_global_context_get_value
+from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.global_context import share_value as _filibuster_global_context_share_value
+from filibuster.global_context import global_mutex as _filibuster_global_context_global_mutex
+from filibuster.global_context import request_mutex as _filibuster_global_context_request_mutex
 from filibuster.logger import info, debug
 
 # We're making an assumption here that test files start with test_ (Pytest)
@@ -12,6 +20,34 @@ TEST_PREFIX = "test_"
 # We're making an assumption here that test files start with test_ (Pytest)
 INSTRUMENTATION_PREFIX = "filibuster/instrumentation"
 
+# Key for the Filibuster test epoch in the context.
+_FILIBUSTER_TEST_EPOCH_KEY = "filibuster_test_epoch"
+
+# Key for the last test epoch observed by this service.
+_FILIBUSTER_LAST_TEST_EPOCH_KEY = "filibuster_last_test_epoch"
+_filibuster_global_context_share_value(_FILIBUSTER_LAST_TEST_EPOCH_KEY)
+
+# Keys for the per-request vclock and execution index mappings.
+_FILIBUSTER_VCLOCK_BY_REQUEST_KEY = "filibuster_vclock_by_request"
+_FILIBUSTER_EI_BY_REQUEST_KEY = "filibuster_execution_indices_by_request"
+
+
+# Context of the inbound request being handled, for asyncio instrumentation: the fields decoded by
+# filibuster.instrumentation.propagation (request id, vclock, origin vclock, execution index, ...)
+_filibuster_incoming_context = contextvars.ContextVar('filibuster_incoming_context', default=None)
+
+
+def get_incoming_context():
+    return _filibuster_incoming_context.get()
+
+
+def set_incoming_context(incoming):
+    return _filibuster_incoming_context.set(incoming)
+
+
+def reset_incoming_context(token):
+    _filibuster_incoming_context.reset(token)
+
 
 def counterexample_file():
     return os.environ.get('COUNTEREXAMPLE_FILE', '')
@@ -21,12 +57,113 @@ def should_load_counterexample_file():
     return exists(counterexample_file())
 
 
+# Whether client calls can be left uninstrumented: with server communication disabled and no
+# counterexample to replay, nothing is injected, recorded or propagated.  Checked when instrumenting.
+def should_passthrough():
+    return bool(os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and not should_load_counterexample_file()
+
+
+# Upper bound on the number of memoized callsites.
+MAX_MEMOIZED_CALLSITES = 100000
+
+_callsites = {}
+
+
+@functools.lru_cache(maxsize=MAX_MEMOIZED_CALLSITES)
+def _format_frame(code, lineno):
+    # Same format as traceback.format_stack().
+    formatted = '  File "{}", line {}, in {}\n'.format(code.co_filename, lineno, code.co_name)
+    line = linecache.getline(code.co_filename, lineno).strip()
+    if line:
+        formatted += '    {}\n'.format(line)
+
+    raw_quotes = formatted.split("\"")
+    revised_quotes = []
+    # Filter the stacktrace only to the filibuster and app code.
+    is_filibuster_stacktrace = False
+    for quote in raw_quotes:
+        # Analyze paths.
+        if "/" in quote:
+            # Remove information about which python version we are using.
+            if "python" in quote:
+                quote = quote.split("python", 1)[1]
+                if "/" in quote and quote[0] != "/":
+                    quote = quote.split("/", 1)[1]
+            # Remove absolute path information and keep things relative only to filibuster.
+            elif "filibuster" in quote:
+                quote = quote.split("filibuster", 1)[1]
+                is_filibuster_stacktrace = True
+        revised_quotes.append(quote)
+
+    if is_filibuster_stacktrace:
+        normalized = "\"".join(revised_quotes)
+    else:
+        normalized = None
+
+    return formatted, normalized
+
+
+# Reset the per-request vclocks and execution indexes the first time a newer test epoch is observed.
+# Callers observe the test epoch of a call before advancing its vclock and execution index, and must not
+# hold any request's mutex while doing so.
+def observe_test_epoch(test_epoch):
+    # Propagated as a string; 'None' when the caller didn't know the test epoch.
+    if test_epoch is None or str(test_epoch) == 'None':
+        return False
+
+    test_epoch = int(test_epoch)
+
+    # Other worker processes may observe the same test epoch concurrently.
+    with _filibuster_global_context_global_mutex():
+        last_test_epoch = _filibuster_global_context_get_value(_FILIBUSTER_LAST_TEST_EPOCH_KEY)
+
+        if last_test_epoch is not None and test_epoch <= last_test_epoch:
+            return False
+
+        debug("New test execution (epoch " + str(test_epoch) + "). Resetting vclocks_by_request and "
+              "execution_indices_by_request.")
+        _filibuster_global_context_set_value(_FILIBUSTER_LAST_TEST_EPOCH_KEY, test_epoch)
+
+        # Cleared in place: the maps are request-scoped maps shared with the instrumentation.  Each
+        # request's entries are removed holding its mutex, which every instrumentation (requests, aio,
+        # gRPC) holds while it advances or pops them, so a reset never interleaves with an update.
+        maps = [_filibuster_global_context_get_value(key)
+                for key in [_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, _FILIBUSTER_EI_BY_REQUEST_KEY]]
+        maps = [by_request for by_request in maps if by_request is not None]
+
+        request_ids = set()
+        for by_request in maps:
+            request_ids.update(list(by_request.keys()))
+
+        for request_id in request_ids:
+            with _filibuster_global_context_request_mutex(request_id):
+                for by_request in maps:
+                    by_request.pop(request_id, None)
+
+    return True
+
+
 def get_full_traceback_hash(service_name):
+    # Walk the stack, outermost frame first.  As with traceback.format_stack(), which this replaces,
+    # the frames hashed include this function's own.
+    frame = sys._getframe(0)
+    frame_keys = [(frame.f_code, frame.f_lineno)]
+    frame = frame.f_back
+    while frame is not None:
+        frame_keys.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    frame_keys.reverse()
+
+    key = (service_name, tuple(frame_keys))
+    if key in _callsites:
+        return _callsites[key]
+
     raw_callsite = None
 
-    for line in traceback.format_stack():
-        if service_name in line and TEST_PREFIX not in line and INSTRUMENTATION_PREFIX not in line:
-            raw_callsite = line
+    for (code, lineno) in frame_keys:
+        (formatted, normalized) = _format_frame(code, lineno)
+        if service_name in formatted and TEST_PREFIX not in formatted and INSTRUMENTATION_PREFIX not in formatted:
+            raw_callsite = formatted
             break
 
     cs_search = re.compile("File \"(.*)\", line (.*), in")
@@ -38,29 +175,17 @@ def get_full_traceback_hash(service_name):
     debug("=> callsite_line: " + callsite_line)
 
     tracebacks = []
-    for _traceback in traceback.format_stack():
-        raw_quotes = _traceback.split("\"")
-        revised_quotes = []
-        # Filter the stacktrace only to the filibuster and app code.
-        is_filibuster_stacktrace = False
-        for quote in raw_quotes:
-            # Analyze paths.
-            if "/" in quote:
-                # Remove information about which python version we are using.
-                if "python" in quote:
-                    quote = quote.split("python",1)[1] 
-                    if "/" in quote and quote[0] != "/":
-                        quote = quote.split("/",1)[1]
-                # Remove absolute path information and keep things relative only to filibuster.
-                elif "filibuster" in quote: 
-                    quote = quote.split("filibuster",1)[1]
-                    is_filibuster_stacktrace = True
-            revised_quotes.append(quote)
-        if is_filibuster_stacktrace:
-            curr_traceback = "\"".join(revised_quotes)
-            tracebacks.append(curr_traceback)
+    for (code, lineno) in frame_keys:
+        (formatted, normalized) = _format_frame(code, lineno)
+        if normalized is not None:
+            tracebacks.append(normalized)
 
     full_traceback = "\n".join(tracebacks)
     full_traceback_hash = hashlib.md5(full_traceback.encode()).hexdigest()
 
-    return callsite_file, callsite_line, full_traceback_hash
\ No newline at end of file
+    if len(_callsites) >= MAX_MEMOIZED_CALLSITES:
+        _callsites.clear()
+
+    _callsites[key] = (callsite_file, callsite_line, full_traceback_hash)
+
+    return callsite_file, callsite_line, full_traceback_hash
@@ -0,0 +1,89 @@
+"""
+Instrument httpx asynchronous clients.
+
+Usage::
+
+    HttpxInstrumentor().instrument(service_name=..., filibuster_url=...)
+
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url)
+
+"""
+
+import os
+
+import httpx
+from wrapt import wrap_function_wrapper as _wrap
+
+from opentelemetry.instrumentation.instrumentor import BaseInstrumentor
+from opentelemetry.instrumentation.utils import unwrap
+
+from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.instrumentation.aio import instrumented_call
+from filibuster.instrumentation.forking import instrument_task_creation, uninstrument_task_creation
+from filibuster.instrumentation.helpers import should_passthrough
+from filibuster.logger import debug
+
+
+def _metadata(request):
+    metadata = {}
+
+    timeout = request.extensions.get('timeout', {}).get('read', None)
+    if timeout is not None:
+        debug("=> timeout for call is set to " + str(timeout))
+        metadata['timeout'] = timeout
+
+    if request.url.scheme == 'https':
+        metadata['ssl'] = True
+
+    return metadata
+
+
+async def _instrumented_send(wrapped, instance, args, kwargs):
+    request = args[0] if args else kwargs['request']
+
+    async def send(additional_headers):
+        # Merge headers: don't worry about collisions, we're only adding information.
+        request.headers.update(additional_headers)
+        return await wrapped(*args, **kwargs)
+
+    def fake_response(status_code, content, result):
+        return httpx.Response(status_code, headers={'Content-Type': 'text/html'}, content=content, request=request)
+
+    async def response_summary(result):
+        # Streamed responses are left for the caller to read.
+        try:
+            return result.status_code, result.content
+        except httpx.ResponseNotRead:
+            return result.status_code, b''
+
+    return await instrumented_call('httpx', request.method, request.url, _metadata(request),
+                                   send, fake_response, response_summary)
+
+
+class HttpxInstrumentor(BaseInstrumentor):
+    """
+    Globally instrument httpx asynchronous clients.
+
+    Every request made through :code:`httpx.AsyncClient.send` (this includes
+    :code:`client.get`, :code:`client.stream`, etc.) is instrumented.
+    """
+
+    def _instrument(self, **kwargs):
+        if os.environ.get('DISABLE_INSTRUMENTATION', ''):
+            debug("Not instrumenting. DISABLE_INSTRUMENTATION set.")
+            return
+
+        _filibuster_global_context_set_value("filibuster_service_name", kwargs['service_name'])
+        _filibuster_global_context_set_value("filibuster_url", kwargs['filibuster_url'])
+
+        if should_passthrough():
+            debug("Not instrumenting httpx. DISABLE_SERVER_COMMUNICATION set and no counterexample.")
+            return
+
+        instrument_task_creation()
+        _wrap("httpx", "AsyncClient.send", _instrumented_send)
+
+    def _uninstrument(self, **kwargs):
+        unwrap(httpx.AsyncClient, "send")
+        uninstrument_task_creation()
@@ -0,0 +1,101 @@
+"""Handling of inbound requests shared by the WSGI and ASGI middleware.
+
+Does what the Flask instrumentation does before and after each request: attach the incoming
+context (to the OpenTelemetry context, for the requests instrumentation, and to the
+incoming contextvar, for the asyncio clients and forked work), keep the request's vclock and
+execution index state while it is handled, and report that the request was received.
+"""
+
+import os
+import uuid
+
+from opentelemetry import context
+
+from filibuster.datatypes import TestExecution
+from filibuster.global_context import acquire_request as _filibuster_global_context_acquire_request
+from filibuster.global_context import release_request as _filibuster_global_context_release_request
+from filibuster.instrumentation.helpers import should_load_counterexample_file, counterexample_file, \
+    set_incoming_context, reset_incoming_context
+from filibuster.instrumentation.reporter import report as _filibuster_report
+from filibuster.logger import notice, debug
+from filibuster.server_helpers import load_counterexample
+
+_FILIBUSTER_VCLOCK_KEY = "filibuster_vclock"
+_FILIBUSTER_ORIGIN_VCLOCK_KEY = "filibuster_origin_vclock"
+_FILIBUSTER_EXECUTION_INDEX_KEY = "filibuster_execution_index"
+_FILIBUSTER_REQUEST_ID_KEY = "filibuster_request_id"
+_FILIBUSTER_TEST_EPOCH_KEY = "filibuster_test_epoch"
+_FILIBUSTER_GENERATED_ID_KEY = "filibuster_generated_id"
+
+# Context keys of the fields of an incoming context, attached when it carries an execution index.
+_CONTEXT_KEYS = [
+    ('generated_id', _FILIBUSTER_GENERATED_ID_KEY),
+    ('execution_index', _FILIBUSTER_EXECUTION_INDEX_KEY),
+    ('vclock', _FILIBUSTER_VCLOCK_KEY),
+    ('origin_vclock', _FILIBUSTER_ORIGIN_VCLOCK_KEY),
+    ('test_epoch', _FILIBUSTER_TEST_EPOCH_KEY),
+]
+
+if should_load_counterexample_file():
+    notice("Counterexample file present!")
+    counterexample = load_counterexample(counterexample_file())
+    counterexample_test_execution = TestExecution.from_json(counterexample['TestExecution']) if counterexample else None
+else:
+    counterexample = None
+    counterexample_test_execution = None
+
+
+class InboundRequest:
+    """An inbound request being handled, and what to undo when it completes."""
+
+    __slots__ = ('request_id', 'sleep_interval', 'tokens', 'incoming_token')
+
+    def __init__(self, request_id, sleep_interval, tokens, incoming_token):
+        self.request_id = request_id
+        self.sleep_interval = sleep_interval
+        self.tokens = tokens
+        self.incoming_token = incoming_token
+
+
+def begin_request(incoming, service_name, filibuster_url):
+    # Generate a new unique request_id if one doesn't already exist (new request), otherwise use
+    # the existing one.
+    request_id = incoming['request_id']
+    if request_id is None:
+        request_id = str(uuid.uuid4())
+    debug("request_id: " + request_id)
+
+    tokens = [context.attach(context.set_value(_FILIBUSTER_REQUEST_ID_KEY, request_id))]
+
+    # Vclock and execution index state for this request id is kept until the request completes.
+    _filibuster_global_context_acquire_request(request_id)
+
+    if incoming['execution_index'] is not None:
+        for (field, key) in _CONTEXT_KEYS:
+            if incoming[field] is not None:
+                tokens.append(context.attach(context.set_value(key, incoming[field])))
+
+        if not os.environ.get('DISABLE_SERVER_COMMUNICATION', '') and counterexample is None:
+            # Delivered before this service makes any calls or responds.
+            _filibuster_report(filibuster_url, {
+                'instrumentation_type': 'request_received',
+                'generated_id': str(incoming['generated_id']),
+                'execution_index': str(incoming['execution_index']),
+                'target_service_name': service_name,
+                'test_epoch': incoming['test_epoch']
+            })
+
+    incoming_token = set_incoming_context(dict(incoming, request_id=request_id))
+
+    sleep_interval = int(incoming['forced_sleep'] or 0)
+
+    return InboundRequest(request_id, sleep_interval, tokens, incoming_token)
+
+
+# Called once the request has been handled; the caller flushes the reporter before responding.
+def end_request(inbound):
+    _filibuster_global_context_release_request(inbound.request_id)
+    reset_incoming_context(inbound.incoming_token)
+
+    for token in reversed(inbound.tokens):
+        context.detach(token)
@@ -0,0 +1,365 @@
+import os
+import json
+import uuid
+import base64
+import threading
+
+from collections import OrderedDict
+
+from filibuster.execution_index import execution_index_tostring, execution_index_is_rolling, ROLLING_HASH_SIZE
+from filibuster.logger import debug
+from filibuster.vclock import vclock_tostring
+
+# Single header carrying the Filibuster context of a call.
+CONTEXT_HEADER = 'X-Filibuster-Context'
+
+# gRPC metadata keys ending in -bin carry bytes; gRPC does the base64 encoding itself.
+CONTEXT_METADATA_KEY = 'x-filibuster-context-bin'
+
+# Send the original X-Filibuster-* headers instead, for services running older instrumentation.
+LEGACY_CONTEXT_HEADERS = os.environ.get('LEGACY_CONTEXT_HEADERS', '')
+
+# Version of the encoding; bumped whenever the layout below changes.
+CONTEXT_VERSION = 2
+
+# Maximum number of parsed execution indexes, and of encoded request ids and test epochs, kept.
+MAX_CACHED_CONTEXTS = 1024
+
+# Kinds of execution index.
+_EI_PATH = 0
+_EI_ROLLING_HASH = 1
+
+# Tags for the encoding of strings.
+_NONE = 0
+_STRING = 1
+_UUID = 2
+_UUID_HEX = 3
+
+# Fields of a context and the legacy header (and metadata key) each was sent in.
+_LEGACY_HEADERS = OrderedDict([
+    ('generated_id', 'X-Filibuster-Generated-Id'),
+    ('vclock', 'X-Filibuster-VClock'),
+    ('origin_vclock', 'X-Filibuster-Origin-VClock'),
+    ('execution_index', 'X-Filibuster-Execution-Index'),
+    ('request_id', 'X-Filibuster-Request-Id'),
+    ('forced_sleep', 'X-Filibuster-Forced-Sleep'),
+    ('test_epoch', 'X-Filibuster-Test-Epoch'),
+])
+
+
+class _LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.mutex = threading.Lock()
+
+    def get(self, key):
+        with self.mutex:
+            value = self.entries.get(key, None)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.mutex:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+# Parsed execution index callstacks, by serialized execution index.
+_callstacks = _LRUCache(MAX_CACHED_CONTEXTS)
+
+# Encoded parts of a context shared by every call made while serving a request (the
+# request id and test epoch), by request id.
+_request_parts = _LRUCache(MAX_CACHED_CONTEXTS)
+
+
+def _write_varint(buffer, value):
+    value = int(value)
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+
+
+def _write_string(buffer, value):
+    if value is None or str(value) == 'None':
+        buffer.append(_NONE)
+        return
+
+    value = str(value)
+
+    # Ids are usually UUIDs and execution index entries MD5 digests; send those as their 16 bytes.
+    if len(value) == 36 or len(value) == 32:
+        try:
+            parsed = uuid.UUID(value)
+            if str(parsed) == value:
+                buffer.append(_UUID)
+                buffer.extend(parsed.bytes)
+                return
+            elif parsed.hex == value:
+                buffer.append(_UUID_HEX)
+                buffer.extend(parsed.bytes)
+                return
+        except ValueError:
+            pass
+
+    encoded = value.encode('utf-8')
+    buffer.append(_STRING)
+    _write_varint(buffer, len(encoded))
+    buffer.extend(encoded)
+
+
+def _read_string(data, offset):
+    tag = data[offset]
+    offset += 1
+
+    if tag == _NONE:
+        return None, offset
+    elif tag == _UUID:
+        return str(uuid.UUID(bytes=bytes(data[offset:offset + 16]))), offset + 16
+    elif tag == _UUID_HEX:
+        return uuid.UUID(bytes=bytes(data[offset:offset + 16])).hex, offset + 16
+    else:
+        (length, offset) = _read_varint(data, offset)
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def _serialized(execution_index):
+    if isinstance(execution_index, str):
+        return execution_index
+    return execution_index_tostring(execution_index)
+
+
+def _callstack(serialized):
+    callstack = _callstacks.get(serialized)
+    if callstack is None:
+        callstack = json.loads(serialized)
+        _callstacks.put(serialized, callstack)
+    return callstack
+
+
+def _intern(services, service):
+    if service not in services:
+        services[service] = len(services)
+    return services[service]
+
+
+def _write_entries(buffer, entries):
+    _write_varint(buffer, len(entries))
+    for (service_id, count) in entries:
+        _write_varint(buffer, service_id)
+        _write_varint(buffer, count)
+
+
+def _read_entries(data, offset, services):
+    (count, offset) = _read_varint(data, offset)
+    entries = []
+    for i in range(count):
+        (service_id, offset) = _read_varint(data, offset)
+        (value, offset) = _read_varint(data, offset)
+        entries.append([services[service_id], value])
+    return entries, offset
+
+
+def encode_context(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep=0):
+    """Encode the context of a call.
+
+    Layout (all integers are varints): version, the table of service names used by the clocks
+    and the execution index, then the vclock and origin vclock as entries referring to that
+    table, the kind of execution index followed by either its entries or its rolling hash,
+    the forced sleep, the generated id, the request id and the test epoch.  The execution
+    index is given either serialized or as (callstack, counters).
+    """
+
+    execution_index = _serialized(execution_index)
+    rolling = execution_index_is_rolling(execution_index)
+
+    services = OrderedDict()
+    vclock_entries = [(_intern(services, s), c) for (s, c) in vclock.items()]
+    origin_vclock_entries = [(_intern(services, s), c) for (s, c) in origin_vclock.items()]
+    if not rolling:
+        execution_index_entries = [(_intern(services, s), c) for (s, c) in _callstack(execution_index)]
+
+    buffer = bytearray()
+    buffer.append(CONTEXT_VERSION)
+
+    _write_varint(buffer, len(services))
+    for service in services:
+        _write_string(buffer, service)
+
+    for entries in (vclock_entries, origin_vclock_entries):
+        _write_entries(buffer, entries)
+
+    if rolling:
+        buffer.append(_EI_ROLLING_HASH)
+        buffer.extend(bytes.fromhex(execution_index))
+    else:
+        buffer.append(_EI_PATH)
+        _write_entries(buffer, execution_index_entries)
+
+    _write_varint(buffer, forced_sleep or 0)
+    _write_string(buffer, generated_id)
+
+    request_parts = _request_parts.get((request_id, str(test_epoch)))
+    if request_parts is None:
+        request_parts = bytearray()
+        _write_string(request_parts, request_id)
+        _write_string(request_parts, test_epoch)
+        request_parts = bytes(request_parts)
+        _request_parts.put((request_id, str(test_epoch)), request_parts)
+    buffer.extend(request_parts)
+
+    return bytes(buffer)
+
+
+def decode_context(data):
+    """Decode a context encoded by encode_context.
+
+    Returns the fields of the context as they were sent in the legacy headers: clocks and
+    the execution index serialized, everything else a string (or None.)  Returns None if
+    the context was encoded with an unknown version.
+    """
+
+    data = bytes(data)
+
+    if not data or data[0] != CONTEXT_VERSION:
+        debug("Ignoring Filibuster context with unknown version.")
+        return None
+
+    offset = 1
+
+    (count, offset) = _read_varint(data, offset)
+    services = []
+    for i in range(count):
+        (service, offset) = _read_string(data, offset)
+        services.append(service)
+
+    (vclock, offset) = _read_entries(data, offset, services)
+    (origin_vclock, offset) = _read_entries(data, offset, services)
+
+    kind = data[offset]
+    offset += 1
+    if kind == _EI_ROLLING_HASH:
+        execution_index = data[offset:offset + ROLLING_HASH_SIZE].hex()
+        offset += ROLLING_HASH_SIZE
+    else:
+        (entries, offset) = _read_entries(data, offset, services)
+        execution_index = json.dumps(entries)
+
+    (forced_sleep, offset) = _read_varint(data, offset)
+    (generated_id, offset) = _read_string(data, offset)
+    (request_id, offset) = _read_string(data, offset)
+    (test_epoch, offset) = _read_string(data, offset)
+
+    return {
+        'generated_id': generated_id,
+        'vclock': json.dumps(dict(vclock)),
+        'origin_vclock': json.dumps(dict(origin_vclock)),
+        'execution_index': execution_index,
+        'request_id': request_id,
+        'forced_sleep': str(forced_sleep),
+        'test_epoch': test_epoch
+    }
+
+
+def _legacy_values(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep):
+    values = {
+        'generated_id': str(generated_id),
+        'vclock': vclock_tostring(vclock),
+        'origin_vclock': vclock_tostring(origin_vclock),
+        'execution_index': _serialized(execution_index),
+        'request_id': str(request_id),
+        'test_epoch': str(test_epoch)
+    }
+
+    if forced_sleep is not None:
+        values['forced_sleep'] = str(forced_sleep)
+
+    return values
+
+
+# Headers to send with an HTTP request.
+def http_headers(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep=None):
+    if LEGACY_CONTEXT_HEADERS:
+        values = _legacy_values(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep)
+        return {_LEGACY_HEADERS[field]: values[field] for field in values}
+
+    encoded = encode_context(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep)
+    return {CONTEXT_HEADER: base64.b64encode(encoded).decode('ascii')}
+
+
+# Metadata to send with a gRPC call.
+def grpc_metadata(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep=None):
+    if LEGACY_CONTEXT_HEADERS:
+        values = _legacy_values(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep)
+        return [(_LEGACY_HEADERS[field].lower(), values[field]) for field in values]
+
+    encoded = encode_context(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, forced_sleep)
+    return [(CONTEXT_METADATA_KEY, encoded)]
+
+
+# Context of an incoming HTTP request, from either the context header or the legacy headers.
+#
+# Every field is None when the request carries no context.
+def from_http_headers(headers):
+    encoded = headers.get(CONTEXT_HEADER, None)
+    if encoded is not None:
+        decoded = decode_context(base64.b64decode(encoded))
+        if decoded is not None:
+            return decoded
+
+    return {field: headers.get(header, None) for (field, header) in _LEGACY_HEADERS.items()}
+
+
+class _WSGIHeaders:
+    def __init__(self, environ):
+        self.environ = environ
+
+    def get(self, header, default=None):
+        return self.environ.get('HTTP_' + header.upper().replace('-', '_'), default)
+
+
+class _ASGIHeaders:
+    def __init__(self, scope):
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for (name, value) in scope.get('headers', [])}
+
+    def get(self, header, default=None):
+        return self.headers.get(header.lower(), default)
+
+
+# Context of an incoming request, from a WSGI environ.
+def from_wsgi_environ(environ):
+    return from_http_headers(_WSGIHeaders(environ))
+
+
+# Context of an incoming request, from an ASGI connection scope.
+def from_asgi_scope(scope):
+    return from_http_headers(_ASGIHeaders(scope))
+
+
+# Context of an incoming gRPC call, from either the context metadata or the legacy metadata.
+def from_grpc_metadata(metadata):
+    encoded = metadata.get(CONTEXT_METADATA_KEY, None)
+    if encoded is not None:
+        decoded = decode_context(encoded)
+        if decoded is not None:
+            return decoded
+
+    return {field: metadata.get(header.lower(), None) for (field, header) in _LEGACY_HEADERS.items()}
+
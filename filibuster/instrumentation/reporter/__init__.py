@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import atexit
+import asyncio
+import threading
+import contextvars
+
+from collections import deque
+
+from filibuster import control_plane
+from filibuster.logger import error, warning, debug
+
+# Maximum number of events waiting to be sent; reporting blocks on a flush when full, except on an
+# event loop, which it never blocks (see report_async.)
+MAX_QUEUE_SIZE = 1024
+
+# Maximum number of events sent in a single call to the server.
+MAX_BATCH_SIZE = 128
+
+# Number of times a batch is sent before its events are given up on, and seconds between attempts.
+MAX_REPORT_ATTEMPTS = int(os.environ.get('FILIBUSTER_MAX_REPORT_ATTEMPTS', '3'))
+REPORT_RETRY_INTERVAL = float(os.environ.get('FILIBUSTER_REPORT_RETRY_INTERVAL', '0.1'))
+
+# Number of batches given up on that are remembered, to tell flush() callers.
+MAX_LOST_BATCHES = 1024
+
+# The functional test, started by the server with the test epoch in its environment, reports
+# synchronously: unlike a service, it never responds to anyone, so nothing else would make sure
+# the server has seen its calls before it asserts or exits.
+SYNCHRONOUS = bool(os.environ.get('FILIBUSTER_TEST_EPOCH', ''))
+
+# One reporter per Filibuster server, per process.
+_reporters = {}
+_reporters_mutex = threading.Lock()
+
+# Events reported while handling the current inbound request, if tracked (see track_request):
+# reporter -> sequence numbers of the first and last one.  Shared with the work forked from the
+# request.
+_request_events = contextvars.ContextVar('filibuster_request_events', default=None)
+
+
+def filibuster_update_batch_url(filibuster_url):
+    return "{}/{}/update-batch".format(filibuster_url, 'filibuster')
+
+
+class BatchReporter:
+    """Reports update events to the Filibuster server from a background thread.
+
+    Events are sent in the order they were reported.  flush() returns once every event
+    reported before it was called has been sent, which is what instrumentation relies on at
+    test boundaries (before responding, and before the functional test asserts.)
+
+    A batch the server didn't accept is sent again, up to MAX_REPORT_ATTEMPTS times, before
+    its events are given up on; flush() returns False if any of the events it waited for were.
+    """
+
+    def __init__(self, filibuster_url):
+        self.filibuster_url = filibuster_url
+        self.queue = deque()
+        self.queue_mutex = threading.Condition()
+        self.send_mutex = threading.Lock()
+
+        # Number of events reported, and number sent (delivered, or given up on.)
+        self.reported = 0
+        self.sent = 0
+
+        # Failed attempts to send the events at the head of the queue.
+        self.attempts = 0
+
+        # Sequence numbers of the first and last events of the batches given up on, and of the
+        # last event flush() has told its callers about.
+        self.lost = deque(maxlen=MAX_LOST_BATCHES)
+        self.checked = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Queue an event; returns whether the caller should wait for a flush.
+    def enqueue(self, payload):
+        with self.queue_mutex:
+            self.reported += 1
+            sequence = self.reported
+            self.queue.append((sequence, payload))
+            full = len(self.queue) >= MAX_QUEUE_SIZE
+            self.queue_mutex.notify()
+
+        request_events = _request_events.get()
+        if request_events is not None:
+            (first, last) = request_events.get(self, (sequence, sequence))
+            request_events[self] = (first, max(last, sequence))
+
+        return full or SYNCHRONOUS
+
+    def report(self, payload):
+        # Code running on an event loop (e.g. ASGI middleware) leaves the queue to the background
+        # thread rather than block the loop.
+        if self.enqueue(payload) and not _on_event_loop():
+            self._send_all()
+
+    # Returns whether the events reported since the last flush were delivered.
+    def flush(self):
+        with self.queue_mutex:
+            first = self.checked + 1
+            last = self.reported
+
+        self._send_all()
+
+        with self.queue_mutex:
+            self.checked = max(self.checked, last)
+
+        return self.was_delivered(first, last)
+
+    # Flush, unless every event up to the last sequence number has already been sent; returns
+    # whether the events from the first to the last were delivered.
+    def flush_until(self, first, last):
+        with self.queue_mutex:
+            sent = self.sent >= last
+
+        if not sent:
+            self._send_all()
+
+        return self.was_delivered(first, last)
+
+    def was_delivered(self, first, last):
+        with self.queue_mutex:
+            return not any(lost_first <= last and first <= lost_last for (lost_first, lost_last) in self.lost)
+
+    def _send_all(self):
+        while True:
+            with self.send_mutex:
+                if not self._send_batch():
+                    return
+
+    def _run(self):
+        while True:
+            with self.queue_mutex:
+                while not self.queue:
+                    self.queue_mutex.wait()
+
+            with self.send_mutex:
+                self._send_batch()
+
+    # Must be called holding send_mutex, so batches reach the server in order.
+    def _send_batch(self):
+        with self.queue_mutex:
+            batch = []
+            while self.queue and len(batch) < MAX_BATCH_SIZE:
+                batch.append(self.queue.popleft())
+
+        if not batch:
+            return False
+
+        debug("Reporting " + str(len(batch)) + " events to the Filibuster server.")
+
+        delivered = False
+        try:
+            response = control_plane.post(filibuster_update_batch_url(self.filibuster_url),
+                                          json=[payload for (sequence, payload) in batch])
+            delivered = 200 <= response.status_code < 300
+            if not delivered:
+                warning("Filibuster server returned " + str(response.status_code) + " (report)!")
+        except Exception as e:
+            warning("Exception raised (report)!")
+            print(e, file=sys.stderr)
+
+        with self.queue_mutex:
+            retry = not delivered and self.attempts + 1 < MAX_REPORT_ATTEMPTS
+            if retry:
+                # Sent again first, so events still reach the server in order.
+                self.attempts += 1
+                self.queue.extendleft(reversed(batch))
+            else:
+                if not delivered:
+                    self.lost.append((batch[0][0], batch[-1][0]))
+                self.attempts = 0
+                self.sent += len(batch)
+
+        if retry:
+            time.sleep(REPORT_RETRY_INTERVAL)
+        elif not delivered:
+            error("Gave up reporting " + str(len(batch)) + " events to the Filibuster server after " +
+                  str(MAX_REPORT_ATTEMPTS) + " attempts.")
+
+        return True
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def get_reporter(filibuster_url):
+    # Threads don't survive fork, so each process gets its own reporter.
+    key = (os.getpid(), filibuster_url)
+
+    with _reporters_mutex:
+        if key not in _reporters:
+            _reporters[key] = BatchReporter(filibuster_url)
+        return _reporters[key]
+
+
+def report(filibuster_url, payload):
+    get_reporter(filibuster_url).report(payload)
+
+
+# Same as report, for asyncio code: waits for a flush off the event loop.
+async def report_async(filibuster_url, payload):
+    reporter = get_reporter(filibuster_url)
+    if reporter.enqueue(payload):
+        await control_plane.run_async(reporter._send_all)
+
+
+# Returns whether the events reported since the last flush were delivered.
+def flush():
+    with _reporters_mutex:
+        reporters = [r for (pid, url), r in _reporters.items() if pid == os.getpid()]
+
+    delivered = [reporter.flush() for reporter in reporters]
+    return all(delivered)
+
+
+# Track the events reported while handling an inbound request, so flush_request only waits
+# for those.  Returns a token for untrack_request.
+def track_request():
+    return _request_events.set({})
+
+
+def untrack_request(token):
+    _request_events.reset(token)
+
+
+# Flush before responding to an inbound request: returns right away if every event the request
+# reported was already sent by the background thread.  Flushes everything if the request isn't
+# tracked.  Returns whether the request's events were delivered.
+def flush_request():
+    request_events = _request_events.get()
+    if request_events is None:
+        return flush()
+
+    delivered = [reporter.flush_until(first, last) for (reporter, (first, last)) in list(request_events.items())]
+    return all(delivered)
+
+
+atexit.register(flush)
@@ -28,16 +28,23 @@ from requests.sessions import Session
 from requests.structures import CaseInsensitiveDict
 from requests import exceptions
 
-from threading import Lock
-
 from filibuster.global_context import get_value as _filibuster_global_context_get_value
 from filibuster.global_context import set_value as _filibuster_global_context_set_value
+from filibuster.global_context import set_request_scoped_map as _filibuster_global_context_set_request_scoped_map
+from filibuster.global_context import request_mutex as _filibuster_global_context_request_mutex
 from filibuster.execution_index import execution_index_new, execution_index_fromstring, \
     execution_index_tostring, execution_index_push, execution_index_pop
 from filibuster.instrumentation.helpers import get_full_traceback_hash, should_load_counterexample_file, \
-    counterexample_file
+    counterexample_file, observe_test_epoch, should_passthrough
+from filibuster.instrumentation.reporter import report as _filibuster_report
+from filibuster.instrumentation.failure_plan import get_failure_plan, resolve_test_epoch, decide, new_generated_id
+from filibuster.instrumentation.exception_registry import exception_class as _filibuster_exception_class, \
+    preload as _filibuster_preload_exceptions
+from filibuster.instrumentation.forking import current_fork, fork_path, instrument_thread_pools, \
+    uninstrument_thread_pools
+from filibuster.instrumentation.propagation import http_headers as _filibuster_http_headers
 from filibuster.logger import warning, debug, notice, info
-from filibuster.vclock import vclock_new, vclock_tostring, vclock_fromstring, vclock_increment, vclock_merge
+from filibuster.vclock import vclock_new, vclock_todict, vclock_fromstring, vclock_increment, vclock_merge
 from filibuster.nginx_http_special_response import get_response
 from filibuster.server_helpers import should_fail_request_with, load_counterexample
 from filibuster.datatypes import TestExecution
@@ -72,23 +79,27 @@ _FILIBUSTER_EXECUTION_INDEX_KEY = "filibuster_execution_index"
 # Key for the Filibuster request id in the context.
 _FILIBUSTER_REQUEST_ID_KEY = "filibuster_request_id"
 
+# Key for the Filibuster test epoch in the context.
+_FILIBUSTER_TEST_EPOCH_KEY = "filibuster_test_epoch"
+
+# Key for the Filibuster generated id of the request being processed in the context.
+_FILIBUSTER_GENERATED_ID_KEY = "filibuster_generated_id"
+
 # Key for Filibuster vclock mapping.
 _FILIBUSTER_VCLOCK_BY_REQUEST_KEY = "filibuster_vclock_by_request"
-_filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, {})
-
-# Mutex for vclock and execution_index.
-ei_and_vclock_mutex = Lock()
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
 
 # Last used execution index.
-# (this is mutated under the same mutex as the vclock.)
+# (this is mutated under the same request mutex as the vclock.)
 _FILIBUSTER_EI_BY_REQUEST_KEY = "filibuster_execution_indices_by_request"
-_filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, {})
+_filibuster_global_context_set_request_scoped_map(_FILIBUSTER_EI_BY_REQUEST_KEY)
 
 if should_load_counterexample_file():
     notice("Counterexample file present!")
     counterexample = load_counterexample(counterexample_file())
     counterexample_test_execution = TestExecution.from_json(counterexample['TestExecution']) if counterexample else None
     print(counterexample_test_execution.failures)
+    _filibuster_preload_exceptions(counterexample_test_execution.failures)
 else:
     counterexample = None
 
@@ -107,17 +118,17 @@ def _instrument(service_name=None, filibuster_url=None):
     # before v1.0.0, Dec 17, 2012, see
     # https://github.com/psf/requests/commit/4e5c4a6ab7bb0195dececdd19bb8505b872fe120)
 
-    wrapped_request = Session.request
-    wrapped_send = Session.send
-
-    def filibuster_update_url(filibuster_url):
-        return "{}/{}/update".format(filibuster_url, 'filibuster')
+    # Configuration is resolved once, here, rather than on every call.
+    server_communication_disabled = bool(os.environ.get('DISABLE_SERVER_COMMUNICATION', ''))
+    pretty_execution_indexes = bool(os.environ.get("PRETTY_EXECUTION_INDEXES", ""))
+    set_error_content = bool(os.environ.get('SET_ERROR_CONTENT', ''))
 
-    def filibuster_create_url(filibuster_url):
-        return "{}/{}/create".format(filibuster_url, 'filibuster')
+    if should_passthrough():
+        debug("Not instrumenting requests. DISABLE_SERVER_COMMUNICATION set and no counterexample.")
+        return
 
-    def filibuster_new_test_execution_url(filibuster_url, service_name):
-        return "{}/{}/new-test-execution/{}".format(filibuster_url, 'filibuster', service_name)
+    wrapped_request = Session.request
+    wrapped_send = Session.send
 
     @functools.wraps(wrapped_request)
     def instrumented_request(self, method, url, *args, **kwargs):
@@ -207,6 +218,8 @@ def _instrument(service_name=None, filibuster_url=None):
 
         execution_index = None
 
+        test_epoch = None
+
         # Record that a call is being made to an external service.
         if not context.get_value(_FILIBUSTER_INSTRUMENTATION_KEY):
             if not context.get_value("suppress_instrumentation"):
@@ -215,99 +228,93 @@ def _instrument(service_name=None, filibuster_url=None):
                 debug("")
                 debug("Recording call using Filibuster instrumentation service. ********************")
 
-                # VClock handling.
-
-                # Figure out if we should reset the node's vector clock, which should happen in between test executions.
-                debug("Setting Filibuster instrumentation key...")
-                token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
-
-                response = None
-                if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
-                    response = wrapped_request(self, 'get',
-                                               filibuster_new_test_execution_url(filibuster_url, service_name))
-                    if response is not None:
-                        response = response.json()
-
-                debug("Removing instrumentation key for Filibuster.")
-                context.detach(token)
-                reset_local_vclock = False
-                if response and ('new-test-execution' in response) and (response['new-test-execution']):
-                    reset_local_vclock = True
-
-                global ei_and_vclock_mutex
-                ei_and_vclock_mutex.acquire()
+                # Test execution this call belongs to; calls not triggered by an instrumented request
+                # (e.g. from the test) get it from the failure plan.
+                test_epoch = context.get_value(_FILIBUSTER_TEST_EPOCH_KEY)
+                if not server_communication_disabled and counterexample is None:
+                    test_epoch = resolve_test_epoch(filibuster_url, test_epoch)
 
                 request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
 
-                if reset_local_vclock:
-                    # Reset everything, since there is a new test execution.
-                    debug("New test execution. Resetting vclocks_by_request and execution_indices_by_request.")
-
-                    vclocks_by_request = {request_id_string: vclock_new()}
-                    _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
-
-                    execution_indices_by_request = {request_id_string: execution_index_new()}
-                    _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
-
-                # Incoming clock from the request that triggered this service to be reached.
-                incoming_vclock_string = context.get_value(_FILIBUSTER_VCLOCK_KEY)
-
-                # If it's not None, we probably need to merge with our clock, first, since our clock is keeping
-                # track of *our* requests from this node.
-                if incoming_vclock_string is not None:
+                # Reset the node's vector clock and execution indexes if this call belongs to a new test
+                # execution, before advancing them.
+                observe_test_epoch(test_epoch)
+
+                # VClock handling.  The vclock and execution index of a request are read and updated
+                # holding the request's mutex, which is shared by every worker process when there's a
+                # shared state server.
+                with _filibuster_global_context_request_mutex(request_id_string):
+                    # Incoming clock from the request that triggered this service to be reached.
+                    incoming_vclock_string = context.get_value(_FILIBUSTER_VCLOCK_KEY)
+
+                    # If it's not None, we probably need to merge with our clock, first, since our clock is keeping
+                    # track of *our* requests from this node.
+                    if incoming_vclock_string is not None:
+                        vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+                        incoming_vclock = vclock_fromstring(incoming_vclock_string)
+                        local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
+                        new_local_vclock = vclock_merge(incoming_vclock, local_vclock)
+                        vclocks_by_request[request_id_string] = new_local_vclock
+                        _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
+
+                    # Finally, advance the clock to account for this request.
                     vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
-                    incoming_vclock = vclock_fromstring(incoming_vclock_string)
                     local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
-                    new_local_vclock = vclock_merge(incoming_vclock, local_vclock)
+                    new_local_vclock = vclock_increment(local_vclock, service_name)
                     vclocks_by_request[request_id_string] = new_local_vclock
                     _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
 
-                # Finally, advance the clock to account for this request.
-                vclocks_by_request = _filibuster_global_context_get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
-                local_vclock = vclocks_by_request.get(request_id_string, vclock_new())
-                new_local_vclock = vclock_increment(local_vclock, service_name)
-                vclocks_by_request[request_id_string] = new_local_vclock
-                _filibuster_global_context_set_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY, vclocks_by_request)
-
-                vclock = new_local_vclock
-
-                notice("clock now: " + str(vclocks_by_request.get(request_id_string, vclock_new())))
-
-                # Maintain the execution index for each request.
-
-                incoming_execution_index_string = context.get_value(_FILIBUSTER_EXECUTION_INDEX_KEY)
-
-                if incoming_execution_index_string is not None:
-                    incoming_execution_index = execution_index_fromstring(incoming_execution_index_string)
-                else:
-                    execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-                    incoming_execution_index = execution_indices_by_request.get(request_id_string,
-                                                                                execution_index_new())
-
-                if os.environ.get("PRETTY_EXECUTION_INDEXES", ""):
-                    execution_index_hash = url
-                else:
-                    # TODO: can't include kwargs here, not sure why, i think it's metadata?  anyway, should be blank mostly since
-                    #       everything should be converted to args by this point.
-                    #       could also be None?
-                    # Remove host information. This allows us to run counterexamples across different
-                    # platforms (local, docker, eks) that use different hosts to resolve networking.
-                    # I.e. since we want http://0.0.0.0:5000/users (local) and http://users:5000/users
-                    # (docker) to have the same execution index hash, standardize the url to include 
-                    # only the port and path (5000/users). 
-                    url = url.replace('http://', '')
-                    if ":" in url:
-                        url = url.split(":", 1)[1]
-                    execution_index_hash = unique_request_hash(
-                        [full_traceback_hash, 'requests', method, json.dumps(url)])
-
-                execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
-                execution_indices_by_request[request_id_string] = execution_index_push(execution_index_hash,
-                                                                                       incoming_execution_index)
-                execution_index = execution_indices_by_request[request_id_string]
-                _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
-
-                ei_and_vclock_mutex.release()
+                    vclock = new_local_vclock
+
+                    notice("clock now: " + str(vclocks_by_request.get(request_id_string, vclock_new())))
+
+                    # Maintain the execution index for each request.
+
+                    # Calls made from a thread the request forked (e.g. on a thread pool) use that
+                    # thread's own copy of the execution index.
+                    fork = current_fork(request_id_string)
+
+                    incoming_execution_index_string = context.get_value(_FILIBUSTER_EXECUTION_INDEX_KEY)
+
+                    if fork is not None:
+                        incoming_execution_index = fork.execution_index
+                    elif incoming_execution_index_string is not None:
+                        incoming_execution_index = execution_index_fromstring(incoming_execution_index_string)
+                    else:
+                        execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+                        incoming_execution_index = execution_indices_by_request.get(request_id_string,
+                                                                                    execution_index_new())
+
+                    if pretty_execution_indexes:
+                        execution_index_hash = url
+                        if fork is not None:
+                            execution_index_hash = url + " " + fork_path(fork)
+                    else:
+                        # TODO: can't include kwargs here, not sure why, i think it's metadata?  anyway, should be blank mostly since
+                        #       everything should be converted to args by this point.
+                        #       could also be None?
+                        # Remove host information. This allows us to run counterexamples across different
+                        # platforms (local, docker, eks) that use different hosts to resolve networking.
+                        # I.e. since we want http://0.0.0.0:5000/users (local) and http://users:5000/users
+                        # (docker) to have the same execution index hash, standardize the url to include 
+                        # only the port and path (5000/users). 
+                        url = url.replace('http://', '')
+                        if ":" in url:
+                            url = url.split(":", 1)[1]
+                        execution_index_hash_args = [full_traceback_hash, 'requests', method, json.dumps(url)]
+                        if fork is not None:
+                            execution_index_hash_args.append(fork_path(fork))
+                        execution_index_hash = unique_request_hash(execution_index_hash_args)
+
+                    if fork is not None:
+                        fork.execution_index = execution_index_push(execution_index_hash, incoming_execution_index)
+                        execution_index = fork.execution_index
+                    else:
+                        execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+                        execution_indices_by_request[request_id_string] = execution_index_push(execution_index_hash,
+                                                                                               incoming_execution_index)
+                        execution_index = execution_indices_by_request[request_id_string]
+                        _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
 
                 # Origin VClock Handling.
 
@@ -347,7 +354,8 @@ def _instrument(service_name=None, filibuster_url=None):
                 else:
                     incoming_origin_vclock = vclock_new()
                 response = _record_call(self, method, [url], callsite_file, callsite_line, full_traceback_hash, vclock,
-                                        incoming_origin_vclock, execution_index_tostring(execution_index), kwargs)
+                                        incoming_origin_vclock, execution_index_tostring(execution_index), kwargs,
+                                        test_epoch)
 
                 if response is not None:
                     if 'generated_id' in response:
@@ -389,25 +397,14 @@ def _instrument(service_name=None, filibuster_url=None):
                 if not should_inject_fault:
                     # Propagate vclock and origin vclock forward.
                     result = call_wrapped(
-                        {
-                            'X-Filibuster-Generated-Id': str(generated_id),
-                            'X-Filibuster-VClock': vclock_tostring(vclock),
-                            'X-Filibuster-Origin-VClock': vclock_tostring(origin_vclock),
-                            'X-Filibuster-Execution-Index': execution_index_tostring(execution_index),
-                            'X-Filibuster-Request-Id': str(request_id)
-                        }
+                        _filibuster_http_headers(generated_id, vclock, origin_vclock, execution_index,
+                                                 request_id, test_epoch)
                     )
                 elif should_inject_fault and not should_abort:
                     # Propagate vclock and origin vclock forward.
                     result = call_wrapped(
-                        {
-                            'X-Filibuster-Generated-Id': str(generated_id),
-                            'X-Filibuster-VClock': vclock_tostring(vclock),
-                            'X-Filibuster-Origin-VClock': vclock_tostring(origin_vclock),
-                            'X-Filibuster-Execution-Index': execution_index_tostring(execution_index),
-                            'X-Filibuster-Forced-Sleep': str(should_sleep_interval),
-                            'X-Filibuster-Request-Id': str(request_id)
-                        }
+                        _filibuster_http_headers(generated_id, vclock, origin_vclock, execution_index,
+                                                 request_id, test_epoch, should_sleep_interval)
                     )
                 else:
                     # Return entirely fake response and do not make request.
@@ -447,7 +444,7 @@ def _instrument(service_name=None, filibuster_url=None):
                     result.status_code = int(status_code)
                     # Get the default response for the status code.
                     default_response = ''
-                    if os.environ.get('SET_ERROR_CONTENT', ''):
+                    if set_error_content:
                         default_response = get_response(status_code)
                     result.headers['Content-Type'] = 'text/html'
                     result._content = default_response.encode()
@@ -466,7 +463,7 @@ def _instrument(service_name=None, filibuster_url=None):
         # Result was an exception. 
         if exception is not None and exception != "None":
             if isinstance(exception, str):
-                exception_class = eval(exception)
+                exception_class = _filibuster_exception_class(exception)
                 exception = exception_class()
                 use_traceback = False
             else:
@@ -511,8 +508,11 @@ def _instrument(service_name=None, filibuster_url=None):
     instrumented_send.opentelemetry_instrumentation_requests_applied = True
     Session.send = instrumented_send
 
+    # Calls made on thread pools get their own execution index.
+    instrument_thread_pools()
+
     def _record_call(self, method, args, callsite_file, callsite_line, full_traceback, vclock, origin_vclock,
-                     execution_index, kwargs):
+                     execution_index, kwargs, test_epoch):
         response = None
         parsed_content = None
 
@@ -531,8 +531,8 @@ def _instrument(service_name=None, filibuster_url=None):
                 'callsite_line': callsite_line,
                 'full_traceback': full_traceback,
                 'metadata': {},
-                'vclock': vclock,
-                'origin_vclock': origin_vclock,
+                'vclock': vclock_todict(vclock),
+                'origin_vclock': vclock_todict(origin_vclock),
                 'execution_index': execution_index
             }
 
@@ -552,12 +552,20 @@ def _instrument(service_name=None, filibuster_url=None):
                 if response is None:
                     response = {'execution_index': execution_index}
                 print(response)
-            if os.environ.get('DISABLE_SERVER_COMMUNICATION', ''):
+            if server_communication_disabled:
                 warning("Server communication disabled.")
             elif counterexample is not None:
                 notice("Skipping request, replaying from local counterexample.")
             else:
-                response = wrapped_request(self, 'put', filibuster_create_url(filibuster_url), json=payload)
+                # Decide locally using the failure plan for this test execution and notify the server.
+                failure_plan = get_failure_plan(filibuster_url, test_epoch)
+                if failure_plan is not None:
+                    generated_id = new_generated_id()
+                    payload['client_generated_id'] = generated_id
+                    payload['parent_generated_id'] = context.get_value(_FILIBUSTER_GENERATED_ID_KEY)
+                    payload['test_epoch'] = failure_plan['test_epoch']
+                    _filibuster_report(filibuster_url, payload)
+                    response = decide(failure_plan, generated_id, payload)
         except Exception as e:
             warning("Exception raised (_record_call)!")
             print(e, file=sys.stderr)
@@ -579,23 +587,23 @@ def _instrument(service_name=None, filibuster_url=None):
         return parsed_content
 
     def _update_execution_index(self):
-        global ei_and_vclock_mutex
-
-        ei_and_vclock_mutex.acquire()
-
-        execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
         request_id_string = context.get_value(_FILIBUSTER_REQUEST_ID_KEY)
-        if request_id_string in execution_indices_by_request:
-            execution_indices_by_request[request_id_string] = execution_index_pop(
-                execution_indices_by_request[request_id_string])
-            _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
 
-        ei_and_vclock_mutex.release()
+        with _filibuster_global_context_request_mutex(request_id_string):
+            execution_indices_by_request = _filibuster_global_context_get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)
+            fork = current_fork(request_id_string)
+            if fork is not None:
+                fork.execution_index = execution_index_pop(fork.execution_index)
+            elif request_id_string in execution_indices_by_request:
+                execution_indices_by_request[request_id_string] = execution_index_pop(
+                    execution_indices_by_request[request_id_string])
+                _filibuster_global_context_set_value(_FILIBUSTER_EI_BY_REQUEST_KEY, execution_indices_by_request)
 
     def _record_successful_response(self, generated_id, execution_index, vclock, result):
         # assumes no asynchrony or threads at calling service.
+        # (reported asynchronously; flushed before the next create and at the end of each request.)
 
-        if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')) and counterexample is None:
+        if not server_communication_disabled and counterexample is None:
             try:
                 debug("Setting Filibuster instrumentation key...")
                 token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
@@ -609,10 +617,10 @@ def _instrument(service_name=None, filibuster_url=None):
                     'instrumentation_type': 'invocation_complete',
                     'generated_id': generated_id,
                     'execution_index': execution_index,
-                    'vclock': vclock,
+                    'vclock': vclock_todict(vclock),
                     'return_value': return_value
                 }
-                wrapped_request(self, 'post', filibuster_update_url(filibuster_url), json=payload)
+                _filibuster_report(filibuster_url, payload)
             except Exception as e:
                 warning("Exception raised (_record_successful_response)!")
                 print(e, file=sys.stderr)
@@ -626,7 +634,7 @@ def _instrument(service_name=None, filibuster_url=None):
                                      should_abort):
         # assumes no asynchrony or threads at calling service.
 
-        if not (os.environ.get('DISABLE_SERVER_COMMUNICATION', '')):
+        if not server_communication_disabled:
             try:
                 debug("Setting Filibuster instrumentation key...")
                 token = context.attach(context.set_value(_FILIBUSTER_INSTRUMENTATION_KEY, True))
@@ -637,7 +645,7 @@ def _instrument(service_name=None, filibuster_url=None):
                     'instrumentation_type': 'invocation_complete',
                     'generated_id': generated_id,
                     'execution_index': execution_index,
-                    'vclock': vclock,
+                    'vclock': vclock_todict(vclock),
                     'exception': {
                         'name': parsed_exception_string,
                         'metadata': {
@@ -652,7 +660,7 @@ def _instrument(service_name=None, filibuster_url=None):
                 if should_abort is not True:
                     payload['exception']['metadata']['abort'] = should_abort
 
-                wrapped_request(self, 'post', filibuster_update_url(filibuster_url), json=payload)
+                _filibuster_report(filibuster_url, payload)
             except Exception as e:
                 warning("Exception raised (_record_exceptional_response)!")
                 print(e, file=sys.stderr)
@@ -674,6 +682,7 @@ def _uninstrument():
 
     Note that this only works if no other module also patches requests."""
     _uninstrument_from(Session)
+    uninstrument_thread_pools()
 
 
 def _uninstrument_from(instr_root, restore_as_bound_func=False):
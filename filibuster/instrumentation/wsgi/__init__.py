@@ -0,0 +1,65 @@
+"""
+Filibuster middleware for any WSGI application.
+
+Usage::
+
+    app = FilibusterWSGIMiddleware(app, service_name=..., filibuster_url=...)
+
+"""
+
+import os
+import time
+
+from filibuster.instrumentation.inbound import begin_request, end_request
+from filibuster.instrumentation.propagation import from_wsgi_environ as _filibuster_from_wsgi_environ
+from filibuster.instrumentation.reporter import flush as _filibuster_flush
+from filibuster.logger import debug
+
+
+class _ClosingIterable:
+    """Response body that ends the request once the server is done with it."""
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.on_close()
+
+
+class FilibusterWSGIMiddleware:
+    def __init__(self, app, service_name, filibuster_url):
+        self.app = app
+        self.service_name = service_name
+        self.filibuster_url = filibuster_url
+
+    def __call__(self, environ, start_response):
+        if os.environ.get('DISABLE_INSTRUMENTATION', ''):
+            return self.app(environ, start_response)
+
+        inbound = begin_request(_filibuster_from_wsgi_environ(environ), self.service_name, self.filibuster_url)
+
+        def filibuster_start_response(status, response_headers, *args):
+            # Make sure the server has seen everything this request did before responding.
+            _filibuster_flush()
+            return start_response(status, response_headers, *args)
+
+        try:
+            # If we should delay the request to simulate timeouts, do it.
+            if inbound.sleep_interval > 0:
+                debug("Sleeping for " + str(inbound.sleep_interval) + " seconds.")
+                time.sleep(inbound.sleep_interval)
+
+            iterable = self.app(environ, filibuster_start_response)
+        except Exception:
+            end_request(inbound)
+            raise
+
+        return _ClosingIterable(iterable, lambda: end_request(inbound))
@@ -1,7 +1,12 @@
+import os
 import time
 import requests
 import threading
+import socketserver
 
+from werkzeug.serving import WSGIRequestHandler
+
+from filibuster import control_plane
 from filibuster.logger import debug
 
 TIMEOUT_ITERATIONS = 100
@@ -38,7 +43,12 @@ def wait_for_services_to_start(services):
     wait_for_num_services_running(services, len(services), "start")
 
 
+# Services are (name, host, port) tuples, or (name, unix socket path) for a service only listening on
+# a Unix domain socket.
 def service_running(service):
+    if len(service) == 2:
+        return unix_socket_service_running(service)
+
     name = service[0]
     host = service[1]
     port = service[2]
@@ -61,14 +71,74 @@ def service_running(service):
         return False
 
 
-def start_filibuster_server_thread(app):
+def unix_socket_service_running(service):
+    (name, socket_path) = service
+
+    debug("checking service's health-check: " + name)
+    try:
+        response = control_plane.get("unix://{}/health-check".format(socket_path), timeout=60)
+        return response.status_code == 200
+    except OSError:
+        debug("! connection error")
+        return False
+
+
+# Keep connections from instrumentation to the Filibuster server alive between calls.
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+
+# Same handler, so connections over the Unix domain socket are kept alive too.
+class UnixWSGIRequestHandler(KeepAliveRequestHandler):
+    def setup(self):
+        super().setup()
+        # Unix domain socket peers have no address.
+        self.client_address = ('unix', 0)
+
+    def log(self, type, message, *args):
+        debug("unix socket: " + (message % args))
+
+
+class UnixWSGIServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # What werkzeug's request handler expects of its server.
+    multithread = True
+    multiprocess = False
+    passthrough_errors = False
+    ssl_context = None
+
+    def __init__(self, socket_path, app):
+        # Remove a socket left behind by a previous server.
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        socketserver.UnixStreamServer.__init__(self, socket_path, UnixWSGIRequestHandler)
+        self.app = app
+        self.shutdown_signal = False
+
+    def log(self, type, message, *args):
+        debug("unix socket: " + (message % args))
+
+
+# Serves on TCP port 5005 unless tcp is False, and on the Unix domain socket, if given.
+def start_filibuster_server_thread(app, unix_socket=None, tcp=True):
     class Server(threading.Thread):
         def __init__(self):
             threading.Thread.__init__(self)
 
         def run(self):
-            app.run(port=5005, host="0.0.0.0")
+            app.run(port=5005, host="0.0.0.0", request_handler=KeepAliveRequestHandler)
+
+    if tcp:
+        server_thread = Server()
+        server_thread.setDaemon(True)
+        server_thread.start()
+
+    # Serve on a Unix domain socket, for services running on the same host.
+    if unix_socket is not None:
+        unix_server = UnixWSGIServer(unix_socket, app)
 
-    server_thread = Server()
-    server_thread.setDaemon(True)
-    server_thread.start()
+        unix_server_thread = threading.Thread(target=unix_server.serve_forever)
+        unix_server_thread.setDaemon(True)
+        unix_server_thread.start()
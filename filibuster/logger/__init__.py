@@ -30,6 +30,11 @@ def info(string):
     print(BColors.OKBLUE + "[FILIBUSTER] [INFO]: " + string + BColors.ENDC, file=sys.stderr, flush=True)
 
 
+# Check before building expensive debug messages.
+def debug_enabled():
+    return bool(os.environ.get("DEBUG", ""))
+
+
 def debug(string):
-    if os.environ.get("DEBUG", ""):
+    if debug_enabled():
         print(BColors.OKCYAN + "[FILIBUSTER] [DEBUG]: " + string + BColors.ENDC, file=sys.stderr, flush=True)
@@ -0,0 +1,130 @@
+import os
+import json
+import hashlib
+
+from filibuster.datatypes import TestExecution
+
+from filibuster.logger import warning, info, debug
+
+
+def hash_file(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Each subdirectory of the services directory is a service; hash all of its files.
+def hash_services(services_directory):
+    service_hashes = {}
+
+    for service_name in sorted(os.listdir(services_directory)):
+        service_path = os.path.join(services_directory, service_name)
+
+        if not os.path.isdir(service_path):
+            continue
+
+        h = hashlib.md5()
+
+        for root, dirs, files in os.walk(service_path):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__' and not d.startswith('.'))
+
+            for file in sorted(files):
+                if file.endswith('.pyc'):
+                    continue
+                file_path = os.path.join(root, file)
+                h.update(os.path.relpath(file_path, service_path).encode())
+                h.update(hash_file(file_path).encode())
+
+        service_hashes[service_name] = h.hexdigest()
+
+    return service_hashes
+
+
+# Services that a completed test execution communicated with.
+def services_touched(test_execution):
+    services = set()
+
+    for entry in test_execution.response_log or []:
+        for key in ['source_service_name', 'target_service_name']:
+            service_name = entry.get(key, None)
+            if service_name is not None and service_name != 'None':
+                services.add(service_name)
+
+    return services
+
+
+# The history of one functional test is only valid for that test: the cache is discarded when
+# it was written by another.
+def load_pruning_cache(path, functional_test, analysis_file, services_directory):
+    if not os.path.exists(path):
+        info("No pruning cache found at " + str(path) + "; starting with empty history.")
+        return []
+
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        warning("Pruning cache at " + str(path) + " could not be read; starting with empty history.")
+        return []
+
+    if cache.get('functional_test', None) != functional_test:
+        info("Pruning cache was written for another functional test; starting with empty history.")
+        return []
+
+    if cache.get('analysis_file', None) != hash_file(analysis_file):
+        info("Analysis file changed since the pruning cache was written; starting with empty history.")
+        return []
+
+    previous_service_hashes = cache.get('services', {})
+    service_hashes = hash_services(services_directory)
+
+    changed_services = set()
+    for service_name in set(previous_service_hashes.keys()) | set(service_hashes.keys()):
+        if previous_service_hashes.get(service_name, None) != service_hashes.get(service_name, None):
+            changed_services.add(service_name)
+
+    if changed_services:
+        info("Services changed since the pruning cache was written: " + ", ".join(sorted(changed_services)))
+
+    # Only keep prior observations that never touched a changed service.
+    test_executions = []
+
+    for te_json in cache.get('test_executions', []):
+        te = TestExecution.from_json(te_json)
+
+        if not services_touched(te) & changed_services:
+            test_executions.append(te)
+        else:
+            debug("Discarding cached test execution that touches a changed service.")
+
+    info("Loaded " + str(len(test_executions)) + " test executions from the pruning cache.")
+
+    return test_executions
+
+
+def save_pruning_cache(path, functional_test, analysis_file, services_directory, test_executions):
+    te_jsons = []
+    seen = set()
+
+    # Executions ran again have new generated ids, but the same canonical key.
+    for te in test_executions:
+        if te.canonical_key() not in seen:
+            seen.add(te.canonical_key())
+            te_jsons.append(te.to_json())
+
+    cache = {
+        'functional_test': functional_test,
+        'analysis_file': hash_file(analysis_file),
+        'services': hash_services(services_directory),
+        'test_executions': te_jsons
+    }
+
+    # Write atomically so an interrupted run doesn't leave a truncated cache.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+    info("Wrote " + str(len(te_jsons)) + " test executions to the pruning cache at " + str(path) + ".")
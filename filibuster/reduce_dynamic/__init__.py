@@ -1,9 +1,30 @@
-import hashlib
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from queue import Empty
+
+from filibuster.datatypes import TestExecution
 
 from filibuster.debugging import describe_test_execution
 from filibuster.execution_index import execution_index_new, execution_index_tostring
-from filibuster.logger import error, debug, info, warning, notice
-from filibuster.vclock import vclock_new
+from filibuster.logger import error, debug, debug_enabled, info, warning, notice
+from filibuster.vclock import vclock_new, vclock_key
+
+# Diagnostics printed when outcomes unexpectedly don't match; these are in the hot path of dynamic reduction.
+PRINT_MATCH_DIAGNOSTICS = not os.environ.get('DISABLE_MATCH_DIAGNOSTICS', '')
+
+# Workers are spawned, not forked: the server forks them after its own threads have started.
+_PRUNING_CONTEXT = multiprocessing.get_context('spawn')
+
+# Seconds to wait for the pruning workers to evaluate a test execution before giving up on them
+# and pruning in-process.
+PRUNING_WORKER_TIMEOUT = float(os.environ.get('FILIBUSTER_PRUNING_WORKER_TIMEOUT', '300'))
+
+# Upper bound on the number of memoized outcome matches; least recently used are dropped first.
+MAX_MEMOIZED_OUTCOMES = int(os.environ.get('FILIBUSTER_MAX_MEMOIZED_OUTCOMES', '10000'))
+
+_outcome_matches = OrderedDict()
 
 
 def print_causal_descendents(causal_descendents):
@@ -18,64 +39,211 @@ def print_causal_descendents(causal_descendents):
         info("None.")
 
 
-def derive_causal_descendents_from_execution(test_execution):
-    causal_descendents = {execution_index_tostring(execution_index_new()): []}
+# Origin vclock of requests made directly by the test.
+_ROOT_VCLOCK_KEY = vclock_key(vclock_new())
 
-    for entry in test_execution.log:
-        # Print out the request.
-        debug(str(entry['generated_id']) + ": " + str(entry['args']) + " " + str(entry['kwargs']))
-        
-        for failure in test_execution.failures:
-            if failure['execution_index'] == entry['execution_index']:
-                if 'forced_exception' in failure and failure['forced_exception'] is not None:
-                    debug("* Failed with exception: " + str(failure['forced_exception']))
-                else:
-                    debug("* Failed with metadata: " + str(list(failure['failure_metadata'].items())))
 
-        # Find all causal descendents of this request.
-        for rle in test_execution.log:
-            if 'vclock' not in entry:
-                error("vclock not found in response_log_entry: " + str(entry))
+# Map each origin vclock to the execution indexes of the requests made with it, in log order;
+# a request's causal descendents are the requests whose origin vclock is its vclock.
+def _children_by_origin_vclock(test_execution):
+    children_by_origin_vclock = {}
+
+    for rle in test_execution.log:
+        if 'vclock' not in rle:
+            error("vclock not found in rle: " + str(rle))
+
+        children_by_origin_vclock.setdefault(vclock_key(rle['origin_vclock']), []).append(rle['execution_index'])
 
-            if 'vclock' not in rle:
-                error("vclock not found in rle: " + str(rle))
+    return children_by_origin_vclock
 
-            # This won't be an equality check *when* we do this before executing the request, because we'll have to
-            # look at requests_to_fail to see if we are gonna throw an exception.
-            # (and callsite, too?  not sure, think about it more.)
-            if rle['origin_vclock'] == entry['vclock']:
-                rle_execution_index = rle['execution_index']
-                entry_execution_index = entry['execution_index']
 
-                if entry_execution_index not in causal_descendents:
-                    causal_descendents[entry_execution_index] = []
+def derive_causal_descendents_from_execution(test_execution, compositional=False):
+    root_execution_index = execution_index_tostring(execution_index_new())
+    causal_descendents = {root_execution_index: []}
 
-                causal_descendents[entry_execution_index].append(rle_execution_index)
+    children_by_origin_vclock = _children_by_origin_vclock(test_execution)
+
+    for entry in test_execution.log:
+        if debug_enabled():
+            # Print out the request.
+            debug(str(entry['generated_id']) + ": " + str(entry['args']) + " " + str(entry['kwargs']))
+
+            for failure in test_execution.failures:
+                if failure['execution_index'] == entry['execution_index']:
+                    if 'forced_exception' in failure and failure['forced_exception'] is not None:
+                        debug("* Failed with exception: " + str(failure['forced_exception']))
+                    else:
+                        debug("* Failed with metadata: " + str(list(failure['failure_metadata'].items())))
 
-        if entry['origin_vclock'] == vclock_new():
+        if 'vclock' not in entry:
+            error("vclock not found in response_log_entry: " + str(entry))
+
+        # Find all causal descendents of this request.
+        #
+        # This won't be an equality check *when* we do this before executing the request, because we'll have to
+        # look at requests_to_fail to see if we are gonna throw an exception.
+        # (and callsite, too?  not sure, think about it more.)
+        children = children_by_origin_vclock.get(vclock_key(entry['vclock']), [])
+        if children:
             entry_execution_index = entry['execution_index']
-            causal_descendents[execution_index_tostring(execution_index_new())].append(entry_execution_index)
+
+            if entry_execution_index not in causal_descendents:
+                causal_descendents[entry_execution_index] = []
+
+            causal_descendents[entry_execution_index].extend(children)
+
+        if vclock_key(entry['origin_vclock']) == _ROOT_VCLOCK_KEY:
+            entry_execution_index = entry['execution_index']
+            causal_descendents[root_execution_index].append(entry_execution_index)
+
+    # When exploring compositionally, the outcome of each request made by the test only has to have been
+    # observed on its own, not in combination with the outcomes of the other requests made by the test.
+    if compositional:
+        for entry_execution_index in causal_descendents.pop(root_execution_index):
+            causal_descendents[root_execution_index + ":" + entry_execution_index] = [entry_execution_index]
 
     return causal_descendents
 
 
-# Given a test execution with what I'm about to do, make sure that what I've done previously matches that.
-def outcomes_match(current_test_execution, previously_ran_completed_request):
-    scheduled_request = None
+# Map the execution index of each request made directly by the test to the execution indexes in its subtree.
+def derive_independent_subtrees(test_execution):
+    children = {}
+    roots = []
+
+    children_by_origin_vclock = _children_by_origin_vclock(test_execution)
+
+    for entry in test_execution.log:
+        if vclock_key(entry['origin_vclock']) == _ROOT_VCLOCK_KEY:
+            roots.append(entry['execution_index'])
+
+        entry_children = children_by_origin_vclock.get(vclock_key(entry['vclock']), [])
+        if entry_children:
+            children.setdefault(entry['execution_index'], []).extend(entry_children)
+
+    subtrees = {}
 
-    # Find the same request in the previous execution.
+    for root in roots:
+        subtree = set()
+        to_visit = [root]
+
+        while to_visit:
+            execution_index = to_visit.pop()
+            if execution_index not in subtree:
+                subtree.add(execution_index)
+                to_visit.extend(children.get(execution_index, []))
+
+        subtrees[root] = subtree
+
+    return subtrees
+
+
+# Does this test execution inject faults in more than one independent subtree?
+def spans_independent_subtrees(test_execution):
+    subtrees = derive_independent_subtrees(test_execution)
+    faulted_subtrees = set()
+
+    for failure in test_execution.failures:
+        for root in subtrees:
+            if failure['execution_index'] in subtrees[root]:
+                faulted_subtrees.add(root)
+
+    return len(faulted_subtrees) > 1
+
+
+class DeferredTestExecutions:
+    """Test executions combining faults from independent subtrees, deferred until the subtrees
+    have been explored separately.
+
+    Each test execution is deferred at most once, and is known to be deferred until released, so
+    it isn't scheduled again in the meantime.  Test executions are compared by canonical key.
+    """
+
+    def __init__(self):
+        self.deferred = []
+        self.deferred_keys = set()
+        self.released_keys = set()
+
+    def should_defer(self, test_execution):
+        return test_execution.canonical_key() not in self.released_keys \
+            and test_execution.canonical_key() not in self.deferred_keys \
+            and spans_independent_subtrees(test_execution)
+
+    def defer(self, test_execution):
+        self.deferred.append(test_execution)
+        self.deferred_keys.add(test_execution.canonical_key())
+
+    # Release every deferred test execution, in the order they were deferred.
+    def release(self):
+        released = self.deferred
+        self.deferred = []
+        self.deferred_keys = set()
+        self.released_keys.update(te.canonical_key() for te in released)
+        return released
+
+    def num_released(self):
+        return len(self.released_keys)
+
+    def __contains__(self, test_execution):
+        return test_execution.canonical_key() in self.deferred_keys
+
+    def __len__(self):
+        return len(self.deferred)
+
+
+# Canonical signature of a log entry, failure or response log entry: a hash of its contents.
+def outcome_signature(entry):
+    return TestExecution.entry_signature(entry)
+
+
+# Map each execution index in the log of a test execution to the request made with it, the failure
+# injected into it (or None) and the signatures of both; computed once per test execution.
+def scheduled_outcomes(current_test_execution):
+    failures = {}
+    for f in current_test_execution.failures:
+        failures[f['execution_index']] = f
+
+    outcomes = {}
     for l_entry in current_test_execution.log:
-        if previously_ran_completed_request['execution_index'] == l_entry['execution_index']:
-            scheduled_request = l_entry
+        failure = failures.get(l_entry['execution_index'], None)
+        outcomes[l_entry['execution_index']] = (l_entry, failure,
+                                                outcome_signature(failure), outcome_signature(l_entry))
+
+    return outcomes
+
+
+# Given a test execution with what I'm about to do, make sure that what I've done previously matches that.
+# previous_signature is the signature of the previously ran request, if already known (see
+# TestExecution.response_log_signatures.)
+def outcomes_match(current_test_execution, previously_ran_completed_request, outcomes=None, previous_signature=None):
+    if outcomes is None:
+        outcomes = scheduled_outcomes(current_test_execution)
+    if previous_signature is None:
+        previous_signature = outcome_signature(previously_ran_completed_request)
+
+    # Find the same request in the current execution, and whether we're failing it.
+    (scheduled_request, failure, failure_signature, scheduled_request_signature) = \
+        outcomes.get(previously_ran_completed_request['execution_index'], (None, None, None, None))
 
-    failure = None
+    # The outcome only depends on what we are about to do with this request and what happened to it before.
+    key = (previously_ran_completed_request['execution_index'],
+           failure_signature,
+           scheduled_request_signature,
+           previous_signature)
 
-    # Find out if we're failing this in the current execution.
-    if scheduled_request is not None:
-        for f in current_test_execution.failures:
-            if f['execution_index'] == scheduled_request['execution_index']:
-                failure = f
+    if key in _outcome_matches:
+        _outcome_matches.move_to_end(key)
+        return _outcome_matches[key]
 
+    result = _outcomes_match(current_test_execution, scheduled_request, failure, previously_ran_completed_request)
+
+    _outcome_matches[key] = result
+    while len(_outcome_matches) > MAX_MEMOIZED_OUTCOMES:
+        _outcome_matches.popitem(last=False)
+
+    return result
+
+
+def _outcomes_match(current_test_execution, scheduled_request, failure, previously_ran_completed_request):
     # If we are going to fail this request, did it fail in the previous execution the same way?
     if failure is not None:
 
@@ -102,13 +270,14 @@ def outcomes_match(current_test_execution, previously_ran_completed_request):
                         # TODO: probably broken if more is reported then sent?
                         return is_subset_match(previously_ran_completed_request['exception'], failure['forced_exception'])
                     else:
-                        print("")
-                        print("previously_ran_completed_request['exception']")
-                        print(str(sorted(previously_ran_completed_request['exception'].items())))
-                        print("")
-                        print("failure['failure_metadata']['return_value']")
-                        print(str(sorted(failure['forced_exception'].items())))
-                        print("")
+                        if PRINT_MATCH_DIAGNOSTICS:
+                            print("")
+                            print("previously_ran_completed_request['exception']")
+                            print(str(sorted(previously_ran_completed_request['exception'].items())))
+                            print("")
+                            print("failure['failure_metadata']['return_value']")
+                            print(str(sorted(failure['forced_exception'].items())))
+                            print("")
 
                         return False
             else:
@@ -121,23 +290,25 @@ def outcomes_match(current_test_execution, previously_ran_completed_request):
                 # TODO: probably broken if more is reported then sent?
                 subset_match = is_subset_match(previously_ran_completed_request['return_value'], failure['failure_metadata']['return_value'])
                 # direct_match = str(previously_ran_completed_request['return_value']['status_code']) == str(failure['failure_metadata']['return_value']['status_code'])
-                warning("subset_match: " + str(subset_match))
-                # warning("direct_match: " + str(direct_match))
+                if PRINT_MATCH_DIAGNOSTICS:
+                    warning("subset_match: " + str(subset_match))
+                    # warning("direct_match: " + str(direct_match))
 
                 if subset_match:
                     return True
                 else:
-                    warning("We shouldn't be here because this means we matched on EI but the requests were different.")
+                    if PRINT_MATCH_DIAGNOSTICS:
+                        warning("We shouldn't be here because this means we matched on EI but the requests were different.")
 
-                    print("")
-                    print("subset_match: " + str(subset_match))
-                    print("")
-                    print("previously_ran_completed_request['return_value']")
-                    print(str(sorted(previously_ran_completed_request['return_value'].items())))
-                    print("")
-                    print("failure['failure_metadata']['return_value']")
-                    print(str(sorted(failure['failure_metadata']['return_value'].items())))
-                    print("")
+                        print("")
+                        print("subset_match: " + str(subset_match))
+                        print("")
+                        print("previously_ran_completed_request['return_value']")
+                        print(str(sorted(previously_ran_completed_request['return_value'].items())))
+                        print("")
+                        print("failure['failure_metadata']['return_value']")
+                        print(str(sorted(failure['failure_metadata']['return_value'].items())))
+                        print("")
 
                 return subset_match
             elif 'exception' in previously_ran_completed_request and previously_ran_completed_request['exception'] is not None and \
@@ -146,15 +317,16 @@ def outcomes_match(current_test_execution, previously_ran_completed_request):
                 subset_match = is_subset_match(previously_ran_completed_request['exception'], failure['failure_metadata']['exception'])
 
                 if subset_match is False:
-                    print("")
-                    print("subset_match: " + str(subset_match))
-                    print("")
-                    print("previously_ran_completed_request['exception']")
-                    print(str(sorted(previously_ran_completed_request['exception'].items())))
-                    print("")
-                    print("failure['failure_metadata']['exception']")
-                    print(str(sorted(failure['failure_metadata']['exception'].items())))
-                    print("")
+                    if PRINT_MATCH_DIAGNOSTICS:
+                        print("")
+                        print("subset_match: " + str(subset_match))
+                        print("")
+                        print("previously_ran_completed_request['exception']")
+                        print(str(sorted(previously_ran_completed_request['exception'].items())))
+                        print("")
+                        print("failure['failure_metadata']['exception']")
+                        print(str(sorted(failure['failure_metadata']['exception'].items())))
+                        print("")
 
                 return subset_match
             else:
@@ -180,21 +352,22 @@ def outcomes_match(current_test_execution, previously_ran_completed_request):
             if subset_match:
                 return True
             else:
-                warning("We shouldn't be here because this means we matched on EI but the requests were different.")
-                print("")
-                print("subset_match: " + str(subset_match))
-                print("")
-                print("SCHEDULED REQUEST ******")
-                print(str(sorted(scheduled_request.items())))
-                print("")
-                print("FAILURE ****************")
-                print(str(failure))
-                print("")
-                print("PREVIOUSLY RAN *********")
-                print(str(sorted(previously_ran_completed_request.items())))
-                print("")
-
-                describe_test_execution(current_test_execution, None, False)
+                if PRINT_MATCH_DIAGNOSTICS:
+                    warning("We shouldn't be here because this means we matched on EI but the requests were different.")
+                    print("")
+                    print("subset_match: " + str(subset_match))
+                    print("")
+                    print("SCHEDULED REQUEST ******")
+                    print(str(sorted(scheduled_request.items())))
+                    print("")
+                    print("FAILURE ****************")
+                    print(str(failure))
+                    print("")
+                    print("PREVIOUSLY RAN *********")
+                    print(str(sorted(previously_ran_completed_request.items())))
+                    print("")
+
+                    describe_test_execution(current_test_execution, None, False)
 
                 return False
 
@@ -202,22 +375,18 @@ def outcomes_match(current_test_execution, previously_ran_completed_request):
 def is_subset_match(A, B):
     return all(A.get(key, None) == val for key, val in B.items())
 
-def should_prune(test_execution, test_executions_ran):
-    # Derive causal descendents for the current request and print.
-    causal_descendents = derive_causal_descendents_from_execution(test_execution)
-    # print_causal_descendents(causal_descendents)
-    # info("")
-
-    all_causal_found = True
+# response_logs are the response logs of previously ran test executions, each with the signatures of its
+# entries.
+def causal_descendents_found(test_execution, causal_descendents, response_logs):
+    found = set()
+    outcomes = scheduled_outcomes(test_execution)
 
     for c in causal_descendents:
         # info("Need to find {} requests in a single trace with the same outcome.".format(len(causal_descendents[c])))
 
         i = 0
 
-        found = False
-
-        for te in test_executions_ran:
+        for (response_log, signatures) in response_logs:
             i = i + 1
             all_found = True
 
@@ -225,11 +394,11 @@ def should_prune(test_execution, test_executions_ran):
                 looking_for_execution_index = d
                 found_execution_index = False
 
-                for l_entry in te.response_log:
+                for (l_entry, signature) in zip(response_log, signatures):
 
                     # Request is in this previous test execution.
                     if l_entry['execution_index'] == looking_for_execution_index:
-                        if outcomes_match(test_execution, l_entry):
+                        if outcomes_match(test_execution, l_entry, outcomes, signature):
                             found_execution_index = True
                         else:
                             # info("-> ! found match for execution index, but outcomes didn't match")
@@ -241,13 +410,135 @@ def should_prune(test_execution, test_executions_ran):
             # info("-> all_found for previous execution {} is: {}".format(str(i), str(all_found)))
 
             if all_found:
-                found = True
+                found.add(c)
                 break
 
-        if not found:
-            all_causal_found = False
+    return found
+
+
+def should_prune(test_execution, test_executions_ran, compositional=False):
+    # Derive causal descendents for the current request and print.
+    causal_descendents = derive_causal_descendents_from_execution(test_execution, compositional)
+    # print_causal_descendents(causal_descendents)
+    # info("")
+
+    response_logs = [(te.response_log, te.response_log_signatures()) for te in test_executions_ran]
+    found = causal_descendents_found(test_execution, causal_descendents, response_logs)
+    all_causal_found = len(found) == len(causal_descendents)
 
     # info("")
     # info("All causal found: {}".format(all_causal_found))
 
     return all_causal_found
+
+
+def _pruning_worker(inputs, results):
+    # Each worker only holds its own slice of the history: the response logs of
+    # previously ran test executions that were assigned to it, with their signatures.
+    response_logs = []
+
+    while True:
+        (command, argument) = inputs.get()
+
+        if command == 'add':
+            response_logs.append(argument)
+        elif command == 'prune':
+            (sequence, test_execution, causal_descendents) = argument
+            results.put((sequence, causal_descendents_found(test_execution, causal_descendents, response_logs)))
+        elif command == 'stop':
+            break
+
+
+class PruningPool:
+    """Evaluates should_prune across a pool of worker processes, outside of the server's GIL.
+
+    History is shipped to the workers incrementally and partitioned round-robin, so each
+    decision only sends the candidate test execution and its causal descendents.  A causal
+    group is satisfied if any worker finds it satisfied in its slice of the history, which
+    gives the same answer as evaluating should_prune in-process.
+
+    If a worker dies or doesn't answer within PRUNING_WORKER_TIMEOUT, the pool is shut down
+    and this and every later decision is evaluated in-process.
+    """
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self.num_response_logs_sent = 0
+        self.sequence = 0
+        self.inputs = []
+        self.results = []
+        self.workers = []
+        self.failed = False
+
+        for x in range(num_workers):
+            inputs = _PRUNING_CONTEXT.Queue()
+            results = _PRUNING_CONTEXT.Queue()
+            worker = _PRUNING_CONTEXT.Process(target=_pruning_worker, args=(inputs, results))
+            worker.daemon = True
+            worker.start()
+            self.inputs.append(inputs)
+            self.results.append(results)
+            self.workers.append(worker)
+
+    # Result of the decision with this sequence number from a worker, or None if it died or timed out.
+    def _result(self, worker, results, sequence, deadline):
+        while True:
+            try:
+                (result_sequence, found) = results.get(timeout=min(1.0, max(deadline - time.monotonic(), 0.01)))
+            except Empty:
+                if not worker.is_alive():
+                    error("Pruning worker " + str(worker.pid) + " exited with code " + str(worker.exitcode) + ".")
+                    return None
+                if time.monotonic() >= deadline:
+                    error("Pruning worker " + str(worker.pid) + " timed out.")
+                    return None
+                continue
+
+            if result_sequence == sequence:
+                return found
+
+    def should_prune(self, test_execution, test_executions_ran, compositional=False):
+        if self.failed:
+            return should_prune(test_execution, test_executions_ran, compositional)
+
+        # Send the workers anything added to the history since the last decision.
+        for te in test_executions_ran[self.num_response_logs_sent:]:
+            self.inputs[self.num_response_logs_sent % self.num_workers].put(
+                ('add', (te.response_log, te.response_log_signatures())))
+            self.num_response_logs_sent += 1
+
+        causal_descendents = derive_causal_descendents_from_execution(test_execution, compositional)
+
+        # Only the filtered log and failures are needed to match outcomes.
+        compact_test_execution = TestExecution(test_execution.log, test_execution.failures)
+
+        self.sequence += 1
+        for inputs in self.inputs:
+            inputs.put(('prune', (self.sequence, compact_test_execution, causal_descendents)))
+
+        deadline = time.monotonic() + PRUNING_WORKER_TIMEOUT
+        found = set()
+        for (worker, results) in zip(self.workers, self.results):
+            worker_found = self._result(worker, results, self.sequence, deadline)
+            if worker_found is None:
+                warning("Pruning in-process from now on.")
+                self.failed = True
+                self.shutdown()
+                return should_prune(test_execution, test_executions_ran, compositional)
+            found.update(worker_found)
+
+        return len(found) == len(causal_descendents)
+
+    def shutdown(self):
+        for (worker, inputs) in zip(self.workers, self.inputs):
+            if worker.is_alive():
+                inputs.put(('stop', None))
+
+        for worker in self.workers:
+            worker.join(timeout=PRUNING_WORKER_TIMEOUT if not self.failed else 1)
+            if worker.is_alive():
+                worker.terminate()
+
+        self.workers = []
+        self.inputs = []
+        self.results = []
@@ -10,6 +10,8 @@ import sys
 import copy
 import time
 import json
+import itertools
+import threading
 
 from timeit import default_timer as timer
 
@@ -18,7 +20,10 @@ from filibuster.datatypes import TestExecution, ServerState
 from filibuster.debugging import print_test_executions_actually_ran, print_test_executions_actually_pruned, \
     describe_test_execution
 
-from filibuster.reduce_dynamic import should_prune as reduce_dynamic_should_prune
+from filibuster.reduce_dynamic import should_prune as reduce_dynamic_should_prune, PruningPool, \
+    derive_independent_subtrees, DeferredTestExecutions
+
+from filibuster.pruning_cache import load_pruning_cache, save_pruning_cache
 
 from filibuster.lifecycle import start_filibuster_server_thread
 
@@ -30,6 +35,8 @@ from filibuster.logger import error, warning, notice, info, debug
 
 from filibuster.server_helpers import should_fail_request_with, load_counterexample
 
+from filibuster.vclock import vclock_key
+
 app = Flask(__name__)
 
 COUNTEREXAMPLE_PATH = "counterexample.json"
@@ -47,6 +54,9 @@ if os.environ.get('PRINT_RESPONSES', ''):
 else:
     PRINT_RESPONSES = False
 
+# Seconds an event waits for the create of the request it depends on before it's dropped.
+PENDING_EVENT_TIMEOUT = float(os.environ.get('FILIBUSTER_PENDING_EVENT_TIMEOUT', '30'))
+
 # Global state.
 
 server_state = ServerState()
@@ -55,23 +65,36 @@ current_test_execution: TestExecution = None
 current_test_execution_batch = []
 test_executions_ran = []
 test_executions_scheduled = Stack()
+test_executions_deferred = DeferredTestExecutions()
 cumulative_dynamic_pruning_time_in_ms = 0
 cumulative_test_generation_time_in_ms = 0
 mean_dynamic_pruning_time_in_ms = []
 instrumentation_data = None
 counterexample = None
+test_epoch = 0
+events_mutex = threading.RLock()
+max_faults_per_execution = None
+k_wise = None
+covered_fault_combinations = set()
+executions_skipped_by_fault_limit = set()
+executions_skipped_by_k_wise = set()
 
 
 # Specific testing functions.
 
 
-def run_test(functional_test, only_initial_execution, disable_dynamic_reduction):
+def run_test(functional_test, only_initial_execution, disable_dynamic_reduction, pruning_workers=0,
+             pruning_cache=None, services_directory=None, compositional_exploration=False):
     global current_test_execution
     global test_executions_scheduled
     global requests_to_fail
     global current_test_execution_batch
     global test_executions_ran
+    global test_executions_deferred
     global counterexample
+    global covered_fault_combinations
+    global executions_skipped_by_fault_limit
+    global executions_skipped_by_k_wise
 
     iteration = 0
 
@@ -88,9 +111,33 @@ def run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
     # Keep track of executions pruned.
     test_executions_pruned = []
 
+    # Keep track of executions combining faults from independent subtrees; these run once the
+    # subtrees have been explored separately, and only if they can't be pruned by then.
+    compositional_exploration = compositional_exploration and not disable_dynamic_reduction and not counterexample
+    test_executions_deferred = DeferredTestExecutions()
+
     # Keep track of the tests that we need to run.
     test_executions_scheduled = Stack()
 
+    # Keep track of combinations of faults already covered and executions skipped because of fault bounds.
+    covered_fault_combinations = set()
+    executions_skipped_by_fault_limit = set()
+    executions_skipped_by_k_wise = set()
+
+    # Evaluate dynamic reduction in worker processes, if requested.
+    pruning_pool = None
+
+    if pruning_workers > 0 and not disable_dynamic_reduction and not counterexample:
+        pruning_pool = PruningPool(pruning_workers)
+
+    # Test executions observed by previous runs against unchanged services.
+    use_pruning_cache = pruning_cache is not None and not disable_dynamic_reduction and not counterexample
+    previous_test_executions_ran = []
+
+    if use_pruning_cache:
+        previous_test_executions_ran = load_pruning_cache(pruning_cache, functional_test, instrumentation_data,
+                                                          services_directory)
+
     if counterexample:  # Schedule a test execution for the counterexample.
         counterexample_test_execution = TestExecution.from_json(counterexample['TestExecution'])
         test_executions_scheduled.push(counterexample_test_execution)
@@ -117,11 +164,27 @@ def run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
 
         info("[DONE] Running initial non-failing execution (test 1)")
 
+        if compositional_exploration:
+            independent_subtrees = derive_independent_subtrees(initial_actual_test_execution)
+            info("Independent subtrees found in initial execution: " + str(len(independent_subtrees)))
+
         iteration = 1
 
     # Loop until list is exhausted.
     if not only_initial_execution:
-        while test_executions_scheduled.size() > 0:
+        while test_executions_scheduled.size() > 0 or len(test_executions_deferred) > 0:
+            if test_executions_scheduled.size() == 0:
+                info("Running " + str(len(test_executions_deferred)) + " deferred test executions.")
+
+                for te in reversed(test_executions_deferred.release()):
+                    test_executions_scheduled.push(te)
+
+            # Skip executions whose k-wise combinations of faults were all covered by executions that
+            # ran since they were scheduled.
+            if not counterexample and fault_bounds_violation(test_executions_scheduled.peek()) is not None:
+                record_fault_bounds_skip(test_executions_scheduled.pop())
+                continue
+
             if os.environ.get("PAUSE_BETWEEN", ""):
                 input("Press Enter to start next test...")
 
@@ -164,16 +227,26 @@ def run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
                     global cumulative_test_generation_time_in_ms
 
                     reduction_start_time = time.time_ns()
-                    dynamic_full_history_reduce = reduce_dynamic_should_prune(current_test_execution, test_executions_ran)
+                    history = previous_test_executions_ran + test_executions_ran
+                    if pruning_pool is not None:
+                        dynamic_full_history_reduce = pruning_pool.should_prune(current_test_execution, history,
+                                                                                compositional_exploration)
+                    else:
+                        dynamic_full_history_reduce = reduce_dynamic_should_prune(current_test_execution, history,
+                                                                                  compositional_exploration)
                     reduction_end_time = time.time_ns()
 
                     dynamic_pruning_time_in_ms = (reduction_end_time - reduction_start_time) / (10 ** 6)
-                    num_tests_compared_to = len(test_executions_ran)
+                    num_tests_compared_to = len(history)
                     cumulative_dynamic_pruning_time_in_ms += dynamic_pruning_time_in_ms
                     if num_tests_compared_to:
                         mean_dynamic_pruning_time_in_ms.append(dynamic_pruning_time_in_ms / num_tests_compared_to)
 
-                    if not dynamic_full_history_reduce:
+                    if not dynamic_full_history_reduce and compositional_exploration \
+                            and test_executions_deferred.should_defer(current_test_execution):
+                        info("Deferring test " + str(iteration) + "; it combines faults from independent subtrees.")
+                        test_executions_deferred.defer(current_test_execution)
+                    elif not dynamic_full_history_reduce:
                         # Run the test.
                         run_test_with_fresh_state(functional_test, counterexample is not None, False)
 
@@ -184,6 +257,7 @@ def run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
                                                                retcon=test_executions_ran)
                         test_executions_attempted.append(next_test_execution)
                         test_executions_ran.append(current_test_execution)
+                        record_covered_fault_combinations(current_test_execution)
                     else:
                         test_executions_pruned.append(current_test_execution)
                 else:
@@ -197,9 +271,19 @@ def run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
                                                            retcon=test_executions_ran)
                     test_executions_attempted.append(next_test_execution)
                     test_executions_ran.append(current_test_execution)
+                    record_covered_fault_combinations(current_test_execution)
 
             info("Test " + (str(iteration)) + " completed.")
 
+    if pruning_pool is not None:
+        pruning_pool.shutdown()
+
+    # Only a complete exploration is safe to reuse as history.
+    if use_pruning_cache and not only_initial_execution and test_executions_scheduled.size() == 0 \
+            and len(test_executions_deferred) == 0:
+        save_pruning_cache(pruning_cache, functional_test, instrumentation_data, services_directory,
+                           previous_test_executions_ran + test_executions_ran)
+
     notice("Completed testing " + str(functional_test))
     info("")
 
@@ -218,25 +302,95 @@ def run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
     info("Number of tests attempted: " + str(len(test_executions_attempted)))
     info("Number of test executions ran: " + str(len(test_executions_ran)))
     info("Test executions pruned with only dynamic pruning: " + str(len(test_executions_pruned)))
+    if use_pruning_cache:
+        info("Test executions loaded from the pruning cache: " + str(len(previous_test_executions_ran)))
+    if max_faults_per_execution is not None:
+        info("Test executions skipped by maximum faults per execution (" + str(max_faults_per_execution) + "): " +
+             str(len(executions_skipped_by_fault_limit)))
+    if k_wise is not None:
+        info("Test executions skipped by " + str(k_wise) + "-wise sampling: " + str(len(executions_skipped_by_k_wise)))
+    if compositional_exploration:
+        info("Test executions combining independent subtrees that were deferred: " + str(test_executions_deferred.num_released()))
     info("Total tests: " + str(len(test_executions_ran) + len(test_executions_pruned)))
     info("")
     info("Time elapsed: " + str(elapsed) + " seconds.")
 
 
-def should_schedule(test_execution, additional_test_executions):
+def not_yet_scheduled(test_execution, additional_test_executions):
     global test_executions_scheduled
     global current_test_execution_batch
     global test_executions_ran
+    global test_executions_deferred
 
-    # Only schedule an execution iff:
     # a.) We haven't scheduled it yet during this iteration.
     # b.) We haven't scheduled it in a previous execution.
     # c.) We aren't currently executing it in the current batch of tests.
     # d.) We haven't already ran it.
+    # e.) We haven't deferred it until independent subtrees have been explored.
     return test_execution not in additional_test_executions \
         and not test_executions_scheduled.contains(test_execution) \
         and test_execution not in current_test_execution_batch \
-        and test_execution not in test_executions_ran
+        and test_execution not in test_executions_ran \
+        and test_execution not in test_executions_deferred
+
+
+def should_schedule(test_execution, additional_test_executions):
+    # Only schedule an execution iff it's new and it's within the bounds on the number and
+    # combination of faults.  Doesn't record anything: candidates are checked more than once.
+    return not_yet_scheduled(test_execution, additional_test_executions) \
+        and within_fault_bounds(test_execution)
+
+
+def fault_signature(failure):
+    return json.dumps(failure, sort_keys=True)
+
+
+# Why an execution is outside the bounds on the number and combination of faults: 'fault_limit',
+# 'k_wise', or None if it's within them.
+def fault_bounds_violation(test_execution):
+    num_faults = len(test_execution.failures)
+
+    if max_faults_per_execution is not None and num_faults > max_faults_per_execution:
+        return 'fault_limit'
+
+    # Executions with fewer than k faults are always needed to reach the combinations they lead to.
+    if k_wise is None or num_faults < k_wise:
+        return None
+
+    # Only run executions that cover at least one k-subset of faults not covered by an execution that ran.
+    if fault_combinations(test_execution) <= covered_fault_combinations:
+        return 'k_wise'
+
+    return None
+
+
+def within_fault_bounds(test_execution):
+    return fault_bounds_violation(test_execution) is None
+
+
+def fault_combinations(test_execution):
+    signatures = sorted(fault_signature(f) for f in test_execution.failures)
+    return set(itertools.combinations(signatures, k_wise))
+
+
+def record_fault_bounds_skip(test_execution):
+    violation = fault_bounds_violation(test_execution)
+
+    if violation == 'fault_limit':
+        debug("Skipping execution with " + str(len(test_execution.failures)) +
+              " faults; exceeds maximum faults per execution.")
+        executions_skipped_by_fault_limit.add(test_execution)
+    elif violation == 'k_wise':
+        debug("Skipping execution; all " + str(k_wise) + "-wise combinations of its faults are covered.")
+        executions_skipped_by_k_wise.add(test_execution)
+
+
+# Called once an execution has run.
+def record_covered_fault_combinations(test_execution):
+    global covered_fault_combinations
+
+    if k_wise is not None and len(test_execution.failures) >= k_wise:
+        covered_fault_combinations |= fault_combinations(test_execution)
 
 
 def generate_additional_test_executions(generated_id, execution_index, instrumentation_type, analysis_file):
@@ -260,15 +414,17 @@ def generate_additional_test_executions(generated_id, execution_index, instrumen
 
     # Get the request
     req = None
-    for req_ in server_state.service_request_log:
+    req_index = None
+    for (index, req_) in enumerate(server_state.service_request_log):
         if str(generated_id) == str(req_['generated_id']):
             req = req_
+            req_index = index
             break
     if req is None:
         raise Exception("Something went fucking wrong!")
 
     # If this is as far as we reached so far...
-    if req == server_state.service_request_log[-1]:
+    if on_causal_frontier(server_state.service_request_log, req_index):
         # Is this request already failed?
         already_failed = False
 
@@ -341,6 +497,8 @@ def generate_additional_test_executions(generated_id, execution_index, instrumen
                                         debug("Adding req failure for request: " + str(req['execution_index']))
                                         debug("=> exception: " + str(exception))
                                         additional_test_executions.append(new_execution)
+                                elif not_yet_scheduled(new_execution, additional_test_executions):
+                                    record_fault_bounds_skip(new_execution)
 
                 # Error testing.
                 if instrumentation_type == 'request_received':
@@ -377,6 +535,8 @@ def generate_additional_test_executions(generated_id, execution_index, instrumen
                                                         req['execution_index']))
                                                     debug("=> failure description: " + str(type))
                                                     additional_test_executions.append(new_execution)
+                                            elif not_yet_scheduled(new_execution, additional_test_executions):
+                                                record_fault_bounds_skip(new_execution)
                             else:
                                 warning("Request does not have a target service, it's made outside of the system.")
 
@@ -392,6 +552,22 @@ def generate_additional_test_executions(generated_id, execution_index, instrumen
     return True
 
 
+# Has no call caused by the call at index been logged yet?
+#
+# Calls made concurrently with it can be logged after it in any order, so being the last call
+# logged isn't required.  Calls it caused have its vclock as their origin vclock.
+def on_causal_frontier(log, index):
+    req = log[index]
+    if 'vclock' not in req:
+        return index == len(log) - 1
+
+    req_vclock_key = vclock_key(req['vclock'])
+    for later in log[index + 1:]:
+        if 'origin_vclock' in later and vclock_key(later['origin_vclock']) == req_vclock_key:
+            return False
+    return True
+
+
 def read_analysis_file(analysis_file):
     with open(analysis_file, "r") as f:
         return json.load(f)
@@ -403,10 +579,20 @@ def run_test_with_fresh_state(functional_test, counterexample_provided=False, lo
     # Reset state.
     global test_executions_ran
     global server_state
+    global test_epoch
     server_state = ServerState()
 
+    # Services reset their vclocks and execution indexes when they see a new test epoch.  The
+    # functional test learns it from the environment, so its calls don't have to ask for it.
+    test_epoch += 1
+    os.environ['FILIBUSTER_TEST_EPOCH'] = str(test_epoch)
+
     exit_code = os.WEXITSTATUS(os.system(functional_test))
 
+    # Anything still waiting on a create now never will.
+    with events_mutex:
+        drop_pending_events()
+
     if not loadgen:
         if exit_code:
             # Allow replay of failed test
@@ -515,6 +701,7 @@ def health_check():
     return jsonify({"status": "OK"})
 
 
+# Used by instrumentation that predates test epochs.
 @app.route("/filibuster/new-test-execution/<service_name>", methods=['GET'])
 def new_test_execution_check(service_name):
     global server_state
@@ -528,10 +715,6 @@ def new_test_execution_check(service_name):
 @app.route("/filibuster/create", methods=['PUT'])
 def create():
     try:
-        global server_state
-        global cumulative_test_generation_time_in_ms
-        global instrumentation_data
-
         data = request.get_json()
 
         if PRINT_RESPONSES:
@@ -541,145 +724,276 @@ def create():
             print("***********************************************")
             print("")
 
-        # Update state to reflect the call.
-        server_state.generated_id_incr += 1
-        data['generated_id'] = server_state.generated_id_incr
-        server_state.service_request_log.append(data)
+        with events_mutex:
+            payload = process_create(data)
 
-        global requests_to_fail
-        failure_request_metadata = should_fail_request_with(data, requests_to_fail)
+        if PRINT_RESPONSES:
+            print("")
+            print("** CREATE RETURNING PAYLOAD *******************")
+            print(json.dumps(payload, indent=2))
+            print("***********************************************")
+            print("")
 
-        payload = {
-            'generated_id': server_state.generated_id_incr,
-        }
-        if 'execution_index' in data:
-            payload['execution_index'] = data['execution_index']
+        return jsonify(payload)
+    except Exception as e:
+        error("Exception when calling CREATE: ")
+        print(e, file=sys.stderr)
 
-        if failure_request_metadata is not None:
-            for key in failure_request_metadata:
-                payload[key] = failure_request_metadata[key]
 
-        if 'instrumentation_type' in data and data['instrumentation_type'] == 'invocation':
-            gen_id = server_state.service_request_log[-1]['generated_id']
-            execution_index = data['execution_index']
+@app.route("/filibuster/failure-plan", methods=['GET'])
+def failure_plan():
+    global requests_to_fail
 
-            # This is the initial execution.
-            if current_test_execution is None:
-                execution_start_time = time.time_ns()
+    # Services use the plan to decide on faults locally, and notify the server of creates asynchronously.
+    return jsonify({
+        'test_epoch': test_epoch,
+        'failures': {str(f['execution_index']): f for f in requests_to_fail}
+    })
+
+
+def process_create(data):
+    global server_state
+    global cumulative_test_generation_time_in_ms
+    global instrumentation_data
+    global requests_to_fail
+
+    # Update state to reflect the call.
+    server_state.generated_id_incr += 1
+    data['generated_id'] = server_state.generated_id_incr
+    server_state.service_request_log.append(data)
+
+    if 'client_generated_id' in data:
+        server_state.generated_id_by_client_id[data['client_generated_id']] = server_state.generated_id_incr
+
+    failure_request_metadata = should_fail_request_with(data, requests_to_fail)
+
+    payload = {
+        'generated_id': server_state.generated_id_incr,
+        'test_epoch': test_epoch
+    }
+    if 'execution_index' in data:
+        payload['execution_index'] = data['execution_index']
+
+    if failure_request_metadata is not None:
+        for key in failure_request_metadata:
+            payload[key] = failure_request_metadata[key]
+
+    if 'instrumentation_type' in data and data['instrumentation_type'] == 'invocation':
+        gen_id = server_state.service_request_log[-1]['generated_id']
+        execution_index = data['execution_index']
+
+        # This is the initial execution.
+        if current_test_execution is None:
+            execution_start_time = time.time_ns()
+            generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
+                                                instrumentation_data)
+            execution_end_time = time.time_ns()
+
+            test_generation_time_in_ms = (execution_end_time - execution_start_time) / (10 ** 6)
+            cumulative_test_generation_time_in_ms += test_generation_time_in_ms
+        else:
+            generated_id_found = False
+
+            # If the request was already known, we don't want to FI in it, because
+            # we already did when it was originally executed.  (Generated ids and vclocks
+            # depend on the order concurrent calls were made in, so they are not compared.)
+            #
+            if current_test_execution.contains_log_entry(server_state.service_request_log[-1]):
+                generated_id_found = True
+
+            if not generated_id_found:
+                generation_start_time = time.time_ns()
                 generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
                                                     instrumentation_data)
-                execution_end_time = time.time_ns()
+                generation_end_time = time.time_ns()
 
-                test_generation_time_in_ms = (execution_end_time - execution_start_time) / (10 ** 6)
+                test_generation_time_in_ms = (generation_end_time - generation_start_time) / (10 ** 6)
                 cumulative_test_generation_time_in_ms += test_generation_time_in_ms
-            else:
-                generated_id_found = False
 
-                # If the request was already known, we don't want to FI in it, because
-                # we already did when it was originally executed.
-                #
-                for l in current_test_execution.log:
-                    if l == TestExecution.filter_request_for_log(server_state.service_request_log[-1]):
-                        generated_id_found = True
+    return payload
 
-                if not generated_id_found:
-                    generation_start_time = time.time_ns()
-                    generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
-                                                        instrumentation_data)
-                    generation_end_time = time.time_ns()
 
-                    test_generation_time_in_ms = (generation_end_time - generation_start_time) / (10 ** 6)
-                    cumulative_test_generation_time_in_ms += test_generation_time_in_ms
+@app.route("/filibuster/update", methods=['POST'])
+def update():
+    try:
+        data = request.get_json()
 
         if PRINT_RESPONSES:
             print("")
-            print("** CREATE RETURNING PAYLOAD *******************")
-            print(json.dumps(payload, indent=2))
+            print("** UPDATE CALLED WITH PAYLOAD *****************")
+            print(json.dumps(data, indent=2))
             print("***********************************************")
             print("")
 
-        return jsonify(payload)
+        with events_mutex:
+            process_event(data)
+
+        if PRINT_RESPONSES:
+            print("")
+            print("** UPDATE RETURNING EMPTY PAYLOAD *******************")
+            print("*****************************************************")
+            print("")
+
+        return jsonify({})
     except Exception as e:
-        error("Exception when calling CREATE: ")
+        error("Exception when calling UPDATE: ")
         print(e, file=sys.stderr)
 
 
-@app.route("/filibuster/update", methods=['POST'])
-def update():
+@app.route("/filibuster/update-batch", methods=['POST'])
+def update_batch():
     try:
-        global server_state
-        global current_test_execution
-        global instrumentation_data
-
         data = request.get_json()
 
         if PRINT_RESPONSES:
             print("")
-            print("** UPDATE CALLED WITH PAYLOAD *****************")
+            print("** UPDATE-BATCH CALLED WITH PAYLOAD ***********")
             print(json.dumps(data, indent=2))
             print("***********************************************")
             print("")
 
-        idx = data['generated_id']
+        # Events are processed in the order they were reported.
+        with events_mutex:
+            for event in data:
+                try:
+                    process_event(event)
+                except Exception as e:
+                    error("Exception when processing event in UPDATE-BATCH: ")
+                    print(e, file=sys.stderr)
 
-        if isinstance(idx, str):
-            idx = int(idx)
-        if idx < 0 or len(server_state.service_request_log) <= idx:
-            raise IndexError
-        for key in data.keys():
-            if key == 'generated_id':
-                continue
-            if data[key] is not None:
-                server_state.service_request_log[idx][key] = data[key]
+            drop_pending_events(PENDING_EVENT_TIMEOUT)
 
-        # For each request that we make, we receive *2* updates:
-        #
-        # 1.) From the remote service, if under instrumentation through Flask. (request_received)
-        # 2.) When the call is completed. (invocation_complete)
-        #
-        if 'instrumentation_type' in data and data['instrumentation_type'] == 'request_received':
-            gen_id = data['generated_id']
-            execution_index = data['execution_index']
+        return jsonify({})
+    except Exception as e:
+        error("Exception when calling UPDATE-BATCH: ")
+        print(e, file=sys.stderr)
 
-            # This is the initial execution.
-            if current_test_execution is None:
-                generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
-                                                    instrumentation_data)
-            else:
-                # Request comes in, do we know about it from the log?
-                req = None
 
-                # Get the request out of the current log by the id.
-                for l in server_state.service_request_log:
-                    if str(gen_id) == str(l['generated_id']):
-                        req = TestExecution.filter_request_for_log(l)
+# Generated ids assigned by services, rather than by the server.
+def is_client_generated_id(generated_id):
+    return isinstance(generated_id, str) and generated_id != 'None' and not generated_id.isdigit()
 
-                if req is None:
-                    error("There was a huge problem in Filibuster.  This should never happen!!!!")
 
-                # See if it exists in the current_request_log (the currently executing test.)
-                found_in_execution_log = False
+# Process a create or update event reported by a service.
+#
+# Creates are reported asynchronously, so events from a service can arrive before the create of
+# the request that reached the service; those wait until that create has been processed.
+def process_event(data):
+    global server_state
 
-                for entry in current_test_execution.log:
-                    if entry == req:
-                        debug("We've already seen this request before; ignoring.")
-                        found_in_execution_log = True
-                        break
+    if data.get('test_epoch', None) not in [None, 'None'] and int(data['test_epoch']) != test_epoch:
+        warning("Ignoring event from a previous test execution.")
+        return
 
-                if not found_in_execution_log:
-                    generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
-                                                        instrumentation_data)
+    is_create = data.get('instrumentation_type', None) == 'invocation'
 
-        if PRINT_RESPONSES:
-            print("")
-            print("** UPDATE RETURNING EMPTY PAYLOAD *******************")
-            print("*****************************************************")
-            print("")
+    if is_create:
+        waiting_on = data.get('parent_generated_id', None)
+    else:
+        waiting_on = data.get('generated_id', None)
 
-        return jsonify({})
-    except Exception as e:
-        error("Exception when calling UPDATE: ")
-        print(e, file=sys.stderr)
+    if is_client_generated_id(waiting_on) and waiting_on not in server_state.generated_id_by_client_id:
+        server_state.pending_events_by_client_id.setdefault(waiting_on, []).append((time.time(), data))
+        return
+
+    if is_create:
+        # Batches the server may have processed are sent again if the service didn't hear back.
+        client_generated_id = data.get('client_generated_id', None)
+        if client_generated_id is not None and client_generated_id in server_state.generated_id_by_client_id:
+            debug("Ignoring create of request " + str(client_generated_id) + " seen before.")
+            return
+
+        process_create(data)
+
+        pending_events = server_state.pending_events_by_client_id.pop(data.get('client_generated_id', None), [])
+        for (received_at, pending_event) in pending_events:
+            process_event(pending_event)
+    else:
+        if is_client_generated_id(data['generated_id']):
+            data['generated_id'] = server_state.generated_id_by_client_id[data['generated_id']]
+
+        process_update(data)
+
+
+# Drop events that have waited longer than max_age seconds (all of them, if None) for the create of
+# the request they depend on, e.g. because the service reporting it died before the create was sent.
+def drop_pending_events(max_age=None):
+    global server_state
+
+    now = time.time()
+
+    for waiting_on in list(server_state.pending_events_by_client_id.keys()):
+        pending_events = server_state.pending_events_by_client_id[waiting_on]
+        dropped = [event for (received_at, event) in pending_events
+                   if max_age is None or now - received_at > max_age]
+        if not dropped:
+            continue
+
+        warning("Dropping " + str(len(dropped)) + " event(s) that never saw the create of request " +
+                str(waiting_on) + ".")
+        for event in dropped:
+            debug("Dropped event: " + json.dumps(event, default=str))
+
+        remaining = [(received_at, event) for (received_at, event) in pending_events
+                     if max_age is not None and now - received_at <= max_age]
+        if remaining:
+            server_state.pending_events_by_client_id[waiting_on] = remaining
+        else:
+            del server_state.pending_events_by_client_id[waiting_on]
+
+
+def process_update(data):
+    global server_state
+    global current_test_execution
+    global instrumentation_data
+
+    idx = data['generated_id']
+
+    if isinstance(idx, str):
+        idx = int(idx)
+    if idx < 0 or len(server_state.service_request_log) <= idx:
+        raise IndexError
+    for key in data.keys():
+        if key == 'generated_id':
+            continue
+        if data[key] is not None:
+            server_state.service_request_log[idx][key] = data[key]
+
+    # For each request that we make, we receive *2* updates:
+    #
+    # 1.) From the remote service, if under instrumentation through Flask. (request_received)
+    # 2.) When the call is completed. (invocation_complete)
+    #
+    if 'instrumentation_type' in data and data['instrumentation_type'] == 'request_received':
+        gen_id = data['generated_id']
+        execution_index = data['execution_index']
+
+        # This is the initial execution.
+        if current_test_execution is None:
+            generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
+                                                instrumentation_data)
+        else:
+            # Request comes in, do we know about it from the log?
+            req = None
+
+            # Get the request out of the current log by the id.
+            for l in server_state.service_request_log:
+                if str(gen_id) == str(l['generated_id']):
+                    req = TestExecution.filter_request_for_log(l)
+
+            if req is None:
+                error("There was a huge problem in Filibuster.  This should never happen!!!!")
+
+            # See if it exists in the current_request_log (the currently executing test.)
+            found_in_execution_log = False
+
+            if current_test_execution.contains_log_entry(req):
+                debug("We've already seen this request before; ignoring.")
+                found_in_execution_log = True
+
+            if not found_in_execution_log:
+                generate_additional_test_executions(gen_id, execution_index, data['instrumentation_type'],
+                                                    instrumentation_data)
 
 
 def start_thread(queue, functional_test, counterexample_file, num_requests):
@@ -779,24 +1093,38 @@ def start_filibuster_server_and_run_multi_threaded_test(functional_test, analysi
     info("--------------- Loadgen Statistics ---------------")
 
 
-def start_filibuster_server_and_run_test(functional_test, analysis_file, counterexample_file, only_initial_execution, disable_dynamic_reduction):
-    start_filibuster_server(analysis_file)
+def start_filibuster_server_and_run_test(functional_test, analysis_file, counterexample_file, only_initial_execution, disable_dynamic_reduction, pruning_workers=0, pruning_cache=None, services_directory=None, max_faults=None, k=None, compositional_exploration=False, unix_socket=None, tcp=True):
+    start_filibuster_server(analysis_file, unix_socket, tcp)
 
     global counterexample
+    global max_faults_per_execution
+    global k_wise
+
+    max_faults_per_execution = max_faults
+    k_wise = k
 
     if counterexample_file:
         counterexample = load_counterexample(counterexample_file)
 
-    run_test(functional_test, only_initial_execution, disable_dynamic_reduction)
+    run_test(functional_test, only_initial_execution, disable_dynamic_reduction, pruning_workers, pruning_cache,
+             services_directory, compositional_exploration)
 
 
-def start_filibuster_server(analysis_file):
+# Without tcp, the server only listens on the Unix domain socket.
+def start_filibuster_server(analysis_file, unix_socket=None, tcp=True):
     global instrumentation_data
     instrumentation_data = analysis_file
 
-    start_filibuster_server_thread(app)
+    start_filibuster_server_thread(app, unix_socket, tcp)
 
-    wait_for_services_to_start([('filibuster', '127.0.0.1', 5005)])
+    # Let the functional test (and its assertions) reach the server over the socket.
+    if unix_socket is not None:
+        os.environ['FILIBUSTER_URL'] = "unix://" + unix_socket
+
+    if tcp:
+        wait_for_services_to_start([('filibuster', '127.0.0.1', 5005)])
+    else:
+        wait_for_services_to_start([('filibuster', unix_socket)])
 
 
 def my_percentile(data, percentile):
@@ -12,6 +12,9 @@ class Stack:
     def pop(self):
         return self.stack.pop()
 
+    def peek(self):
+        return self.stack[-1]
+
     def size(self):
         return len(self.stack)
 
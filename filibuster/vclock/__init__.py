@@ -1,101 +1,157 @@
+import threading
+
+from array import array
 from json import dumps, loads
 
-from filibuster.logger import debug
+from filibuster.logger import debug, debug_enabled
+
+# Service names are interned to small integers for the lifetime of the process, so clocks
+# can be stored as arrays of counters indexed by service id.
+_service_ids = {}
+_service_names = []
+_service_ids_mutex = threading.Lock()
+
+
+def _service_id(actor):
+    service_id = _service_ids.get(actor, None)
+    if service_id is None:
+        with _service_ids_mutex:
+            service_id = _service_ids.get(actor, None)
+            if service_id is None:
+                service_id = len(_service_names)
+                _service_names.append(actor)
+                _service_ids[actor] = service_id
+    return service_id
+
+
+class VClock:
+    """Vector clock stored as an array of counters indexed by interned service id.
+
+    Clocks are never modified once built: increment and merge return new clocks, so a clock
+    can be handed to the reporter (or kept in a log) while the service keeps advancing.
+    Missing services count as 0.
+    """
+
+    __slots__ = ('counts',)
+
+    def __init__(self, counts=None):
+        self.counts = counts if counts is not None else array('Q')
+
+    @classmethod
+    def fromdict(cls, clock):
+        counts = array('Q')
+        for (actor, count) in clock.items():
+            service_id = _service_id(actor)
+            if service_id >= len(counts):
+                counts.extend([0] * (service_id + 1 - len(counts)))
+            counts[service_id] = count
+        return cls(counts)
+
+    def todict(self):
+        return {_service_names[i]: count for (i, count) in enumerate(self.counts) if count}
+
+    def items(self):
+        return self.todict().items()
+
+    def increment(self, actor):
+        service_id = _service_id(actor)
+        counts = array('Q', self.counts)
+        if service_id >= len(counts):
+            counts.extend([0] * (service_id + 1 - len(counts)))
+        counts[service_id] += 1
+        return VClock(counts)
+
+    # Counter-by-counter maximum of the two clocks.
+    def merge(self, other):
+        (longer, shorter) = (self.counts, other.counts)
+        if len(longer) < len(shorter):
+            (longer, shorter) = (shorter, longer)
+        counts = array('Q', map(max, longer, shorter))
+        counts.extend(longer[len(shorter):])
+        return VClock(counts)
+
+    # Does other descend this clock?
+    def descended_by(self, other):
+        (mine, theirs) = (self.counts, other.counts)
+        width = max(len(mine), len(theirs))
+        mine = mine.tolist() + [0] * (width - len(mine))
+        theirs = theirs.tolist() + [0] * (width - len(theirs))
+        return all(map(int.__le__, mine, theirs)) and any(map(int.__lt__, mine, theirs))
+
+    def key(self):
+        return frozenset((_service_names[i], count) for (i, count) in enumerate(self.counts) if count)
+
+    def __eq__(self, other):
+        if isinstance(other, VClock):
+            return self.key() == other.key()
+        if isinstance(other, dict):
+            return self.key() == vclock_key(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return str(self.todict())
+
+    # Service ids are only meaningful in this process; pickle by service name (e.g. for the
+    # shared state server.)
+    def __reduce__(self):
+        return VClock.fromdict, (self.todict(),)
+
+
+def _as_vclock(clock):
+    if isinstance(clock, VClock):
+        return clock
+    return VClock.fromdict(clock)
 
 
 def vclock_new():
-    clock = {}
-    return clock
+    return VClock()
 
 
 def vclock_increment(clock, actor):
-    if actor in clock:
-        clock[actor] = clock[actor] + 1
-    else:
-        clock[actor] = 1
+    return _as_vclock(clock).increment(actor)
+
 
+# Clocks are sent and reported as JSON objects keyed by service name.
+def vclock_todict(clock):
+    if isinstance(clock, VClock):
+        return clock.todict()
     return clock
 
 
 def vclock_tostring(clock):
-    return dumps(clock)
+    return dumps(vclock_todict(clock))
 
 
 def vclock_fromstring(serialized):
     loaded = loads(str(serialized))
-    return loaded
+    return VClock.fromdict(loaded)
 
 
-# Check if clocks are equal.
-def vclock_equals(clock1, clock2):
-    # First, check that both clocks have the same keys.
-    clock1_keys = clock1.keys()
-    clock2_keys = clock2.keys()
-    if clock1_keys == clock2_keys:
-        return False
+# Hashable key for a clock (either a VClock or a dict); equal clocks have equal keys.
+def vclock_key(clock):
+    if isinstance(clock, VClock):
+        return clock.key()
+    return frozenset((actor, count) for (actor, count) in clock.items() if count)
 
-    # Verify that they have the same values for each key.
-    for key in clock1:
-        if clock1[key] != clock2[key]:
-            return False
 
-    return True
+# Check if clocks are equal: services missing from a clock count as 0.
+def vclock_equals(clock1, clock2):
+    return vclock_key(clock1) == vclock_key(clock2)
 
 
 # Merge.
 def vclock_merge(clock1, clock2):
-    new_clock = vclock_new()
-
-    for key in clock1:
-        if key not in clock2:
-            new_clock[key] = clock1[key]
-        else:
-            new_clock[key] = max(clock1[key], clock2[key])
-
-    for key in clock2:
-        if key not in clock1:
-            new_clock[key] = clock2[key]
-
-    return new_clock
+    return _as_vclock(clock1).merge(_as_vclock(clock2))
 
 
 # Does clock2 descend clock1?
 def vclock_descends(clock1, clock2):
-    debug("vclock compare entering")
-    debug("clock1: " + str(clock1))
-    debug("clock2: " + str(clock2))
-
-    clock2_at_least_equal_to_clock1 = True
-
-    # First, make sure that every entry in clock1 exists in clock2 and is leq.
-    for key in clock1:
-        # Does the key exist in clock2?
-        if key not in clock2:
-            clock2_at_least_equal_to_clock1 = False
-            break
-        else:
-            # If it does, make sure it's leq then clock2.
-            if not clock2[key] >= clock1[key]:
-                clock2_at_least_equal_to_clock1 = False
-                break
-
-    debug("clock2_at_least_equal_to_clock1: " + str(clock2_at_least_equal_to_clock1))
-
-    # Then, make sure at least one clock in clock2 is greater than the one in clock1.
-    clock2_greater_in_single_clock = False
-
-    for key in clock2:
-        # If clock2 has a key clock1 doesn't have, then it is.
-        if key not in clock1:
-            clock2_greater_in_single_clock = True
-            break
-        # Otherwise, the lamport clock in clock2 should be greater than it in clock1
-        else:
-            if clock2[key] > clock1[key]:
-                clock2_greater_in_single_clock = True
-                break
-
-    debug("clock2_greater_in_single_clock: " + str(clock2_greater_in_single_clock))
-
-    # Both conditions have to be true.
-    return clock2_greater_in_single_clock and clock2_at_least_equal_to_clock1
+    result = _as_vclock(clock1).descended_by(_as_vclock(clock2))
+
+    if debug_enabled():
+        debug("vclock compare: " + str(clock1) + " <= " + str(clock2) + ": " + str(result))
+
+    return result
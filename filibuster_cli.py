@@ -11,17 +11,55 @@ from filibuster.server import start_filibuster_server_and_run_test
 @click.option('--only-initial-execution', type=bool, is_flag=True, help='Only run the initial, fault-free execution '
                                                                         'of the test.')
 @click.option('--disable-dynamic-reduction', type=bool, is_flag=True, help='Disable dynamic reduction.')
-def test(functional_test, analysis_file, counterexample_file, only_initial_execution, disable_dynamic_reduction):
+@click.option('--pruning-workers', default=0, type=int, help='Number of worker processes used for dynamic reduction '
+                                                             '(0 runs dynamic reduction in the server process.)')
+@click.option('--pruning-cache', type=str, help='File used to persist dynamic reduction history across runs.')
+@click.option('--services-directory', default="services", type=str, help='Directory containing one subdirectory '
+                                                                          'per service; used to detect changed '
+                                                                          'services when using a pruning cache.')
+@click.option('--max-faults-per-execution', type=click.IntRange(min=1), help='Maximum number of faults injected '
+                                                                              'simultaneously in a test execution.')
+@click.option('--k-wise', type=click.IntRange(min=1), help='Only run test executions that cover a new combination of '
+                                                           'k faults (e.g. 2 for pairwise.)')
+@click.option('--compositional-exploration', type=bool, is_flag=True, help='Explore faults in causally independent '
+                                                                          'subtrees separately, pruning executions '
+                                                                          'that combine them.')
+@click.option('--unix-socket', type=str, help='Unix domain socket the Filibuster server also listens on; '
+                                              'instrumentation uses it when given unix://<path> as its URL.')
+@click.option('--unix-socket-only', type=bool, is_flag=True, help='Only listen on the Unix domain socket given with '
+                                                                  '--unix-socket, not on TCP port 5005.')
+def test(functional_test, analysis_file, counterexample_file, only_initial_execution, disable_dynamic_reduction,
+         pruning_workers, pruning_cache, services_directory, max_faults_per_execution, k_wise,
+         compositional_exploration, unix_socket, unix_socket_only):
     """Test a microservice application using Filibuster."""
 
     # Resolve full path of analysis file.
     abs_analysis_file = abspath(os.path.dirname(os.path.realpath(__file__)) + "/" + analysis_file)
 
+    if unix_socket_only and unix_socket is None:
+        raise click.BadParameter("requires --unix-socket.", param_hint='--unix-socket-only')
+
+    if pruning_cache is not None:
+        pruning_cache = abspath(pruning_cache)
+        services_directory = abspath(services_directory)
+
+        if not os.path.isdir(services_directory):
+            raise click.BadParameter("services directory " + services_directory + " does not exist.",
+                                     param_hint='--services-directory')
+
     start_filibuster_server_and_run_test(functional_test,
                                          abs_analysis_file,
                                          counterexample_file,
                                          only_initial_execution,
-                                         disable_dynamic_reduction)
+                                         disable_dynamic_reduction,
+                                         pruning_workers,
+                                         pruning_cache,
+                                         services_directory,
+                                         max_faults_per_execution,
+                                         k_wise,
+                                         compositional_exploration,
+                                         abspath(unix_socket) if unix_socket is not None else None,
+                                         not unix_socket_only)
 
 
 if __name__ == '__main__':
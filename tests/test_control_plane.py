@@ -0,0 +1,69 @@
+import http.client
+import socket
+import threading
+
+import pytest
+
+from filibuster.control_plane import ControlPlaneClient
+
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}'
+
+
+class Server:
+    """Answers the first request on each connection, then handles the next one as close_after says:
+    'idle' closes the connection once idle, 'request' closes it after reading a request."""
+
+    def __init__(self, close_after):
+        self.close_after = close_after
+        self.requests = 0
+        self.closed = threading.Event()
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.url = 'http://127.0.0.1:' + str(self.listener.getsockname()[1])
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _read_request(self, connection):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            data += connection.recv(65536)
+        (headers, body) = data.split(b'\r\n\r\n', 1)
+        for line in headers.split(b'\r\n'):
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+                while len(body) < length:
+                    body += connection.recv(65536)
+        self.requests += 1
+
+    def _serve(self):
+        while True:
+            (connection, _) = self.listener.accept()
+            self._read_request(connection)
+            connection.sendall(RESPONSE)
+
+            if self.close_after == 'request':
+                self._read_request(connection)
+            connection.close()
+            self.closed.set()
+
+
+def test_idle_connections_closed_by_the_server_are_not_reused():
+    server = Server('idle')
+    client = ControlPlaneClient()
+
+    assert client.post(server.url + '/filibuster/update-batch', json=[]).status_code == 200
+    server.closed.wait(5)
+    assert client.post(server.url + '/filibuster/update-batch', json=[]).status_code == 200
+
+    assert server.requests == 2
+
+
+def test_posts_the_server_may_have_handled_are_not_made_again():
+    server = Server('request')
+    client = ControlPlaneClient()
+
+    assert client.post(server.url + '/filibuster/update-batch', json=[]).status_code == 200
+    with pytest.raises(http.client.RemoteDisconnected):
+        client.post(server.url + '/filibuster/update-batch', json=[])
+
+    assert server.requests == 2
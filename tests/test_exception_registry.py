@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from filibuster.instrumentation.exception_registry import exception_class, preload
+
+
+def test_resolves_builtin_and_dotted_names():
+    assert exception_class('ConnectionError') is ConnectionError
+    assert exception_class('json.decoder.JSONDecodeError') is json.decoder.JSONDecodeError
+
+
+def test_unknown_names_raise_every_time():
+    for i in range(2):
+        with pytest.raises(LookupError, match='no.such.module.Error'):
+            exception_class('no.such.module.Error')
+
+    with pytest.raises(LookupError):
+        exception_class('json.NoSuchError')
+
+
+def test_preload_warns_about_unknown_names_instead_of_raising():
+    preload([
+        {'forced_exception': {'name': 'no.such.module.OtherError', 'metadata': {}}},
+        {'forced_exception': {'name': 'TimeoutError', 'metadata': None}},
+    ])
+
+    assert exception_class('TimeoutError') is TimeoutError
@@ -0,0 +1,79 @@
+import itertools
+
+import pytest
+
+from filibuster import execution_index
+from filibuster.execution_index import execution_index_new, execution_index_push, execution_index_pop, \
+    execution_index_tostring, execution_index_fromstring, execution_index_is_rolling
+
+ROLLING_ROOT = '0' * 32
+
+# Pushes (service names) and pops (None) made by a service.
+CALLS = [
+    ['a'],
+    ['b'],
+    ['a', None, 'a'],
+    ['a', 'b'],
+    ['b', 'a'],
+    ['a', None, 'b'],
+    ['a', 'a'],
+]
+
+
+@pytest.fixture(params=['', '1'], ids=['path', 'rolling'])
+def rolling(request, monkeypatch):
+    monkeypatch.setattr(execution_index, 'EI_ROLLING_HASH', request.param)
+    return bool(request.param)
+
+
+def _run(calls):
+    ei = execution_index_new()
+    for service in calls:
+        ei = execution_index_pop(ei) if service is None else execution_index_push(service, ei)
+    return execution_index_tostring(ei)
+
+
+def test_round_trip(rolling):
+    serialized = _run(['a', 'b'])
+    assert execution_index_is_rolling(serialized) == rolling
+    assert execution_index_tostring(execution_index_fromstring(serialized)) == serialized
+
+
+def test_pop_returns_to_the_caller(rolling):
+    ei = execution_index_push('a', execution_index_new())
+    caller = execution_index_tostring(ei)
+
+    ei = execution_index_pop(execution_index_push('b', ei))
+    assert execution_index_tostring(ei) == caller
+
+    ei = execution_index_pop(ei)
+    assert execution_index_tostring(ei) == execution_index_tostring(execution_index_new())
+
+    with pytest.raises(RuntimeError):
+        execution_index_pop(ei)
+
+
+def test_rolling_hashes_distinguish_the_same_calls_as_paths(monkeypatch):
+    paths = [_run(calls) for calls in CALLS]
+
+    monkeypatch.setattr(execution_index, 'EI_ROLLING_HASH', '1')
+    hashes = [_run(calls) for calls in CALLS]
+
+    assert len(set(hashes)) == len(set(paths))
+    for (i, j) in itertools.product(range(len(CALLS)), repeat=2):
+        assert (paths[i] == paths[j]) == (hashes[i] == hashes[j])
+
+    # And only depend on the calls made.
+    assert hashes == [_run(calls) for calls in CALLS]
+
+
+def test_received_rolling_hashes_are_extended_but_not_popped(monkeypatch):
+    monkeypatch.setattr(execution_index, 'EI_ROLLING_HASH', '1')
+
+    received = execution_index_fromstring(_run(['a']))
+    assert execution_index_tostring(execution_index_push('b', received)) == _run(['a', 'b'])
+
+    with pytest.raises(RuntimeError):
+        execution_index_pop(received)
+
+    assert execution_index_tostring(execution_index_fromstring(ROLLING_ROOT)) == ROLLING_ROOT
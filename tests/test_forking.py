@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from filibuster.instrumentation import forking
+from filibuster.instrumentation.helpers import set_incoming_context, reset_incoming_context
+
+
+@pytest.fixture
+def thread_pools():
+    forking.instrument_thread_pools()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+    forking.uninstrument_thread_pools()
+
+
+def _fork_path():
+    fork = forking._filibuster_fork.get()
+    return None if fork is None else fork.path
+
+
+def test_work_submitted_outside_a_request_is_not_forked(thread_pools):
+    assert thread_pools.submit(_fork_path).result() is None
+
+
+def test_work_submitted_while_handling_a_request_is_forked(thread_pools):
+    token = set_incoming_context({'request_id': 'r1', 'execution_index': None})
+    try:
+        paths = [thread_pools.submit(_fork_path).result() for i in range(2)]
+    finally:
+        reset_incoming_context(token)
+
+    assert paths == [(0,), (1,)]
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from filibuster import global_context
+from filibuster.global_context import request_mutex, acquire_request, release_request, set_request_scoped_map, \
+    get_value, RequestLocks
+
+REQUEST_SCOPED_KEY = 'test_global_context_by_request'
+set_request_scoped_map(REQUEST_SCOPED_KEY)
+
+
+def test_request_mutex_survives_release_of_request_while_held():
+    acquire_request('r1')
+    get_value(REQUEST_SCOPED_KEY)['r1'] = 1
+
+    mutex = request_mutex('r1')
+    mutex.acquire()
+    release_request('r1')
+
+    assert 'r1' not in get_value(REQUEST_SCOPED_KEY)
+
+    # Another thread handling the same request id must still wait for the holder.
+    acquired = threading.Event()
+
+    def other():
+        with request_mutex('r1'):
+            acquired.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    assert not acquired.wait(0.2)
+
+    mutex.release()
+    thread.join(5)
+    assert acquired.is_set()
+    assert len(global_context._REQUEST_LOCKS) == 0
+
+
+def test_request_mutexes_are_not_evicted_with_request_scoped_entries(monkeypatch):
+    monkeypatch.setattr(global_context, 'MAX_REQUEST_SCOPED_ENTRIES', 2)
+
+    with request_mutex('held'):
+        for i in range(10):
+            get_value(REQUEST_SCOPED_KEY)[i] = i
+            with request_mutex(i):
+                pass
+
+        assert len(get_value(REQUEST_SCOPED_KEY)) == 2
+        assert list(global_context._REQUEST_LOCKS.locks) == ['held']
+
+    assert len(global_context._REQUEST_LOCKS) == 0
+
+
+def test_request_locks_are_dropped_only_when_nobody_waits():
+    locks = RequestLocks()
+    locks.acquire('r')
+
+    waiter = threading.Thread(target=lambda: (locks.acquire('r'), locks.release('r')))
+    waiter.start()
+    while locks.locks['r'][1] < 2:
+        time.sleep(0.01)
+
+    # The waiter still needs the mutex.
+    locks.release('r')
+    waiter.join(5)
+
+    assert not waiter.is_alive()
+    assert len(locks) == 0
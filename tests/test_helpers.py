@@ -0,0 +1,56 @@
+import threading
+
+from filibuster.global_context import get_value, set_request_scoped_map, request_mutex
+from filibuster.instrumentation.helpers import observe_test_epoch, _FILIBUSTER_VCLOCK_BY_REQUEST_KEY, \
+    _FILIBUSTER_EI_BY_REQUEST_KEY
+
+set_request_scoped_map(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
+set_request_scoped_map(_FILIBUSTER_EI_BY_REQUEST_KEY)
+
+# Test epochs only ever increase.
+_test_epochs = iter(range(1000, 2000))
+
+
+def test_new_test_epoch_resets_every_request():
+    observe_test_epoch(next(_test_epochs))
+    get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)['r1'] = 'vclock'
+    get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)[None] = 'execution index'
+
+    assert observe_test_epoch(next(_test_epochs))
+
+    assert len(get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)) == 0
+    assert len(get_value(_FILIBUSTER_EI_BY_REQUEST_KEY)) == 0
+
+
+def test_same_or_older_test_epoch_keeps_requests():
+    test_epoch = next(_test_epochs)
+    observe_test_epoch(test_epoch)
+    get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)['r1'] = 'vclock'
+
+    assert not observe_test_epoch(test_epoch)
+    assert not observe_test_epoch(test_epoch - 1)
+    assert not observe_test_epoch('None')
+
+    assert get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)['r1'] == 'vclock'
+
+
+def test_reset_waits_for_requests_being_updated():
+    get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)['r1'] = 'vclock'
+
+    done = threading.Event()
+
+    def reset():
+        observe_test_epoch(next(_test_epochs))
+        done.set()
+
+    with request_mutex('r1'):
+        thread = threading.Thread(target=reset)
+        thread.start()
+        assert not done.wait(0.2)
+
+        # Updated as the instrumentation would, holding the request's mutex.
+        get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)['r1'] = 'advanced vclock'
+
+    thread.join(5)
+    assert done.is_set()
+    assert 'r1' not in get_value(_FILIBUSTER_VCLOCK_BY_REQUEST_KEY)
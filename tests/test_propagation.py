@@ -0,0 +1,104 @@
+import uuid
+
+import pytest
+
+from filibuster.execution_index import execution_index_new, execution_index_push, execution_index_fromstring
+from filibuster.instrumentation.propagation import encode_context, decode_context, http_headers, \
+    from_http_headers, _legacy_values
+from filibuster.vclock import vclock_new, vclock_increment
+
+
+def _path_execution_index():
+    execution_index = execution_index_new()
+    execution_index = execution_index_push('a', execution_index)
+    execution_index = execution_index_push('b', execution_index)
+    return execution_index_push('b', execution_index)
+
+
+def _rolling_execution_index():
+    execution_index = execution_index_fromstring('00' * 16)
+    execution_index = execution_index_push('a', execution_index)
+    return execution_index_push('b', execution_index)
+
+
+def _vclock(*services):
+    vclock = vclock_new()
+    for service in services:
+        vclock = vclock_increment(vclock, service)
+    return vclock
+
+
+EXECUTION_INDEXES = {
+    'path': _path_execution_index(),
+    'rolling': _rolling_execution_index(),
+    'empty': execution_index_new(),
+}
+
+IDS = {
+    'uuid': str(uuid.uuid4()),
+    'uuid hex': uuid.uuid4().hex,
+    'string': 'request-1',
+    'none': None,
+}
+
+
+# The legacy headers send a missing value as 'None'.
+def _as_legacy(decoded):
+    return {field: 'None' if value is None else value for (field, value) in decoded.items()}
+
+
+@pytest.mark.parametrize('execution_index', EXECUTION_INDEXES.values(), ids=list(EXECUTION_INDEXES))
+@pytest.mark.parametrize('generated_id', IDS.values(), ids=list(IDS))
+@pytest.mark.parametrize('request_id', IDS.values(), ids=list(IDS))
+@pytest.mark.parametrize('test_epoch', [None, 3])
+def test_round_trip_matches_legacy_headers(execution_index, generated_id, request_id, test_epoch):
+    vclock = _vclock('test', 'a', 'b', 'b')
+    origin_vclock = _vclock('test', 'a')
+
+    encoded = encode_context(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, 2)
+
+    assert _as_legacy(decode_context(encoded)) == \
+        _legacy_values(generated_id, vclock, origin_vclock, execution_index, request_id, test_epoch, 2)
+
+
+def test_round_trip_with_empty_clocks_and_no_sleep():
+    encoded = encode_context(None, vclock_new(), vclock_new(), execution_index_new(), None, None)
+
+    assert _as_legacy(decode_context(encoded)) == \
+        _legacy_values(None, vclock_new(), vclock_new(), execution_index_new(), None, None, 0)
+
+
+def test_decoded_contexts_are_not_shared():
+    encoded = encode_context(uuid.uuid4().hex, _vclock('test', 'a'), _vclock('test'), _path_execution_index(),
+                             str(uuid.uuid4()), 1)
+
+    first = decode_context(encoded)
+    first['vclock'] = None
+
+    assert decode_context(encoded)['vclock'] is not None
+
+
+def test_http_headers_round_trip():
+    vclock = _vclock('test')
+    generated_id = str(uuid.uuid4())
+
+    headers = http_headers(generated_id, vclock, vclock_new(), _rolling_execution_index(), None, 5)
+    incoming = from_http_headers(headers)
+
+    assert incoming['generated_id'] == generated_id
+    assert incoming['test_epoch'] == '5'
+    assert incoming['request_id'] is None
+
+
+def test_legacy_headers_are_read_without_a_context_header():
+    headers = {'X-Filibuster-Generated-Id': '7', 'X-Filibuster-Test-Epoch': '2'}
+
+    incoming = from_http_headers(headers)
+
+    assert incoming['generated_id'] == '7'
+    assert incoming['test_epoch'] == '2'
+    assert incoming['execution_index'] is None
+
+
+def test_unknown_version_is_ignored():
+    assert decode_context(b'\x01') is None
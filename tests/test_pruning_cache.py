@@ -0,0 +1,47 @@
+from filibuster import datatypes
+from filibuster.pruning_cache import load_pruning_cache, save_pruning_cache
+
+
+def _ran(generated_id):
+    log = [{
+        'generated_id': generated_id,
+        'execution_index': 'a',
+        'module': 'requests',
+        'method': 'get',
+        'args': ['http://a'],
+        'kwargs': {},
+        'vclock': {'test': 1},
+        'origin_vclock': {},
+        'source_service_name': 'test',
+        'target_service_name': 'a',
+        'return_value': {'status_code': '200'},
+    }]
+    return datatypes.TestExecution(log, [], completed=True, retcon=[])
+
+
+def _cache(tmp_path):
+    analysis_file = tmp_path / 'analysis.json'
+    analysis_file.write_text('{}')
+    services_directory = tmp_path / 'services'
+    (services_directory / 'a').mkdir(parents=True)
+    (services_directory / 'a' / 'app.py').write_text('')
+    return str(tmp_path / 'cache.json'), str(analysis_file), str(services_directory)
+
+
+def test_cache_is_only_loaded_for_the_test_that_wrote_it(tmp_path):
+    (path, analysis_file, services_directory) = _cache(tmp_path)
+    save_pruning_cache(path, 'python3 test_a.py', analysis_file, services_directory, [_ran(0)])
+
+    assert load_pruning_cache(path, 'python3 test_b.py', analysis_file, services_directory) == []
+    assert load_pruning_cache(path, 'python3 test_a.py', analysis_file, services_directory) == [_ran(0)]
+
+
+def test_executions_ran_again_are_saved_once(tmp_path):
+    (path, analysis_file, services_directory) = _cache(tmp_path)
+
+    for generated_id in range(3):
+        history = load_pruning_cache(path, 'python3 test_a.py', analysis_file, services_directory)
+        save_pruning_cache(path, 'python3 test_a.py', analysis_file, services_directory,
+                           history + [_ran(generated_id)])
+
+    assert len(load_pruning_cache(path, 'python3 test_a.py', analysis_file, services_directory)) == 1
@@ -0,0 +1,179 @@
+import pytest
+
+from filibuster import datatypes
+from filibuster import reduce_dynamic
+from filibuster.reduce_dynamic import should_prune, outcomes_match, PruningPool, DeferredTestExecutions
+
+CONNECTION_ERROR = {'name': 'requests.exceptions.ConnectionError', 'metadata': {}}
+TIMEOUT = {'name': 'requests.exceptions.Timeout', 'metadata': {}}
+
+
+def _entry(generated_id, execution_index, vclock, origin_vclock, **outcome):
+    entry = {
+        'generated_id': generated_id,
+        'execution_index': execution_index,
+        'module': 'requests',
+        'method': 'get',
+        'args': ['http://' + execution_index],
+        'kwargs': {},
+        'vclock': vclock,
+        'origin_vclock': origin_vclock,
+        'source_service_name': 'test',
+    }
+    entry.update(outcome)
+    return entry
+
+
+# The test calls a, which calls b.
+def _log(b_outcome=None):
+    a = _entry(0, 'a', {'test': 1}, {}, return_value={'status_code': '200'})
+    if b_outcome is None:
+        return [a]
+    b = _entry(1, 'b', {'test': 1, 'a': 1}, {'test': 1}, **b_outcome)
+    return [a, b]
+
+
+def _ran(log, failures):
+    return datatypes.TestExecution(log, failures, completed=True, retcon=[])
+
+
+def _history():
+    return [
+        _ran(_log({'return_value': {'status_code': '200'}}), []),
+        _ran(_log({'exception': CONNECTION_ERROR}), [{'execution_index': 'b', 'forced_exception': CONNECTION_ERROR}]),
+    ]
+
+
+CANDIDATES = [
+    # Failing b as it was failed before.
+    (datatypes.TestExecution(_log({}), [{'execution_index': 'b', 'forced_exception': CONNECTION_ERROR}]), True),
+    # Failing b with an exception it wasn't failed with before.
+    (datatypes.TestExecution(_log({}), [{'execution_index': 'b', 'forced_exception': TIMEOUT}]), False),
+    # Failing a, which was never failed.
+    (datatypes.TestExecution(_log(), [{'execution_index': 'a', 'forced_exception': CONNECTION_ERROR}]), False),
+]
+
+
+@pytest.fixture(scope='module')
+def pruning_pool():
+    pool = PruningPool(2)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize('candidate,expected', CANDIDATES)
+def test_should_prune(candidate, expected):
+    assert should_prune(candidate, _history()) == expected
+
+
+@pytest.mark.parametrize('candidate,expected', CANDIDATES)
+def test_pruning_pool_matches_in_process(pruning_pool, candidate, expected):
+    history = _history()
+    assert pruning_pool.should_prune(candidate, history) == should_prune(candidate, history) == expected
+
+
+def test_pruning_pool_sees_history_added_later():
+    (candidate, _) = CANDIDATES[0]
+    full_history = _history()
+    history = full_history[:1]
+
+    pool = PruningPool(2)
+    try:
+        assert pool.should_prune(candidate, history) == should_prune(candidate, history) is False
+        history.append(full_history[1])
+        assert pool.should_prune(candidate, history) == should_prune(candidate, history) is True
+    finally:
+        pool.shutdown()
+
+
+def test_pruning_pool_falls_back_when_a_worker_dies():
+    pool = PruningPool(2)
+    try:
+        pool.workers[0].terminate()
+        pool.workers[0].join()
+
+        for (candidate, expected) in CANDIDATES:
+            assert pool.should_prune(candidate, _history()) == expected
+        assert pool.failed
+    finally:
+        pool.shutdown()
+
+
+def test_outcomes_match_sees_entries_mutated_after_matching():
+    (candidate, _) = CANDIDATES[0]
+    previously_ran = dict(_history()[1].response_log[1])
+
+    assert outcomes_match(candidate, previously_ran)
+
+    previously_ran['forced_exception'] = TIMEOUT
+    assert not outcomes_match(candidate, previously_ran)
+
+
+def test_outcomes_are_memoized_across_candidates(monkeypatch):
+    monkeypatch.setattr(reduce_dynamic, '_outcome_matches', reduce_dynamic.OrderedDict())
+
+    compared = []
+    _outcomes_match = reduce_dynamic._outcomes_match
+
+    def counting_outcomes_match(current_test_execution, scheduled_request, failure, previously_ran_completed_request):
+        compared.append(previously_ran_completed_request['execution_index'])
+        return _outcomes_match(current_test_execution, scheduled_request, failure, previously_ran_completed_request)
+
+    monkeypatch.setattr(reduce_dynamic, '_outcomes_match', counting_outcomes_match)
+
+    signed = []
+    entry_signature = datatypes.TestExecution.entry_signature
+
+    def counting_entry_signature(entry):
+        signed.append(entry)
+        return entry_signature(entry)
+
+    monkeypatch.setattr(datatypes.TestExecution, 'entry_signature', staticmethod(counting_entry_signature))
+
+    history = _history()
+    ((first, first_expected), (second, second_expected)) = CANDIDATES[:2]
+
+    assert should_prune(first, history) == first_expected
+    assert 'a' in compared
+
+    compared.clear()
+    signed.clear()
+    assert should_prune(second, history) == second_expected
+
+    # Only the outcomes of the request failed differently are compared again, and only the candidate's
+    # own requests and failures are signed: the history's were signed once.
+    assert set(compared) == {'b'}
+    assert len(signed) == 2 * len(second.log)
+
+
+# The test calls a and c independently.
+def _independent_log(first_generated_id=0):
+    return [
+        _entry(first_generated_id, 'a', {'test': 1}, {}),
+        _entry(first_generated_id + 1, 'c', {'test': 2}, {}),
+    ]
+
+
+def test_deferred_test_executions_are_deferred_once_until_released():
+    both = [{'execution_index': 'a', 'forced_exception': CONNECTION_ERROR},
+            {'execution_index': 'c', 'forced_exception': CONNECTION_ERROR}]
+    deferred = DeferredTestExecutions()
+
+    assert not deferred.should_defer(datatypes.TestExecution(_independent_log(), both[:1]))
+
+    test_execution = datatypes.TestExecution(_independent_log(), both)
+    assert deferred.should_defer(test_execution)
+    deferred.defer(test_execution)
+
+    # Generated again, with other generated ids, before the deferred executions are released.
+    generated_again = datatypes.TestExecution(_independent_log(10), both)
+    assert generated_again in deferred
+    assert not deferred.should_defer(generated_again)
+
+    assert deferred.release() == [test_execution]
+    assert len(deferred) == 0
+    assert generated_again not in deferred
+
+    # Once released, it runs or is pruned like any other test execution.
+    assert not deferred.should_defer(generated_again)
+    assert deferred.num_released() == 1
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+
+from filibuster import control_plane
+from filibuster.instrumentation import reporter
+
+
+class SlowServer:
+    def __init__(self, delay):
+        self.delay = delay
+        self.events = []
+        self.mutex = threading.Lock()
+
+    def post(self, url, json=None):
+        time.sleep(self.delay)
+        with self.mutex:
+            self.events.extend(json)
+        return control_plane.ControlPlaneResponse(200, b'{}')
+
+
+# Fails the first failures calls (all of them, if None.)
+class FailingServer(SlowServer):
+    def __init__(self, failures=None):
+        super().__init__(0)
+        self.failures = failures
+        self.calls = 0
+
+    def post(self, url, json=None):
+        self.calls += 1
+        if self.failures is None or self.calls <= self.failures:
+            raise ConnectionResetError()
+        return super().post(url, json=json)
+
+
+def test_report_does_not_flush_on_an_event_loop(monkeypatch):
+    server = SlowServer(0.5)
+    monkeypatch.setattr(control_plane, 'post', server.post)
+    monkeypatch.setattr(reporter, 'MAX_QUEUE_SIZE', 1)
+    batch_reporter = reporter.BatchReporter('http://filibuster')
+
+    async def handler():
+        start = time.monotonic()
+        for i in range(3):
+            batch_reporter.report({'event': i})
+        return time.monotonic() - start
+
+    assert asyncio.run(handler()) < 0.5
+
+    batch_reporter.flush()
+    assert server.events == [{'event': i} for i in range(3)]
+
+
+def test_report_flushes_when_full_off_an_event_loop(monkeypatch):
+    server = SlowServer(0)
+    monkeypatch.setattr(control_plane, 'post', server.post)
+    monkeypatch.setattr(reporter, 'MAX_QUEUE_SIZE', 1)
+    batch_reporter = reporter.BatchReporter('http://filibuster')
+
+    batch_reporter.report({'event': 0})
+
+    assert server.events == [{'event': 0}]
+
+
+def test_report_async_waits_for_the_flush_off_the_event_loop(monkeypatch):
+    server = SlowServer(0.2)
+    monkeypatch.setattr(control_plane, 'post', server.post)
+    monkeypatch.setattr(reporter, 'MAX_QUEUE_SIZE', 1)
+
+    async def handler():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        await reporter.report_async('http://filibuster-async', {'event': 0})
+        ticker.cancel()
+        return ticks
+
+    # The loop kept running while the event was delivered.
+    assert asyncio.run(handler()) > 5
+    assert server.events == [{'event': 0}]
+
+
+def test_flush_request_only_waits_for_the_requests_own_events(monkeypatch):
+    server = SlowServer(0)
+    monkeypatch.setattr(control_plane, 'post', server.post)
+    batch_reporter = reporter.BatchReporter('http://filibuster')
+
+    token = reporter.track_request()
+    try:
+        batch_reporter.report({'event': 'mine'})
+        reporter.flush_request()
+        assert server.events == [{'event': 'mine'}]
+
+        # Another request's event is still being delivered.
+        server.delay = 0.5
+        other = threading.Thread(target=batch_reporter.report, args=({'event': 'other'},))
+        other.start()
+        other.join()
+
+        start = time.monotonic()
+        reporter.flush_request()
+        assert time.monotonic() - start < 0.5
+    finally:
+        reporter.untrack_request(token)
+
+    batch_reporter.flush()
+    assert server.events == [{'event': 'mine'}, {'event': 'other'}]
+
+
+def test_failed_batches_are_sent_again_in_order(monkeypatch):
+    server = FailingServer(failures=2)
+    monkeypatch.setattr(control_plane, 'post', server.post)
+    monkeypatch.setattr(reporter, 'REPORT_RETRY_INTERVAL', 0)
+    batch_reporter = reporter.BatchReporter('http://filibuster')
+
+    with batch_reporter.send_mutex:
+        for i in range(3):
+            batch_reporter.enqueue({'event': i})
+
+    assert batch_reporter.flush()
+    assert server.events == [{'event': i} for i in range(3)]
+
+
+def test_flush_tells_callers_about_events_given_up_on(monkeypatch):
+    server = FailingServer()
+    monkeypatch.setattr(control_plane, 'post', server.post)
+    monkeypatch.setattr(reporter, 'REPORT_RETRY_INTERVAL', 0)
+    batch_reporter = reporter.BatchReporter('http://filibuster')
+
+    token = reporter.track_request()
+    try:
+        batch_reporter.report({'event': 'lost'})
+        assert not reporter.flush_request()
+    finally:
+        reporter.untrack_request(token)
+
+    assert server.calls == reporter.MAX_REPORT_ATTEMPTS
+    assert not batch_reporter.flush()
+
+    # Events reported after the server came back were delivered.
+    server.failures = 0
+    batch_reporter.report({'event': 'delivered'})
+    assert batch_reporter.flush()
+    assert server.events == [{'event': 'delivered'}]
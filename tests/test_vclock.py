@@ -0,0 +1,78 @@
+import os
+import pickle
+import subprocess
+import sys
+
+from filibuster.vclock import VClock, vclock_new, vclock_increment, vclock_merge, vclock_descends, vclock_equals, \
+    vclock_tostring, vclock_fromstring, vclock_todict
+
+
+def _clock(**counts):
+    clock = vclock_new()
+    for (actor, count) in counts.items():
+        for i in range(count):
+            clock = vclock_increment(clock, actor)
+    return clock
+
+
+def test_increment_returns_a_new_clock():
+    clock = _clock(a=1)
+    incremented = vclock_increment(clock, 'a')
+
+    assert vclock_todict(clock) == {'a': 1}
+    assert vclock_todict(incremented) == {'a': 2}
+
+
+def test_merge_takes_the_maximum_of_each_service():
+    merged = vclock_merge(_clock(a=2, b=1), _clock(b=3, c=1))
+
+    assert vclock_todict(merged) == {'a': 2, 'b': 3, 'c': 1}
+    assert vclock_merge(_clock(b=3, c=1), _clock(a=2, b=1)) == merged
+    assert vclock_merge({'a': 1}, _clock(a=2)) == {'a': 2}
+
+
+def test_descends():
+    assert vclock_descends(_clock(a=1), _clock(a=2))
+    assert vclock_descends(_clock(a=1), _clock(a=1, b=1))
+    assert vclock_descends(vclock_new(), {'a': 1})
+
+    # Equal and concurrent clocks don't descend each other.
+    assert not vclock_descends(_clock(a=1), _clock(a=1))
+    assert not vclock_descends(_clock(a=1, b=1), _clock(a=2))
+    assert not vclock_descends(_clock(a=2), _clock(a=1, b=1))
+
+
+def test_equals_ignores_services_never_incremented():
+    assert vclock_equals(_clock(a=1, b=2), {'b': 2, 'a': 1})
+    assert vclock_equals(_clock(a=1), {'a': 1, 'b': 0})
+    assert vclock_equals(vclock_new(), {})
+
+    assert not vclock_equals(_clock(a=1), _clock(a=2))
+    assert not vclock_equals(_clock(a=1), _clock(a=1, b=1))
+
+
+def test_string_round_trip():
+    clock = _clock(a=1, b=2)
+    serialized = vclock_tostring(clock)
+
+    assert vclock_fromstring(serialized) == clock
+    assert vclock_fromstring(vclock_tostring(vclock_new())) == vclock_new()
+    assert vclock_tostring(vclock_fromstring('{"a": 1}')) == '{"a": 1}'
+
+
+def test_pickles_by_service_name():
+    clock = _clock(a=1, b=2)
+    unpickled = pickle.loads(pickle.dumps(clock))
+
+    assert isinstance(unpickled, VClock)
+    assert unpickled == clock
+
+    # Another process (e.g. the shared state server) interns services in another order.
+    unpickled_elsewhere = subprocess.run(
+        [sys.executable, '-c',
+         'import pickle, sys; from filibuster.vclock import vclock_new, vclock_increment, vclock_tostring; '
+         'vclock_increment(vclock_new(), "b"); print(vclock_tostring(pickle.loads(sys.stdin.buffer.read())))'],
+        input=pickle.dumps(clock), capture_output=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+
+    assert vclock_fromstring(unpickled_elsewhere.decode()) == clock